@@ -0,0 +1,187 @@
+import argparse
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, Optional, Sequence
+from sqlalchemy import case, delete, func, insert, select, union_all
+from sqlalchemy.orm import Session, aliased
+import config
+import models
+import pagination
+
+# Archivage des cycles clos : paiements et tours des cycles terminés quittent les tables chaudes pour
+# paiements_archive / tours_archive. Les index chauds ne grossissent plus avec l'historique.
+#   python archivage.py run [--dry-run] [--tontine ID]
+# Les lectures qui couvrent des périodes archivées réunissent table chaude et archive (UNION ALL).
+
+# Cycles complets gardés dans les tables chaudes, en plus du cycle en cours (le générateur de tours relit le dernier)
+ARCHIVE_CYCLES_CONSERVES = int(os.getenv("ARCHIVE_CYCLES_CONSERVES", 1))
+# Tontines archivées par transaction
+ARCHIVE_TAILLE_LOT = int(os.getenv("ARCHIVE_TAILLE_LOT", 500))
+
+ARCHIVES = {models.Paiement: models.PaiementArchive, models.Tour: models.TourArchive}
+
+# --- Lectures ---
+
+# Dernière période archivée par tontine (absente = rien d'archivé)
+def limites(db: Session, tontine_ids: Iterable[int]) -> Dict[int, int]:
+    A = models.ArchiveTontine.__table__
+    tontine_ids = list(tontine_ids)
+    if not tontine_ids:
+        return {}
+    return dict(db.execute(select(A.c.id_tontine, A.c.periode_archivee).where(A.c.id_tontine.in_(tontine_ids))).all())
+
+def limite(db: Session, tontine_id: int) -> int:
+    archive = db.get(models.ArchiveTontine, tontine_id)
+    return archive.periode_archivee if archive is not None else 0
+
+# Table chaude + archive en une sous-requête aux mêmes colonnes, chaque branche filtrée par filtre(table)
+def union(modele, filtre: Callable = lambda table: ()):
+    return union_all(*(
+        select(table).where(*filtre(table)) for table in (modele.__table__, ARCHIVES[modele].__table__)
+    )).subquery(modele.__tablename__)
+
+# Liste paginée par id : table chaude seule, ou réunie à l'archive si `archive`.
+# Chaque branche est déjà triée et coupée à `limit` : la fusion ne lit que 2 × limit lignes.
+# `champs` : lignes réduites à ces colonnes plutôt qu'instances ORM (serialisation.FAST_LIST_RESPONSES)
+def lire(db: Session, modele, filtre: Callable, apres=None, limit=None, archive: bool = True,
+         champs: Optional[Sequence[str]] = None):
+    def entites(source):
+        return [getattr(source, nom) for nom in champs] if champs else [source]
+    if not archive:
+        query = db.query(*entites(modele)).filter(*filtre(modele.__table__))
+        return pagination.keyset(query, (modele.id,), apres, limit).all()
+    branches = [
+        pagination.keyset(select(table).where(*filtre(table)), (table.c.id,), apres, limit).subquery()
+        for table in (modele.__table__, ARCHIVES[modele].__table__)
+    ]
+    # Ids d'origine conservés à l'archivage : les instances restent uniques dans la session
+    entite = aliased(modele, union_all(*(select(branche) for branche in branches)).subquery(modele.__tablename__))
+    return pagination.keyset(db.query(*entites(entite)), (entite.id,), None, limit).all()
+
+# Cotisations archivées par (tontine, membre), à ajouter aux sommes lues dans la table chaude
+def cotisations_archivees(db: Session, tontine_ids: Iterable[int], utilisateur_id: Optional[int] = None) -> Dict[int, Dict[int, int]]:
+    C = models.CotisationArchivee.__table__
+    tontine_ids = list(tontine_ids)
+    if not tontine_ids:
+        return {}
+    stmt = select(C.c.id_tontine, C.c.id_utilisateur, C.c.montant).where(C.c.id_tontine.in_(tontine_ids))
+    if utilisateur_id is not None:
+        stmt = stmt.where(C.c.id_utilisateur == utilisateur_id)
+    cumuls = defaultdict(dict)
+    for tid, uid, montant in db.execute(stmt):
+        cumuls[tid][uid] = int(montant)
+    return cumuls
+
+# --- Archivage ---
+
+# Nouvelle limite par tontine : fin du dernier cycle clos, moins les cycles conservés.
+# Un cycle dure autant de périodes que la tontine a de membres ; il est clos quand son dernier tour est servi
+# et que le calendrier l'a dépassé (des tours générés d'avance ne font pas archiver le cycle en cours).
+def a_archiver(db: Session, tontine_ids: Optional[Iterable[int]] = None, jour: Optional[date] = None) -> Dict[int, int]:
+    import scheduler
+    jour = jour or date.today()
+    T, M, R = models.Tontine.__table__, models.Membre.__table__, models.Tour.__table__
+    derniers = select(R.c.id_tontine, func.max(R.c.periode)).group_by(R.c.id_tontine)
+    effectifs = select(M.c.id_tontine, func.count(M.c.id)).group_by(M.c.id_tontine)
+    if tontine_ids is not None:
+        tontine_ids = list(tontine_ids)
+        derniers = derniers.where(R.c.id_tontine.in_(tontine_ids))
+        effectifs = effectifs.where(M.c.id_tontine.in_(tontine_ids))
+    derniers = dict(db.execute(derniers).all())
+    effectifs = dict(db.execute(effectifs).all())
+    calendriers = {
+        t.id: t for t in db.execute(select(T.c.id, T.c.frequence, T.c.date_demarrage).where(T.c.id.in_(list(derniers))))
+    } if derniers else {}
+    actuelles = limites(db, derniers)
+    cibles = {}
+    for tid, derniere in derniers.items():
+        n, tontine = effectifs.get(tid), calendriers.get(tid)
+        if not n or tontine is None:
+            continue
+        courante = scheduler.periode_courante(tontine.frequence, tontine.date_demarrage, jour)
+        cycles_clos = min(derniere // n, max(courante - 1, 0) // n)
+        nouvelle = (cycles_clos - ARCHIVE_CYCLES_CONSERVES) * n
+        if nouvelle > actuelles.get(tid, 0):
+            cibles[tid] = nouvelle
+    return cibles
+
+def _archiver_lot(db: Session, cibles: Dict[int, int], volumes: Dict[str, int]):
+    ids = list(cibles)
+    # Une seule requête par table pour tout le lot : la limite de chaque tontine est choisie par CASE
+    def condition(table):
+        return (table.c.id_tontine.in_(ids), table.c.periode <= case(cibles, value=table.c.id_tontine))
+
+    P = models.Paiement.__table__
+    sommes = db.execute(
+        select(P.c.id_tontine, P.c.id_utilisateur, func.sum(P.c.montant))
+        .where(*condition(P)).group_by(P.c.id_tontine, P.c.id_utilisateur)
+    ).all()
+
+    for modele, archive in ARCHIVES.items():
+        table = modele.__table__
+        db.execute(insert(archive.__table__).from_select([c.name for c in table.c], select(table).where(*condition(table))))
+        volumes[table.name] += db.execute(delete(table).where(*condition(table))).rowcount
+
+    cumuls = {
+        (c.id_tontine, c.id_utilisateur): c for c in
+        db.query(models.CotisationArchivee).filter(models.CotisationArchivee.id_tontine.in_(ids))
+    }
+    for tid, uid, total in sommes:
+        cumul = cumuls.get((tid, uid))
+        if cumul is None:
+            db.add(models.CotisationArchivee(id_tontine=tid, id_utilisateur=uid, montant=int(total or 0)))
+        else:
+            cumul.montant += int(total or 0)
+
+    existantes = {a.id_tontine: a for a in db.query(models.ArchiveTontine).filter(models.ArchiveTontine.id_tontine.in_(ids))}
+    maintenant = datetime.utcnow()
+    for tid, periode in cibles.items():
+        archive = existantes.get(tid)
+        if archive is None:
+            db.add(models.ArchiveTontine(id_tontine=tid, periode_archivee=periode, date_archivage=maintenant))
+        else:
+            archive.periode_archivee, archive.date_archivage = periode, maintenant
+
+# Déplace en masse les cycles clos vers les archives, une transaction par lot de tontines
+def archiver(db: Session, tontine_ids: Optional[Iterable[int]] = None, dry_run: bool = False,
+             jour: Optional[date] = None) -> dict:
+    cibles = a_archiver(db, tontine_ids, jour)
+    volumes = {"paiements": 0, "tours": 0}
+    if not dry_run:
+        ordre = sorted(cibles)
+        for debut in range(0, len(ordre), ARCHIVE_TAILLE_LOT):
+            _archiver_lot(db, {tid: cibles[tid] for tid in ordre[debut:debut + ARCHIVE_TAILLE_LOT]}, volumes)
+            db.commit()
+    return {
+        "dry_run": dry_run,
+        "tontines": len(cibles),
+        "paiements_archives": volumes["paiements"],
+        "tours_archives": volumes["tours"],
+        "limites": cibles,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archivage des cycles clos (paiements et tours)")
+    parser.add_argument("commande", choices=["run"])
+    parser.add_argument("--tontine", type=int, action="append", help="Limiter à une tontine (répétable)")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Date de référence (défaut : aujourd'hui)")
+    parser.add_argument("--dry-run", action="store_true", help="Affiche les tontines à archiver sans rien déplacer")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        resultat = archiver(db, args.tontine, args.dry_run, args.date)
+    finally:
+        db.close()
+    if args.dry_run:
+        print(f"⏭️  {resultat['tontines']} tontine(s) à archiver (dry-run)")
+    else:
+        print(f"✅ {resultat['tontines']} tontine(s) archivée(s) : {resultat['paiements_archives']} paiement(s), "
+              f"{resultat['tours_archives']} tour(s) déplacés")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,43 +1,57 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
+import time
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-import crud
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud_async
 import os
-from dotenv import load_dotenv # <--- 1. Import nécessaire
-from database import get_db
+import revocation
+import hashing
+import config # <--- 1. Charge le fichier .env (une seule fois pour toute l'application)
+from database import get_async_db
 
-# <--- 2. Chargement du fichier .env
-load_dotenv()
-
-# <--- 3. Récupération des variables sécurisées
+# <--- 2. Récupération des variables sécurisées
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256") # Valeur par défaut "HS256" si non trouvé
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30)) # Conversion en int() obligatoire !
+# Mode sans état : l'utilisateur courant est construit depuis les claims du jeton, sans requête SQL
+STATELESS_AUTH = os.getenv("STATELESS_AUTH", "False").lower() in ("1", "true", "yes")
 
 # Sécurité : On vérifie que la clé secrète existe bien
 if not SECRET_KEY:
     raise ValueError("❌ Erreur critique : La variable SECRET_KEY est absente du fichier .env")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = hashing.pwd_context
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Utilisateur courant reconstruit depuis le jeton (mode STATELESS_AUTH)
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    telephone: str
+    role: str
+
 # Fonctions utilitaires
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return hashing.verify_and_update(plain_password, hashed_password)[0]
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return hashing.hash_password(password)
 
-def authenticate_user(db: Session, telephone: str, password: str):
-    utilisateur = crud.get_utilisateur_by_telephone(db, telephone)
+async def authenticate_user(db: AsyncSession, telephone: str, password: str):
+    utilisateur = await crud_async.get_utilisateur_by_telephone(db, telephone)
     if not utilisateur:
         return False
-    if not verify_password(password, utilisateur.mot_de_passe):
+    # bcrypt tourne dans le pool de hachage, pas sur la boucle d'événements
+    valide, nouveau_hash = await hashing.verify_and_update_async(password, utilisateur.mot_de_passe)
+    if not valide:
         return False
+    if nouveau_hash:
+        # Hash produit avec un ancien coût bcrypt : on le remplace de façon transparente
+        await crud_async.update_mot_de_passe_utilisateur(db, utilisateur, nouveau_hash)
     return utilisateur
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -46,12 +60,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES) # Utilise la variable convertie
-    to_encode.update({"exp": expire})
+    # iat reste un entier (RFC 7519) ; iat_ms donne l'instant d'émission à la milliseconde pour la révocation
+    maintenant = time.time()
+    to_encode.update({"exp": expire, "iat": int(maintenant), "iat_ms": int(maintenant * 1000)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 # Dépendances d'authentification
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -62,15 +78,35 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         telephone: str = payload.get("sub")
         if telephone is None:
             raise credentials_exception
-        token_data = {"telephone": telephone}
     except JWTError:
         raise credentials_exception
-    utilisateur = crud.get_utilisateur_by_telephone(db, telephone=telephone)
+
+    # Jetons émis avant une suppression ou un changement de rôle : refusés dans les deux modes
+    uid = payload.get("uid")
+    # Jeton sans iat_ms : iat entier, donc refusé aussi s'il a été émis dans la seconde de la révocation
+    emis_le = payload["iat_ms"] / 1000 if "iat_ms" in payload else payload.get("iat", 0)
+    if uid is not None and await revocation.est_revoque_async(uid, emis_le):
+        raise credentials_exception
+
+    if STATELESS_AUTH and uid is not None and payload.get("role"):
+        return Principal(id=uid, telephone=telephone, role=payload["role"])
+
+    utilisateur = await crud_async.get_utilisateur_by_telephone(db, telephone=telephone)
     if utilisateur is None:
         raise credentials_exception
     return utilisateur
 
-async def get_current_active_user(current_user = Depends(get_current_user)):
+async def get_current_active_user(current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    # En mode sans état, les routes qui renvoient le profil complet chargent la ligne en base
+    if isinstance(current_user, Principal):
+        utilisateur = await crud_async.get_utilisateur(db, utilisateur_id=current_user.id)
+        if utilisateur is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return utilisateur
     return current_user
 
 # Vérification des rôles
@@ -0,0 +1,472 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+from typing import Dict, List
+
+# Banc de charge en processus : l'application FastAPI est appelée via httpx (ASGI), sans serveur ni réseau.
+# Exemple :
+#   DATABASE_URL=sqlite:///bench.db python seed.py
+#   DATABASE_URL=sqlite:///bench.db python benchmark.py --sortie resultats.json --comparer reference.json
+
+SCENARIOS = ("login", "mes_tontines", "statistiques", "paiements")
+
+def percentile(valeurs: List[float], p: float) -> float:
+    # Rang le plus proche, sur des valeurs déjà triées
+    if not valeurs:
+        return 0.0
+    rang = max(0, min(len(valeurs) - 1, math.ceil(p / 100 * len(valeurs)) - 1))
+    return valeurs[rang]
+
+def resumer(durees: List[float], erreurs: int, duree_totale: float) -> dict:
+    durees = sorted(durees)
+    ms = lambda s: round(s * 1000, 3)
+    return {
+        "requetes": len(durees),
+        "erreurs": erreurs,
+        "debit": round(len(durees) / duree_totale, 1) if duree_totale else 0.0,
+        "moyenne_ms": ms(sum(durees) / len(durees)) if durees else 0.0,
+        "p50_ms": ms(percentile(durees, 50)),
+        "p95_ms": ms(percentile(durees, 95)),
+        "p99_ms": ms(percentile(durees, 99)),
+    }
+
+# Démarrage à froid d'un worker, dans un processus neuf : import de l'application puis première réponse
+# de /readyz (connexion à la base et préchauffage du pool). Les imports du client HTTP ne sont pas comptés.
+SCRIPT_DEMARRAGE = """
+import asyncio, json, time
+import httpx
+debut = time.perf_counter()
+from main import app
+importe = time.perf_counter()
+async def sonder():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        return (await client.get("/readyz")).status_code
+statut = asyncio.run(sonder())
+fin = time.perf_counter()
+print(json.dumps({"import_ms": (importe - debut) * 1000, "readyz_ms": (fin - importe) * 1000, "statut": statut}))
+"""
+
+def mesurer_demarrage(repetitions: int) -> dict:
+    mesures = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        sortie = subprocess.run([sys.executable, "-c", SCRIPT_DEMARRAGE], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+        mesure = json.loads(sortie.strip().splitlines()[-1])
+        if mesure["statut"] != 200:
+            raise RuntimeError(f"/readyz a répondu {mesure['statut']} au démarrage")
+        mesure["processus_ms"] = (time.perf_counter() - debut) * 1000
+        mesures.append(mesure)
+    # Médiane de chaque étape sur les répétitions
+    return {
+        cle: round(statistics.median(m[cle] for m in mesures), 1)
+        for cle in ("import_ms", "readyz_ms", "processus_ms")
+    }
+
+# Effet de l'historique : base temporaire semée avec 1 puis `facteur` cycles clos par tontine, requêtes du
+# cycle en cours mesurées avant et après archivage. Archivées, elles doivent rester stables quand l'historique grossit.
+REQUETES_CHAUDES = ("paiements_cycle", "paiement_existe", "situation_cycle", "planifier", "creer_paiement")
+
+def _mesurer_requetes_chaudes(db, rng: random.Random, adhesions, membres: int, periodes: int,
+                              repetitions: int, jour: date) -> dict:
+    import crud
+    import models
+    import scheduler
+    import schemas
+    import situation
+    debut_cycle = (periodes - 1) // membres * membres + 1
+    tontines = {t.id: t for t in db.query(models.Tontine)}
+    appels = {
+        "paiements_cycle": lambda tid, uid, i: crud.get_paiements_by_tontine(db, tid, limit=101, periode_min=debut_cycle),
+        "paiement_existe": lambda tid, uid, i: crud.paiement_existe(db, tid, uid, periodes),
+        "situation_cycle": lambda tid, uid, i: situation.situation_tontines(
+            db, [tontines[tid]], jour, periode_min=debut_cycle, detail=False),
+        "planifier": lambda tid, uid, i: scheduler.planifier(db, jour, [tid]),
+        "creer_paiement": lambda tid, uid, i: crud.create_paiement(
+            db, schemas.PaiementCreate(id_tontine=tid, montant=500, periode=10_000 + i), uid),
+    }
+    mesures = {}
+    for nom, appel in appels.items():
+        durees = []
+        for i in range(repetitions):
+            tid, uid = rng.choice(adhesions)
+            debut = time.perf_counter()
+            appel(tid, uid, i)
+            durees.append(time.perf_counter() - debut)
+            db.rollback()
+        mesures[nom] = round(statistics.median(durees) * 1000, 3)
+    return mesures
+
+def mesurer_historique(facteur: int, tontines: int = 20, membres: int = 10, repetitions: int = 200,
+                       graine: int = 42) -> dict:
+    import tempfile
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    import archivage
+    import migrations
+    import models
+    import seed
+
+    jour = date.today()
+    resultats = {}
+    for cycles in sorted({1, facteur}):
+        # Période courante au milieu d'un cycle : `cycles` cycles clos derrière elle
+        periodes = cycles * membres + membres // 2
+        with tempfile.TemporaryDirectory() as dossier:
+            moteur = create_engine(f"sqlite:///{dossier}/historique.db")
+            migrations.upgrade(moteur, verbose=False)
+            db = Session(bind=moteur)
+            try:
+                volumes = seed.generer(db, membres * 3, tontines, membres, periodes, 1.0, graine, jour)
+                adhesions = db.query(models.Membre.id_tontine, models.Membre.id_utilisateur).all()
+                mesure = {"paiements": volumes["paiements"], "tours": volumes["tours"]}
+                mesure["sans_archivage"] = _mesurer_requetes_chaudes(
+                    db, random.Random(graine), adhesions, membres, periodes, repetitions, jour)
+                archive = archivage.archiver(db, jour=jour)
+                mesure["paiements_archives"] = archive["paiements_archives"]
+                mesure["avec_archivage"] = _mesurer_requetes_chaudes(
+                    db, random.Random(graine), adhesions, membres, periodes, repetitions, jour)
+            finally:
+                db.close()
+                moteur.dispose()
+        resultats[str(cycles)] = mesure
+        for mode in ("sans_archivage", "avec_archivage"):
+            print(f"  ×{cycles:<4} {mode:<15} " + "  ".join(f"{nom} {mesure[mode][nom]} ms" for nom in REQUETES_CHAUDES))
+    return resultats
+
+# Chemin rapide des listes : une même page de `lignes` paiements servie par l'application avec puis sans
+# FAST_LIST_RESPONSES, sur une base temporaire. Les deux corps doivent être identiques octet pour octet.
+def mesurer_listes(lignes: int = 10_000, repetitions: int = 20, graine: int = 42) -> dict:
+    import tempfile
+    import httpx
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    import database
+    import migrations
+    import models
+    import pagination
+    import seed
+    import serialisation
+    from main import app
+
+    membres = 100
+    with tempfile.TemporaryDirectory() as dossier:
+        moteur = create_engine(f"sqlite:///{dossier}/listes.db")
+        migrations.upgrade(moteur, verbose=False)
+        db = Session(bind=moteur)
+        try:
+            seed.generer(db, membres + 1, 1, membres, -(-lignes // membres), 1.0, graine)
+            tontine_id = db.query(models.Tontine.id).scalar()
+        finally:
+            db.close()
+
+        def session_temporaire():
+            db = Session(bind=moteur)
+            try:
+                yield db
+            finally:
+                db.close()
+
+        async def servir(rapide: bool):
+            serialisation.FAST_LIST_RESPONSES = rapide
+            durees, corps = [], None
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+                for _ in range(repetitions + 1):
+                    debut = time.perf_counter()
+                    reponse = await client.get(f"/tontines/{tontine_id}/paiements", params={"limit": lignes})
+                    durees.append(time.perf_counter() - debut)
+                    corps = reponse.content
+            # Premier appel (préparation des adaptateurs, cache du plan) non compté
+            return round(statistics.median(durees[1:]) * 1000, 1), corps
+
+        etat = (pagination.MAX_PAGE_SIZE, serialisation.FAST_LIST_RESPONSES)
+        pagination.MAX_PAGE_SIZE = lignes
+        app.dependency_overrides[database.get_db_lecture] = session_temporaire
+        try:
+            standard_ms, standard = asyncio.run(servir(False))
+            rapide_ms, rapide = asyncio.run(servir(True))
+        finally:
+            pagination.MAX_PAGE_SIZE, serialisation.FAST_LIST_RESPONSES = etat
+            app.dependency_overrides.pop(database.get_db_lecture, None)
+            moteur.dispose()
+    if standard != rapide:
+        raise RuntimeError("Chemin rapide : le JSON diffère de celui de response_model")
+    resultat = {"lignes": lignes, "standard_ms": standard_ms, "rapide_ms": rapide_ms,
+                "acceleration": round(standard_ms / rapide_ms, 2) if rapide_ms else 0.0}
+    print(f"  {lignes} paiements : standard {standard_ms} ms, rapide {rapide_ms} ms (×{resultat['acceleration']})")
+    return resultat
+
+# Adhésions simultanées (crud.rejoindre_tontine) sur une base temporaire : `candidats` utilisateurs dont
+# `doublons` rejoignent deux fois, avec une capacité inférieure puis supérieure au nombre de candidats.
+# Lève une erreur si la capacité est dépassée, si une position est dupliquée ou si un doublon est accepté.
+def verifier_adhesions(candidats: int = 300, doublons: int = 50, capacite: int = 50, threads: int = 32) -> dict:
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import create_engine, func, insert
+    from sqlalchemy.orm import Session
+    import crud
+    import migrations
+    import models
+    import schemas
+    import statistiques
+
+    resultat = {}
+    with tempfile.TemporaryDirectory() as dossier:
+        moteur = create_engine(f"sqlite:///{dossier}/adhesions.db", connect_args={"timeout": 30})
+        migrations.upgrade(moteur, verbose=False)
+        with moteur.begin() as conn:
+            conn.execute(insert(models.Utilisateur.__table__), [
+                {"nom_utilisateur": f"adherent{i}", "telephone": f"78{i:07d}", "email": f"adherent{i}@exemple.com",
+                 "mot_de_passe": "-", "role": "membre"} for i in range(1, candidats + 1)
+            ])
+
+        def rejoindre(tontine_id: int, utilisateur_id: int):
+            db = Session(bind=moteur)
+            try:
+                return crud.rejoindre_tontine(db, tontine_id, utilisateur_id, date.today())[1]
+            finally:
+                db.close()
+
+        for plafond in (capacite, candidats + doublons):
+            db = Session(bind=moteur)
+            try:
+                tontine = crud.create_tontine(db, schemas.TontineCreate(
+                    nom="Adhésions simultanées", montant_cotisation=1000, frequence="mensuel", mode_rotation="ordre",
+                    nombre_max_membres=plafond, date_demarrage=date.today()), 1)
+                tontine_id = tontine.id
+            finally:
+                db.close()
+            demandes = list(range(1, candidats + 1)) + list(range(1, doublons + 1))
+            random.Random(plafond).shuffle(demandes)
+            with ThreadPoolExecutor(threads) as pool:
+                erreurs = list(pool.map(lambda uid: rejoindre(tontine_id, uid), demandes))
+
+            db = Session(bind=moteur)
+            try:
+                positions = sorted(p for (p,) in db.query(models.Membre.position).filter(models.Membre.id_tontine == tontine_id))
+                adherents = db.query(func.count(func.distinct(models.Membre.id_utilisateur))).filter(
+                    models.Membre.id_tontine == tontine_id).scalar()
+                derives = statistiques.verifier_statistiques(db, [tontine_id])
+            finally:
+                db.close()
+            attendus = min(plafond, candidats)
+            if len(positions) != attendus or adherents != attendus or positions != list(range(1, attendus + 1)):
+                raise RuntimeError(f"Adhésions incohérentes (capacité {plafond}) : {len(positions)} membres, "
+                                   f"{adherents} utilisateurs distincts, attendus {attendus}")
+            if derives:
+                raise RuntimeError(f"Compteurs de statistiques faux après les adhésions : {derives}")
+            repartition = {cle or "ok": erreurs.count(cle) for cle in set(erreurs)}
+            resultat[f"capacite_{plafond}"] = repartition
+            print(f"  capacité {plafond} : {len(demandes)} demandes simultanées -> {repartition}")
+        moteur.dispose()
+    return resultat
+
+class Contexte:
+    # Comptes et identifiants tirés de la base semée, choisis avec une graine fixe
+    def __init__(self, graine: int):
+        import models
+        import seed
+        from auth import create_access_token
+        from database import SessionLocal
+
+        self.rng = random.Random(graine)
+        self.mot_de_passe = seed.MOT_DE_PASSE
+        db = SessionLocal()
+        try:
+            self.tresoriers = [
+                (u.id, u.telephone) for u in db.query(models.Utilisateur.id, models.Utilisateur.telephone)
+                .filter(models.Utilisateur.role == "trésorier").order_by(models.Utilisateur.id).limit(200)
+            ]
+            self.adhesions = [
+                (m.id_utilisateur, m.id_tontine) for m in db.query(models.Membre.id_utilisateur, models.Membre.id_tontine)
+                .order_by(models.Membre.id).limit(5000)
+            ]
+            comptes = {
+                u.id: (u.telephone, u.role) for u in db.query(models.Utilisateur.id, models.Utilisateur.telephone, models.Utilisateur.role)
+                .filter(models.Utilisateur.id.in_({uid for uid, _ in self.adhesions}))
+            }
+            self.tontines = [tid for (tid,) in db.query(models.Tontine.id).order_by(models.Tontine.id).limit(5000)]
+        finally:
+            db.close()
+        if not self.tresoriers or not self.adhesions:
+            raise SystemExit("❌ Base vide : lancez d'abord seed.py")
+
+        # Jetons émis comme /login, sans payer bcrypt à la préparation
+        def jeton(uid, tel, role):
+            return create_access_token({"sub": tel, "role": role, "uid": uid})
+        self.jetons_tresoriers = [jeton(uid, tel, "trésorier") for uid, tel in self.tresoriers]
+        self.jetons_membres = {uid: jeton(uid, *comptes[uid]) for uid, _ in self.adhesions}
+        self.periode = 10_000
+
+    def requete(self, scenario: str):
+        rng = self.rng
+        if scenario == "login":
+            _, tel = rng.choice(self.tresoriers)
+            return "POST", "/login", {"json": {"telephone": tel, "mot_de_passe": self.mot_de_passe}}
+        if scenario == "mes_tontines":
+            return "GET", "/tontines/mes-tontines", {"headers": _bearer(rng.choice(self.jetons_tresoriers))}
+        if scenario == "statistiques":
+            return "GET", f"/tontines/{rng.choice(self.tontines)}/statistiques", {"headers": _bearer(rng.choice(self.jetons_tresoriers))}
+        if scenario == "paiements":
+            uid, tid = rng.choice(self.adhesions)
+            # Périodes hors de la plage semée : pas de collision avec les données existantes
+            self.periode += 1
+            return "POST", "/paiements", {
+                "json": {"id_tontine": tid, "montant": 500, "periode": self.periode},
+                "headers": _bearer(self.jetons_membres[uid]),
+            }
+        raise ValueError(scenario)
+
+def _bearer(jeton: str) -> dict:
+    return {"Authorization": f"Bearer {jeton}"}
+
+async def executer_scenario(client, contexte: Contexte, scenario: str, requetes: int, concurrence: int,
+                            echauffement: int) -> dict:
+    for _ in range(echauffement):
+        methode, url, options = contexte.requete(scenario)
+        await client.request(methode, url, **options)
+
+    durees, erreurs = [], 0
+    restantes = requetes
+
+    async def travailleur():
+        nonlocal restantes, erreurs
+        while restantes > 0:
+            restantes -= 1
+            methode, url, options = contexte.requete(scenario)
+            debut = time.perf_counter()
+            reponse = await client.request(methode, url, **options)
+            durees.append(time.perf_counter() - debut)
+            if reponse.status_code >= 400:
+                erreurs += 1
+
+    debut = time.perf_counter()
+    await asyncio.gather(*(travailleur() for _ in range(concurrence)))
+    return resumer(durees, erreurs, time.perf_counter() - debut)
+
+async def executer(scenarios, requetes: int, concurrence: int, echauffement: int, graine: int) -> dict:
+    import httpx
+    from main import app
+
+    contexte = Contexte(graine)
+    resultats = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for scenario in scenarios:
+            # Le login est borné par bcrypt : moins de requêtes pour garder un temps de run raisonnable
+            n = max(1, requetes // 10) if scenario == "login" else requetes
+            resultats[scenario] = await executer_scenario(client, contexte, scenario, n, concurrence, echauffement)
+            print(f"  {scenario:<14} {resultats[scenario]['debit']:>8} req/s  "
+                  f"p50 {resultats[scenario]['p50_ms']:>8} ms  p95 {resultats[scenario]['p95_ms']:>8} ms  "
+                  f"p99 {resultats[scenario]['p99_ms']:>8} ms  erreurs {resultats[scenario]['erreurs']}")
+    return resultats
+
+def comparer(resultats: Dict[str, dict], reference: Dict[str, dict], tolerance: float) -> List[str]:
+    # Régression : p95 plus lent ou débit plus faible que la référence au-delà de la tolérance
+    regressions = []
+    for scenario, mesure in resultats.items():
+        base = reference.get(scenario)
+        if not base:
+            continue
+        if base["p95_ms"] and mesure["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{scenario} : p95 {base['p95_ms']} -> {mesure['p95_ms']} ms")
+        if base["debit"] and mesure["debit"] < base["debit"] * (1 - tolerance):
+            regressions.append(f"{scenario} : débit {base['debit']} -> {mesure['debit']} req/s")
+        if mesure["erreurs"] > base.get("erreurs", 0):
+            regressions.append(f"{scenario} : erreurs {base.get('erreurs', 0)} -> {mesure['erreurs']}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure débit et latences (p50/p95/p99) des routes principales")
+    parser.add_argument("--database-url", default=None, help="Base semée par seed.py (défaut : DATABASE_URL)")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requetes", type=int, default=1000, help="Requêtes par scénario")
+    parser.add_argument("--concurrence", type=int, default=20, help="Clients simultanés")
+    parser.add_argument("--echauffement", type=int, default=20, help="Requêtes non mesurées avant chaque scénario")
+    parser.add_argument("--graine", type=int, default=42)
+    parser.add_argument("--group-commit", choices=["on", "off"], default=None,
+                        help="Force le mode group commit des paiements (défaut : GROUP_COMMIT)")
+    parser.add_argument("--demarrages", type=int, default=3,
+                        help="Démarrages à froid mesurés dans un processus neuf (0 = désactivé)")
+    parser.add_argument("--historique", type=int, default=0,
+                        help="Mesure les requêtes chaudes avec 1 puis N cycles d'historique, avant et après archivage (0 = désactivé)")
+    parser.add_argument("--listes", type=int, default=0,
+                        help="Mesure une liste de N paiements avec et sans FAST_LIST_RESPONSES (0 = désactivé)")
+    parser.add_argument("--adhesions", type=int, default=0,
+                        help="Vérifie N adhésions simultanées à une même tontine (0 = désactivé)")
+    parser.add_argument("--sortie", default=None, help="Fichier JSON des résultats")
+    parser.add_argument("--comparer", default=None, help="Fichier JSON de référence")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Écart toléré avant de signaler une régression")
+    args = parser.parse_args(argv)
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    if args.group_commit:
+        os.environ["GROUP_COMMIT"] = str(args.group_commit == "on")
+
+    demarrage = None
+    if args.demarrages:
+        demarrage = mesurer_demarrage(args.demarrages)
+        print(f"🧊 Démarrage à froid : import {demarrage['import_ms']} ms, /readyz {demarrage['readyz_ms']} ms, "
+              f"processus {demarrage['processus_ms']} ms (médiane sur {args.demarrages})")
+
+    historique = None
+    if args.historique:
+        print(f"📚 Requêtes chaudes (p50) selon l'historique, ×1 puis ×{args.historique} cycles clos")
+        historique = mesurer_historique(args.historique, graine=args.graine)
+
+    listes = None
+    if args.listes:
+        print(f"📜 Réponse de {args.listes} lignes (médiane de 20 appels)")
+        listes = mesurer_listes(args.listes, graine=args.graine)
+
+    adhesions = None
+    if args.adhesions:
+        print(f"🤝 {args.adhesions} adhésions simultanées (capacité, positions, doublons)")
+        adhesions = verifier_adhesions(args.adhesions)
+
+    print(f"🏁 {args.requetes} requêtes par scénario, {args.concurrence} clients simultanés")
+    resultats = asyncio.run(executer(args.scenarios, args.requetes, args.concurrence, args.echauffement, args.graine))
+
+    from database import get_engine
+    rapport = {
+        "date": datetime.utcnow().isoformat(timespec="seconds"),
+        "parametres": {k: v for k, v in vars(args).items() if k not in ("sortie", "comparer", "database_url")},
+        "environnement": {
+            "python": platform.python_version(),
+            "plateforme": platform.platform(),
+            "base": get_engine().dialect.name,
+            "group_commit": os.getenv("GROUP_COMMIT", "False"),
+        },
+        "demarrage": demarrage,
+        "historique": historique,
+        "listes": listes,
+        "adhesions": adhesions,
+        "resultats": resultats,
+    }
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as f:
+            json.dump(rapport, f, indent=2, ensure_ascii=False)
+        print(f"💾 Résultats enregistrés dans {args.sortie}")
+
+    if args.comparer:
+        with open(args.comparer, encoding="utf-8") as f:
+            reference = json.load(f)["resultats"]
+        regressions = comparer(resultats, reference, args.tolerance)
+        for regression in regressions:
+            print(f"❌ Régression {regression}")
+        if regressions:
+            return 1
+        print("✅ Aucune régression par rapport à la référence")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Tuple, get_args
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+import config
+import pagination
+import serialisation
+
+# Durée de vie d'une réponse en cache (secondes) ; filet de sécurité en plus de l'invalidation par étiquette
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", 60))
+# Nombre maximal de réponses conservées en mémoire (éviction LRU au-delà)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+# Cache partagé entre workers (ex : redis://localhost:6379/1). Vide = mémoire du processus
+CACHE_BACKEND_URL = os.getenv("CACHE_BACKEND_URL", "")
+
+# En-têtes de la réponse d'origine rejoués depuis le cache
+EN_TETES_CONSERVES = (pagination.NEXT_CURSOR_HEADER, "Link")
+
+# Entrée : (corps JSON, ETag, en-têtes conservés)
+Entree = Tuple[bytes, str, dict]
+
+
+# Cache LRU + TTL en mémoire du processus, avec index étiquette -> clés pour l'invalidation
+class MemoryCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entrees = OrderedDict()  # clé -> (expire, entrée, étiquettes)
+        self._etiquettes = {}          # étiquette -> ensemble de clés
+        self._generations = {}         # étiquette -> nombre d'invalidations
+        self._lock = threading.Lock()
+
+    def get(self, cle: str) -> Optional[Entree]:
+        with self._lock:
+            valeur = self._entrees.get(cle)
+            if valeur is None:
+                return None
+            expire, entree, _ = valeur
+            if expire < time.monotonic():
+                self._retirer(cle)
+                return None
+            self._entrees.move_to_end(cle)
+            return entree
+
+    def generations(self, etiquettes: Iterable[str]) -> tuple:
+        with self._lock:
+            return tuple(self._generations.get(etiquette, 0) for etiquette in etiquettes)
+
+    # generations : relevées avant le calcul ; l'entrée n'est pas stockée si une étiquette a été invalidée depuis
+    def set(self, cle: str, entree: Entree, etiquettes: Iterable[str], generations: Optional[tuple] = None):
+        etiquettes = tuple(etiquettes)
+        with self._lock:
+            if generations is not None and generations != tuple(self._generations.get(e, 0) for e in etiquettes):
+                return
+            self._retirer(cle)
+            self._entrees[cle] = (time.monotonic() + self.ttl, entree, etiquettes)
+            for etiquette in etiquettes:
+                self._etiquettes.setdefault(etiquette, set()).add(cle)
+            while len(self._entrees) > self.max_entries:
+                self._retirer(next(iter(self._entrees)))
+
+    def invalidate(self, *etiquettes: str):
+        with self._lock:
+            for etiquette in etiquettes:
+                self._generations[etiquette] = self._generations.get(etiquette, 0) + 1
+                for cle in self._etiquettes.pop(etiquette, ()):
+                    self._retirer(cle)
+
+    def clear(self):
+        with self._lock:
+            self._entrees.clear()
+            self._etiquettes.clear()
+            self._generations.clear()
+
+    def _retirer(self, cle: str):
+        valeur = self._entrees.pop(cle, None)
+        if valeur is None:
+            return
+        for etiquette in valeur[2]:
+            cles = self._etiquettes.get(etiquette)
+            if cles is not None:
+                cles.discard(cle)
+                if not cles:
+                    del self._etiquettes[etiquette]
+
+
+# Cache partagé via Redis : une clé expirante par réponse, un ensemble Redis par étiquette
+class RedisCache:
+    def __init__(self, url: str, ttl: int = CACHE_TTL_SECONDS, prefix: str = "tontine:cache:"):
+        import json
+        import redis  # dépendance optionnelle, uniquement si CACHE_BACKEND_URL est défini
+        self.json = json
+        self.redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, cle: str) -> Optional[Entree]:
+        valeur = self.client.get(self.prefix + cle)
+        if valeur is None:
+            return None
+        en_tete, corps = valeur.split(b"\n", 1)
+        etag, en_tetes = self.json.loads(en_tete)
+        return corps, etag, en_tetes
+
+    def generations(self, etiquettes: Iterable[str]) -> tuple:
+        cles = [f"{self.prefix}gen:{etiquette}" for etiquette in etiquettes]
+        return tuple(int(v or 0) for v in self.client.mget(cles)) if cles else ()
+
+    def set(self, cle: str, entree: Entree, etiquettes: Iterable[str], generations: Optional[tuple] = None):
+        etiquettes = tuple(etiquettes)
+        corps, etag, en_tetes = entree
+        compteurs = [f"{self.prefix}gen:{etiquette}" for etiquette in etiquettes]
+        with self.client.pipeline() as pipe:
+            try:
+                if generations is not None and compteurs:
+                    # WATCH : une invalidation entre la comparaison et l'écriture annule la transaction
+                    pipe.watch(*compteurs)
+                    if tuple(int(v or 0) for v in pipe.mget(compteurs)) != generations:
+                        return
+                pipe.multi()
+                pipe.set(self.prefix + cle, self.json.dumps([etag, en_tetes]).encode() + b"\n" + corps, ex=self.ttl)
+                for etiquette in etiquettes:
+                    pipe.sadd(f"{self.prefix}tag:{etiquette}", cle)
+                    pipe.expire(f"{self.prefix}tag:{etiquette}", self.ttl)
+                pipe.execute()
+            except self.redis.WatchError:
+                pass
+
+    def invalidate(self, *etiquettes: str):
+        for etiquette in etiquettes:
+            # Génération incrémentée d'abord : un calcul en cours ne pourra plus stocker son résultat
+            self.client.incr(f"{self.prefix}gen:{etiquette}")
+            cles = self.client.smembers(f"{self.prefix}tag:{etiquette}")
+            pipe = self.client.pipeline()
+            for cle in cles:
+                pipe.delete(self.prefix + cle.decode())
+            pipe.delete(f"{self.prefix}tag:{etiquette}")
+            pipe.execute()
+
+    def clear(self):
+        for cle in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(cle)
+
+
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        if CACHE_BACKEND_URL:
+            _cache = RedisCache(CACHE_BACKEND_URL)
+        else:
+            _cache = MemoryCache()
+    return _cache
+
+def set_cache(cache):
+    global _cache
+    _cache = cache
+
+# --- Étiquettes : une par ressource, invalidées par les écritures de crud.py ---
+
+def tag_tontines() -> str:
+    return "tontines"
+
+def tag_tontine(tontine_id: int) -> str:
+    return f"tontine:{tontine_id}"
+
+def tag_membres(tontine_id: int) -> str:
+    return f"membres:{tontine_id}"
+
+def tag_tours(tontine_id: int) -> str:
+    return f"tours:{tontine_id}"
+
+def invalider(*etiquettes: str):
+    get_cache().invalidate(*etiquettes)
+
+# --- Réponses HTTP ---
+
+_adaptateurs = {}
+
+def _serialiser(modele, valeur) -> bytes:
+    if serialisation.est_lignes(valeur):
+        # Lignes réduites aux colonnes du schéma (FAST_LIST_RESPONSES) : encodées sans validation
+        return serialisation.encoder(get_args(modele)[0], valeur)
+    # Validation pydantic faite une seule fois, au remplissage du cache
+    adaptateur = _adaptateurs.get(modele)
+    if adaptateur is None:
+        adaptateur = _adaptateurs[modele] = TypeAdapter(modele)
+    return adaptateur.dump_json(adaptateur.validate_python(valeur, from_attributes=True))
+
+def _cle(request: Request) -> str:
+    parametres = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return f"{request.method}:{request.url.path}?{parametres}"
+
+def _correspond(request: Request, etag: str) -> bool:
+    # If-None-Match : comparaison faible (RFC 9110), liste séparée par des virgules ou "*"
+    valeur = request.headers.get("if-none-match")
+    if not valeur:
+        return False
+    candidats = [v.strip().removeprefix("W/") for v in valeur.split(",")]
+    return "*" in candidats or etag in candidats
+
+def reponse(request: Request, response: Response, etiquettes: Iterable[str], modele, calculer: Callable) -> Response:
+    cache = get_cache()
+    cle = _cle(request)
+    entree = cache.get(cle)
+    if entree is None:
+        etiquettes = tuple(etiquettes)
+        # Générations relevées avant la lecture : une écriture validée pendant le calcul invalide ses étiquettes,
+        # le résultat (peut-être antérieur à l'écriture) est alors renvoyé sans être mis en cache
+        generations = cache.generations(etiquettes)
+        # calculer() peut lever une HTTPException (404) : rien n'est mis en cache dans ce cas
+        corps = _serialiser(modele, calculer())
+        etag = '"' + hashlib.sha256(corps).hexdigest()[:32] + '"'
+        en_tetes = {nom: response.headers[nom] for nom in EN_TETES_CONSERVES if nom in response.headers}
+        entree = (corps, etag, en_tetes)
+        cache.set(cle, entree, etiquettes, generations)
+
+    corps, etag, en_tetes = entree
+    en_tetes = {**en_tetes, "ETag": etag, "Cache-Control": "no-cache"}
+    if _correspond(request, etag):
+        return Response(status_code=304, headers=en_tetes)
+    return Response(content=corps, media_type="application/json", headers=en_tetes)
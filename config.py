@@ -0,0 +1,5 @@
+from dotenv import load_dotenv
+
+# Chargement unique du fichier .env pour toute l'application : les modules font `import config`
+# avant de lire leurs variables (le module n'est exécuté qu'une fois par processus)
+load_dotenv()
@@ -1,28 +1,58 @@
-from typing import List
+import os
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import Date, bindparam, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
 import models
 import schemas
-from passlib.context import CryptContext
+import revocation
+import cache
+import hashing
+import statistiques
+import pagination
+import idempotence
+import shards
+import archivage
+import serialisation
+import evenements
 from datetime import date, datetime
+import config
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Une seule cotisation par membre et par période (index unique posé par la migration 6 si activé)
+PAIEMENT_UNIQUE_PAR_PERIODE = os.getenv("PAIEMENT_UNIQUE_PAR_PERIODE", "False").lower() in ("1", "true", "yes")
+# Essais d'une adhésion qui perd la course sur uq_membres_tontine_position avant de répondre 409
+ADHESION_TENTATIVES = int(os.getenv("ADHESION_TENTATIVES", 3))
+
+# Clés de tri de la pagination par curseur (colonnes uniques ou départagées par l'id)
+CLE_UTILISATEURS = (models.Utilisateur.id,)
+CLE_TONTINES = (models.Tontine.id,)
+CLE_MEMBRES = (models.Membre.id,)
+CLE_PAIEMENTS = (models.Paiement.id,)  # id croissant = ordre de versement (date_versement = now() à l'insertion)
+CLE_TOURS = (models.Tour.id,)
+
+# Listes en chemin rapide (lignes=True) : seules les colonnes du schéma de réponse, en tuples, sans instances ORM
+def _entites(modele, schema, lignes: bool):
+    return serialisation.colonnes(schema, modele) if lignes else [modele]
 
 # CRUD Utilisateur
+# Comptes supprimés (date_suppression) : invisibles pour l'API, conservés pour l'historique des tontines
+_ACTIF = models.Utilisateur.date_suppression.is_(None)
+
 def get_utilisateur(db: Session, utilisateur_id: int):
-    return db.query(models.Utilisateur).filter(models.Utilisateur.id == utilisateur_id).first()
+    return db.query(models.Utilisateur).filter(models.Utilisateur.id == utilisateur_id, _ACTIF).first()
 
 def get_utilisateur_by_telephone(db: Session, telephone: str):
-    return db.query(models.Utilisateur).filter(models.Utilisateur.telephone == telephone).first()
+    return db.query(models.Utilisateur).filter(models.Utilisateur.telephone == telephone, _ACTIF).first()
 
 def get_utilisateur_by_email(db: Session, email: str):
-    return db.query(models.Utilisateur).filter(models.Utilisateur.email == email).first()
+    return db.query(models.Utilisateur).filter(models.Utilisateur.email == email, _ACTIF).first()
 
-def get_utilisateurs(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Utilisateur).offset(skip).limit(limit).all()
+def get_utilisateurs(db: Session, apres=None, limit: int = 100, lignes: bool = False):
+    query = db.query(*_entites(models.Utilisateur, schemas.Utilisateur, lignes)).filter(_ACTIF)
+    return pagination.keyset(query, CLE_UTILISATEURS, apres, limit).all()
 
 def create_utilisateur(db: Session, utilisateur: schemas.UtilisateurCreate):
-    hashed_password = pwd_context.hash(utilisateur.mot_de_passe)
+    hashed_password = hashing.hash_password(utilisateur.mot_de_passe)
     db_utilisateur = models.Utilisateur(
         nom_utilisateur=utilisateur.nom_utilisateur,
         telephone=utilisateur.telephone,
@@ -39,26 +69,70 @@ def authenticate_utilisateur(db: Session, telephone: str, mot_de_passe: str):
     utilisateur = get_utilisateur_by_telephone(db, telephone)
     if not utilisateur:
         return False
-    if not pwd_context.verify(mot_de_passe, utilisateur.mot_de_passe):
+    valide, nouveau_hash = hashing.verify_and_update(mot_de_passe, utilisateur.mot_de_passe)
+    if not valide:
         return False
+    if nouveau_hash:
+        update_mot_de_passe_utilisateur(db, utilisateur, nouveau_hash)
     return utilisateur
 
-def delete_utilisateur(db: Session, utilisateur_id: int):
-    db_obj = db.query(models.Utilisateur).filter(models.Utilisateur.id == utilisateur_id).first()
-    if db_obj:
-        db.delete(db_obj)
+def update_mot_de_passe_utilisateur(db: Session, db_utilisateur: models.Utilisateur, hashed_password: str):
+    db_utilisateur.mot_de_passe = hashed_password
+    db.commit()
+    db.refresh(db_utilisateur)
+    return db_utilisateur
+
+def update_role_utilisateur(db: Session, utilisateur_id: int, role: str):
+    db_utilisateur = db.query(models.Utilisateur).filter(models.Utilisateur.id == utilisateur_id).first()
+    if db_utilisateur and db_utilisateur.role != role:
+        db_utilisateur.role = role
         db.commit()
-    return db_obj
+        db.refresh(db_utilisateur)
+        # Le rôle est porté par le jeton : on invalide les jetons déjà émis
+        revocation.revoquer_utilisateur(utilisateur_id)
+    return db_utilisateur
+
+# Suppression = compte désactivé et anonymisé : ses paiements et tours restent dans le grand livre des tontines
+# (compteurs inchangés), seules ses adhésions sont retirées (positions resserrées). Refusée tant qu'il gère
+# des tontines : les autres membres en dépendent.
+def delete_utilisateur(db: Session, utilisateur_id: int):
+    db_obj = get_utilisateur(db, utilisateur_id)
+    if db_obj is None:
+        return None, "introuvable"
+    if db.query(models.Tontine.id).filter(models.Tontine.id_tresorier == utilisateur_id).first():
+        return None, "tresorier"
+    M = models.Membre
+    positions = dict(db.query(M.id_tontine, M.position).filter(M.id_utilisateur == utilisateur_id).all())
+    db.query(M).filter(M.id_utilisateur == utilisateur_id).delete(synchronize_session=False)
+    _resserrer_positions(db, positions)
+    incrementer_statistiques_groupes(db, "membres_actifs", {tid: -1 for tid in positions})
+
+    db.query(models.Idempotence).filter(models.Idempotence.id_utilisateur == utilisateur_id).delete(synchronize_session=False)
+    # Identifiants uniques remplacés : plus de connexion possible, le téléphone et l'email redeviennent libres
+    db_obj.nom_utilisateur = f"utilisateur_supprime_{utilisateur_id}"
+    db_obj.telephone = f"supprime:{utilisateur_id}"
+    db_obj.email = f"supprime-{utilisateur_id}@utilisateur.invalid"
+    db_obj.mot_de_passe = "!"
+    db_obj.role = "membre"
+    db_obj.date_suppression = datetime.utcnow()
+    db.commit()
+    revocation.revoquer_utilisateur(utilisateur_id)
+    cache.invalider(*(tag(tid) for tid in positions for tag in (cache.tag_tontine, cache.tag_membres)))
+    return db_obj, None
 
 # CRUD Tontine
 def get_tontine(db: Session, tontine_id: int):
     return db.query(models.Tontine).filter(models.Tontine.id == tontine_id).first()
 
-def get_tontines(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Tontine).offset(skip).limit(limit).all()
+@shards.en_parallele(lambda t: t.id)
+def get_tontines(db: Session, apres=None, limit: int = 100, lignes: bool = False):
+    query = db.query(*_entites(models.Tontine, schemas.Tontine, lignes))
+    return pagination.keyset(query, CLE_TONTINES, apres, limit).all()
 
-def get_tontines_by_tresorier(db: Session, tresorier_id: int):
-    return db.query(models.Tontine).filter(models.Tontine.id_tresorier == tresorier_id).all()
+@shards.en_parallele(lambda t: t.id)
+def get_tontines_by_tresorier(db: Session, tresorier_id: int, apres=None, limit=None, lignes: bool = False):
+    query = db.query(*_entites(models.Tontine, schemas.Tontine, lignes)).filter(models.Tontine.id_tresorier == tresorier_id)
+    return pagination.keyset(query, CLE_TONTINES, apres, limit).all()
 
 def create_tontine(db: Session, tontine: schemas.TontineCreate, tresorier_id: int):
     db_tontine = models.Tontine(
@@ -66,15 +140,33 @@ def create_tontine(db: Session, tontine: schemas.TontineCreate, tresorier_id: in
         id_tresorier=tresorier_id
     )
     db.add(db_tontine)
+    db.flush()
+    db.add(models.StatistiqueTontine(id_tontine=db_tontine.id))
     db.commit()
+    cache.invalider(cache.tag_tontines())
     db.refresh(db_tontine)
     return db_tontine
 
+# Tables rattachées à une tontine, vidées avant elle. Pas de ON DELETE en base : les shards n'ont pas de clé
+# étrangère vers utilisateurs et SQLite ne les applique pas par défaut ; la cascade est faite par la couche crud.
+TABLES_TONTINE = (models.Paiement, models.Tour, models.Membre, models.StatistiqueTontine, models.PaiementArchive,
+                  models.TourArchive, models.ArchiveTontine, models.CotisationArchivee)
+
+# Un DELETE ensembliste par table, sans charger les lignes filles (100k paiements = une instruction)
+def _supprimer_tontines(db: Session, tontine_ids: List[int]):
+    if not tontine_ids:
+        return
+    for modele in TABLES_TONTINE:
+        db.query(modele).filter(modele.id_tontine.in_(tontine_ids)).delete(synchronize_session=False)
+    db.query(models.Tontine).filter(models.Tontine.id.in_(tontine_ids)).delete(synchronize_session=False)
+
 def delete_tontine(db: Session, tontine_id: int):
-    db_obj = db.query(models.Tontine).filter(models.Tontine.id == tontine_id).first()
+    db_obj = get_tontine(db, tontine_id)
     if db_obj:
-        db.delete(db_obj)
+        _supprimer_tontines(db, [tontine_id])
         db.commit()
+        cache.invalider(cache.tag_tontines(), cache.tag_tontine(tontine_id),
+                        cache.tag_membres(tontine_id), cache.tag_tours(tontine_id))
     return db_obj
 
 def update_tontine(db: Session, tontine_id: int, tontine_update: schemas.TontineCreate):
@@ -83,6 +175,7 @@ def update_tontine(db: Session, tontine_id: int, tontine_update: schemas.Tontine
         for key, value in tontine_update.dict().items():
             setattr(db_tontine, key, value)
         db.commit()
+        cache.invalider(cache.tag_tontines(), cache.tag_tontine(tontine_id))
         db.refresh(db_tontine)
     return db_tontine
 
@@ -90,8 +183,9 @@ def update_tontine(db: Session, tontine_id: int, tontine_update: schemas.Tontine
 def get_membre(db: Session, membre_id: int):
     return db.query(models.Membre).filter(models.Membre.id == membre_id).first()
 
-def get_membres_by_tontine(db: Session, tontine_id: int):
-    return db.query(models.Membre).filter(models.Membre.id_tontine == tontine_id).all()
+def get_membres_by_tontine(db: Session, tontine_id: int, apres=None, limit=None, lignes: bool = False):
+    query = db.query(*_entites(models.Membre, schemas.Membre, lignes)).filter(models.Membre.id_tontine == tontine_id)
+    return pagination.keyset(query, CLE_MEMBRES, apres, limit).all()
 
 def get_membre_by_user_tontine(db: Session, utilisateur_id: int, tontine_id: int):
     return db.query(models.Membre).filter(
@@ -102,78 +196,356 @@ def get_membre_by_user_tontine(db: Session, utilisateur_id: int, tontine_id: int
 def add_membre(db: Session, membre: schemas.MembreCreate):
     db_membre = models.Membre(**membre.dict())
     db.add(db_membre)
+    db.flush()
+    incrementer_statistiques(db, db_membre.id_tontine, membres_actifs=1)
     db.commit()
+    cache.invalider(cache.tag_membres(db_membre.id_tontine))
     db.refresh(db_membre)
+    evenements.membre(db_membre, "membre_ajoute")
     return db_membre
 
+# Adhésion atomique : contrôle de capacité et calcul de position dans le même INSERT ... SELECT.
+# Les index uniques de `membres` tranchent les courses restantes (doublon ou position déjà prise).
+# Coût : sans concurrence, deux allers-retours (INSERT ... SELECT [RETURNING], puis UPDATE des compteurs
+# et COMMIT ; un SELECT de plus sans RETURNING). Chaque course perdue ajoute ROLLBACK + SELECT et un nouvel
+# essai, au plus `tentatives` essais : au-delà, échec immédiat "conflit" (409, le client réessaie).
+def rejoindre_tontine(db: Session, tontine_id: int, utilisateur_id: int, date_adhesion: date,
+                      tentatives: Optional[int] = None):
+    membres = models.Membre.__table__
+    tontines = models.Tontine.__table__
+    existants = membres.alias("existants")
+    capacite = select(tontines.c.nombre_max_membres).where(tontines.c.id == tontine_id).scalar_subquery()
+    candidat = (
+        select(
+            literal(tontine_id), literal(utilisateur_id), literal(date_adhesion, Date),
+            func.coalesce(func.max(existants.c.position), 0) + 1,
+        )
+        .select_from(existants)
+        .where(existants.c.id_tontine == tontine_id)
+        .having(func.count(existants.c.id) < capacite)
+    )
+    stmt = insert(membres).from_select(["id_tontine", "id_utilisateur", "date_adhesion", "position"], candidat)
+    avec_returning = db.get_bind().dialect.insert_returning
+    if avec_returning:
+        stmt = stmt.returning(membres.c.id, membres.c.position)
+
+    for _ in range(tentatives or ADHESION_TENTATIVES):
+        try:
+            result = db.execute(stmt)
+            if avec_returning:
+                ligne = result.first()
+            elif result.rowcount:
+                ligne = db.execute(
+                    select(membres.c.id, membres.c.position).where(membres.c.id == result.lastrowid)
+                ).first()
+            else:
+                ligne = None
+            if ligne is None:
+                db.rollback()
+                # Aucune ligne insérée : tontine absente, déjà rejointe ou complète (chemin d'échec uniquement)
+                if get_tontine(db, tontine_id) is None:
+                    return None, "introuvable"
+                if get_membre_by_user_tontine(db, utilisateur_id, tontine_id):
+                    return None, "deja_membre"
+                return None, "complete"
+            incrementer_statistiques(db, tontine_id, membres_actifs=1)
+            db.commit()
+            cache.invalider(cache.tag_membres(tontine_id))
+            evenements.publier(tontine_id, "membre_ajoute", id=ligne.id, id_utilisateur=utilisateur_id, position=ligne.position)
+        except (IntegrityError, OperationalError):
+            db.rollback()
+            if get_membre_by_user_tontine(db, utilisateur_id, tontine_id):
+                return None, "deja_membre"
+            # Position prise par une adhésion concurrente (ou verrou mort) : on recommence
+            continue
+        return {
+            "id": ligne.id,
+            "id_tontine": tontine_id,
+            "id_utilisateur": utilisateur_id,
+            "position": ligne.position,
+            "date_adhesion": date_adhesion,
+        }, None
+    return None, "conflit"
+
 def count_membres_tontine(db: Session, tontine_id: int):
     return db.query(func.count(models.Membre.id)).filter(
         models.Membre.id_tontine == tontine_id
     ).scalar()
 
+# Positions suivant celle libérée décalées d'un cran, en deux UPDATE par tontine (executemany).
+# Aucun ordre de parcours n'est garanti sous uq_membres_tontine_position (MySQL sans ORDER BY, contrainte
+# vérifiée ligne à ligne ailleurs) : les positions passent d'abord en négatif (position - 1, signe inversé),
+# plage disjointe des positions existantes, puis reprennent leur signe.
+def _resserrer_positions(db: Session, liberees: Dict[int, int]):
+    if not liberees:
+        return
+    table = models.Membre.__table__
+    parametres = [{"tid": tid, "liberee": position} for tid, position in liberees.items()]
+    db.execute(
+        update(table)
+        .where(table.c.id_tontine == bindparam("tid"), table.c.position > bindparam("liberee"))
+        .values(position=1 - table.c.position),
+        parametres,
+    )
+    db.execute(
+        update(table)
+        .where(table.c.id_tontine == bindparam("tid"), table.c.position < 0)
+        .values(position=-table.c.position),
+        parametres,
+    )
+
 def remove_membre(db: Session, membre_id: int):
-    db_obj = db.query(models.Membre).filter(models.Membre.id == membre_id).first()
+    db_obj = get_membre(db, membre_id)
     if db_obj:
         db.delete(db_obj)
+        db.flush()
+        _resserrer_positions(db, {db_obj.id_tontine: db_obj.position})
+        incrementer_statistiques(db, db_obj.id_tontine, membres_actifs=-1)
         db.commit()
+        cache.invalider(cache.tag_membres(db_obj.id_tontine))
+        evenements.membre(db_obj, "membre_retire")
     return db_obj
 
 # CRUD Paiement
 def get_paiement(db: Session, paiement_id: int):
     return db.query(models.Paiement).filter(models.Paiement.id == paiement_id).first()
 
-def get_paiements_by_tontine(db: Session, tontine_id: int):
-    return db.query(models.Paiement).filter(models.Paiement.id_tontine == tontine_id).all()
+def _filtre_tontine(tontine_id: int, periode_min: Optional[int]):
+    def filtre(table):
+        conditions = [table.c.id_tontine == tontine_id]
+        if periode_min is not None:
+            conditions.append(table.c.periode >= periode_min)
+        return conditions
+    return filtre
 
-def get_paiements_by_utilisateur(db: Session, utilisateur_id: int):
-    return db.query(models.Paiement).filter(models.Paiement.id_utilisateur == utilisateur_id).all()
+# L'archive n'est lue que si la requête remonte jusqu'aux périodes archivées de la tontine
+def get_paiements_by_tontine(db: Session, tontine_id: int, apres=None, limit=None, periode_min: Optional[int] = None,
+                             lignes: bool = False):
+    archive = archivage.limite(db, tontine_id) >= (periode_min or 1)
+    return archivage.lire(db, models.Paiement, _filtre_tontine(tontine_id, periode_min), apres, limit, archive,
+                          serialisation.champs(schemas.Paiement) if lignes else None)
 
-def create_paiement(db: Session, paiement: schemas.PaiementCreate, utilisateur_id: int):
+def get_paiements_by_utilisateur(db: Session, utilisateur_id: int, apres=None, limit=None):
+    return archivage.lire(db, models.Paiement, lambda table: (table.c.id_utilisateur == utilisateur_id,), apres, limit)
+
+def paiement_existe(db: Session, tontine_id: int, utilisateur_id: int, periode: int) -> bool:
+    table = models.Paiement.__table__
+    if periode <= archivage.limite(db, tontine_id):
+        table = archivage.union(models.Paiement, lambda t: (t.c.id_tontine == tontine_id,))
+    return db.execute(select(table.c.id).where(
+        table.c.id_utilisateur == utilisateur_id,
+        table.c.id_tontine == tontine_id,
+        table.c.periode == periode,
+    ).limit(1)).first() is not None
+
+# Triplets (tontine, utilisateur, période) déjà payés parmi les candidats, archive comprise si une période
+# visée est archivée
+def paiements_existants(db: Session, tontine_ids, utilisateur_ids, periodes) -> set:
+    table = models.Paiement.__table__
+    if min(periodes) <= max(archivage.limites(db, tontine_ids).values(), default=0):
+        table = archivage.union(models.Paiement, lambda t: (t.c.id_tontine.in_(list(tontine_ids)),))
+    return set(db.execute(
+        select(table.c.id_tontine, table.c.id_utilisateur, table.c.periode).where(
+            table.c.id_tontine.in_(list(tontine_ids)),
+            table.c.id_utilisateur.in_(list(utilisateur_ids)),
+            table.c.periode.in_(list(periodes)),
+        )
+    ).tuples())
+
+# Renvoie None si la cotisation de la période existe déjà (PAIEMENT_UNIQUE_PAR_PERIODE)
+# ou si la même clé d'idempotence a été enregistrée entre-temps par une requête concurrente
+def create_paiement(db: Session, paiement: schemas.PaiementCreate, utilisateur_id: int,
+                    demande: Optional[idempotence.Demande] = None):
+    if PAIEMENT_UNIQUE_PAR_PERIODE and paiement_existe(db, paiement.id_tontine, utilisateur_id, paiement.periode):
+        return None
     db_paiement = models.Paiement(
         **paiement.dict(),
         id_utilisateur=utilisateur_id
     )
     db.add(db_paiement)
-    db.commit()
+    db.flush()
+    incrementer_statistiques(db, db_paiement.id_tontine, total_cotisations=db_paiement.montant)
+    if demande is not None:
+        # Réponse enregistrée dans la même transaction que le paiement
+        db.refresh(db_paiement)
+        corps = schemas.Paiement.model_validate(db_paiement).model_dump_json()
+        idempotence.enregistrer(db, demande, corps)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        if demande is None and not PAIEMENT_UNIQUE_PAR_PERIODE:
+            raise
+        return None
+    if demande is not None:
+        idempotence.memoriser(demande, corps)
     db.refresh(db_paiement)
+    evenements.paiement(db_paiement)
     return db_paiement
 
+# Import groupé : validation complète puis un seul INSERT multi-lignes et un seul commit
+def create_paiements_batch(
+    db: Session,
+    lignes: List[Optional[schemas.PaiementBatchItem]],
+    erreurs: Dict[int, str],
+    tresorier_id: Optional[int] = None,
+    atomique: bool = False,
+):
+    # lignes[i] vaut None si la ligne i n'a pas pu être lue ; son erreur est déjà dans `erreurs`
+    erreurs = dict(erreurs)
+    tontine_ids = {ligne.id_tontine for ligne in lignes if ligne is not None}
+    tontines = {
+        tid: id_tresorier for tid, id_tresorier in db.query(models.Tontine.id, models.Tontine.id_tresorier)
+        .filter(models.Tontine.id.in_(tontine_ids))
+    } if tontine_ids else {}
+    adhesions = set(
+        db.query(models.Membre.id_tontine, models.Membre.id_utilisateur)
+        .filter(models.Membre.id_tontine.in_(tontine_ids))
+    ) if tontine_ids else set()
+    # Cotisations déjà enregistrées pour les (tontine, membre, période) du lot, en une requête
+    deja_payes = set()
+    if PAIEMENT_UNIQUE_PAR_PERIODE and tontine_ids:
+        deja_payes = paiements_existants(
+            db, tontine_ids, {l.id_utilisateur for l in lignes if l is not None}, {l.periode for l in lignes if l is not None}
+        )
+
+    valides = []
+    for i, ligne in enumerate(lignes):
+        if ligne is None:
+            continue
+        if ligne.id_tontine not in tontines:
+            erreurs[i] = "Tontine non trouvée"
+        elif tresorier_id is not None and tontines[ligne.id_tontine] != tresorier_id:
+            erreurs[i] = "Tontine gérée par un autre trésorier"
+        elif (ligne.id_tontine, ligne.id_utilisateur) not in adhesions:
+            erreurs[i] = "Le payeur n'est pas membre de la tontine"
+        elif ligne.montant <= 0:
+            erreurs[i] = "Le montant doit être positif"
+        elif ligne.periode < 1:
+            erreurs[i] = "La période doit être supérieure ou égale à 1"
+        elif PAIEMENT_UNIQUE_PAR_PERIODE and (ligne.id_tontine, ligne.id_utilisateur, ligne.periode) in deja_payes:
+            erreurs[i] = "Cotisation déjà enregistrée pour cette période"
+        else:
+            valides.append(i)
+            if PAIEMENT_UNIQUE_PAR_PERIODE:
+                deja_payes.add((ligne.id_tontine, ligne.id_utilisateur, ligne.periode))
+
+    if valides and not (atomique and erreurs):
+        rows = [
+            {"id_tontine": l.id_tontine, "id_utilisateur": l.id_utilisateur, "montant": l.montant, "periode": l.periode}
+            for l in (lignes[i] for i in valides)
+        ]
+        # Un seul executemany Core sur la table (INSERT multi-lignes côté pilote) : pas d'hydratation ORM
+        # ni de RETURNING, qui forcerait un INSERT par ligne pour garantir l'ordre des ids
+        db.execute(insert(models.Paiement.__table__), rows)
+
+        totaux = {}
+        for row in rows:
+            totaux[row["id_tontine"]] = totaux.get(row["id_tontine"], 0) + row["montant"]
+        for tid, total in totaux.items():
+            incrementer_statistiques(db, tid, total_cotisations=total)
+        db.commit()
+        # Import sans RETURNING : un événement récapitulatif par tontine plutôt qu'un par paiement
+        nombres = {}
+        for row in rows:
+            nombres[row["id_tontine"]] = nombres.get(row["id_tontine"], 0) + 1
+        for tid, total in totaux.items():
+            evenements.publier(tid, "paiements_importes", nombre=nombres[tid], total=total)
+    else:
+        valides = []
+
+    resultats = []
+    for i in range(len(lignes)):
+        if i in erreurs:
+            resultats.append({"ligne": i + 1, "statut": "erreur", "erreur": erreurs[i]})
+        elif atomique and erreurs:
+            resultats.append({"ligne": i + 1, "statut": "erreur", "erreur": "Lot rejeté : au moins une ligne invalide"})
+        else:
+            resultats.append({"ligne": i + 1, "statut": "ok"})
+    return {
+        "total": len(lignes),
+        "inseres": len(valides),
+        "rejetes": len(lignes) - len(valides),
+        "resultats": resultats,
+    }
+
 # CRUD Tour
 def get_tour(db: Session, tour_id: int):
     return db.query(models.Tour).filter(models.Tour.id == tour_id).first()
 
-def get_tours_by_tontine(db: Session, tontine_id: int):
-    return db.query(models.Tour).filter(models.Tour.id_tontine == tontine_id).all()
+def get_tours_by_tontine(db: Session, tontine_id: int, apres=None, limit=None, periode_min: Optional[int] = None,
+                         lignes: bool = False):
+    archive = archivage.limite(db, tontine_id) >= (periode_min or 1)
+    return archivage.lire(db, models.Tour, _filtre_tontine(tontine_id, periode_min), apres, limit, archive,
+                          serialisation.champs(schemas.Tour) if lignes else None)
 
-def create_tour(db: Session, tour: schemas.TourCreate):
+# Renvoie None si la période a déjà son tour (uq_tours_tontine_periode)
+# ou si la même clé d'idempotence a été enregistrée entre-temps par une requête concurrente
+def create_tour(db: Session, tour: schemas.TourCreate, demande: Optional[idempotence.Demande] = None):
     db_tour = models.Tour(**tour.dict())
     db.add(db_tour)
-    db.commit()
+    try:
+        db.flush()
+        incrementer_statistiques(db, db_tour.id_tontine, total_distribue=db_tour.montant_recu, tours_realises=1)
+        if demande is not None:
+            db.refresh(db_tour)
+            corps = schemas.Tour.model_validate(db_tour).model_dump_json()
+            idempotence.enregistrer(db, demande, corps)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    if demande is not None:
+        idempotence.memoriser(demande, corps)
+    cache.invalider(cache.tag_tours(db_tour.id_tontine))
     db.refresh(db_tour)
+    evenements.tour(db_tour)
     return db_tour
 
 # Statistiques
+def incrementer_statistiques(db: Session, tontine_id: int, **deltas):
+    # Appelé après flush, avant commit : les compteurs suivent la transaction de l'écriture
+    compteurs = models.StatistiqueTontine.__table__.c
+    result = db.execute(
+        update(models.StatistiqueTontine)
+        .where(models.StatistiqueTontine.id_tontine == tontine_id)
+        .values({cle: compteurs[cle] + delta for cle, delta in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        # Tontine antérieure à la table de compteurs : on les initialise depuis les tables brutes
+        statistiques.reconstruire_statistiques(db, [tontine_id])
+
+# Variante groupée : un seul UPDATE exécuté en executemany pour toutes les tontines touchées
+def incrementer_statistiques_groupes(db: Session, compteur: str, deltas: Dict[int, int]):
+    if not deltas:
+        return
+    table = models.StatistiqueTontine.__table__
+    result = db.execute(
+        update(table)
+        .where(table.c.id_tontine == bindparam("tid"))
+        .values({compteur: table.c[compteur] + bindparam("delta")}),
+        [{"tid": tid, "delta": delta} for tid, delta in deltas.items()],
+    )
+    if result.rowcount is not None and 0 <= result.rowcount < len(deltas):
+        presentes = {tid for (tid,) in db.execute(select(table.c.id_tontine).where(table.c.id_tontine.in_(list(deltas))))}
+        statistiques.reconstruire_statistiques(db, [tid for tid in deltas if tid not in presentes])
+
 def get_statistiques_tontine(db: Session, tontine_id: int):
-    total_cotisations = db.query(func.sum(models.Paiement.montant)).filter(
-        models.Paiement.id_tontine == tontine_id
-    ).scalar() or 0
-    
-    total_distribue = db.query(func.sum(models.Tour.montant_recu)).filter(
-        models.Tour.id_tontine == tontine_id
-    ).scalar() or 0
-    
-    membres_actifs = count_membres_tontine(db, tontine_id)
-    
-    tours_realises = db.query(func.count(models.Tour.id)).filter(
-        models.Tour.id_tontine == tontine_id
-    ).scalar() or 0
+    stat = db.get(models.StatistiqueTontine, tontine_id)
+    if stat is None:
+        valeurs = statistiques.reconstruire_statistiques(db, [tontine_id]).get(tontine_id)
+        if valeurs is None:
+            return None
+        db.commit()
+        stat = models.StatistiqueTontine(id_tontine=tontine_id, **valeurs)
     
     return {
-        "total_cotisations": total_cotisations,
-        "total_distribue": total_distribue,
-        "solde_restant": total_cotisations - total_distribue,
-        "membres_actifs": membres_actifs,
-        "tours_realises": tours_realises
+        "total_cotisations": stat.total_cotisations,
+        "total_distribue": stat.total_distribue,
+        "solde_restant": stat.total_cotisations - stat.total_distribue,
+        "membres_actifs": stat.membres_actifs,
+        "tours_realises": stat.tours_realises
     }
 
 
@@ -181,5 +553,15 @@ def get_statistiques_tontine(db: Session, tontine_id: int):
 def get_membres_by_utilisateur(db: Session, utilisateur_id: int):
     return db.query(models.Membre).filter(models.Membre.id_utilisateur == utilisateur_id).all()
 
-def get_tontines_by_ids(db: Session, tontine_ids: List[int]):
-    return db.query(models.Tontine).filter(models.Tontine.id.in_(tontine_ids)).all()
\ No newline at end of file
+@shards.en_parallele(lambda t: t.id)
+def get_tontines_by_ids(db: Session, tontine_ids: List[int], apres=None, limit=None):
+    query = db.query(models.Tontine).filter(models.Tontine.id.in_(tontine_ids))
+    return pagination.keyset(query, CLE_TONTINES, apres, limit).all()
+
+# Tontines dont l'utilisateur est membre, en une requête (jointure sur membres)
+@shards.en_parallele(lambda t: t.id)
+def get_tontines_by_membre(db: Session, utilisateur_id: int, apres=None, limit=None, lignes: bool = False):
+    query = db.query(*_entites(models.Tontine, schemas.Tontine, lignes)).join(
+        models.Membre, models.Membre.id_tontine == models.Tontine.id
+    ).filter(models.Membre.id_utilisateur == utilisateur_id)
+    return pagination.keyset(query, CLE_TONTINES, apres, limit).all()
\ No newline at end of file
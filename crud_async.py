@@ -0,0 +1,112 @@
+from typing import List
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud
+import models
+import schemas
+import hashing
+import pagination
+
+# Variantes asynchrones de crud.py, pour les routes async (AsyncSession de database.get_async_db)
+
+# CRUD Utilisateur
+async def get_utilisateur(db: AsyncSession, utilisateur_id: int):
+    return await db.get(models.Utilisateur, utilisateur_id)
+
+async def get_utilisateur_by_telephone(db: AsyncSession, telephone: str):
+    result = await db.execute(select(models.Utilisateur).where(models.Utilisateur.telephone == telephone))
+    return result.scalars().first()
+
+async def get_utilisateur_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.Utilisateur).where(models.Utilisateur.email == email))
+    return result.scalars().first()
+
+async def get_utilisateurs(db: AsyncSession, apres=None, limit: int = 100):
+    result = await db.execute(pagination.keyset(select(models.Utilisateur), crud.CLE_UTILISATEURS, apres, limit))
+    return result.scalars().all()
+
+async def create_utilisateur(db: AsyncSession, utilisateur: schemas.UtilisateurCreate):
+    hashed_password = await hashing.hash_password_async(utilisateur.mot_de_passe)
+    db_utilisateur = models.Utilisateur(
+        nom_utilisateur=utilisateur.nom_utilisateur,
+        telephone=utilisateur.telephone,
+        email=utilisateur.email,
+        mot_de_passe=hashed_password,
+        role=utilisateur.role
+    )
+    db.add(db_utilisateur)
+    await db.commit()
+    await db.refresh(db_utilisateur)
+    return db_utilisateur
+
+async def update_mot_de_passe_utilisateur(db: AsyncSession, db_utilisateur: models.Utilisateur, hashed_password: str):
+    db_utilisateur.mot_de_passe = hashed_password
+    await db.commit()
+    return db_utilisateur
+
+# CRUD Tontine
+async def get_tontine(db: AsyncSession, tontine_id: int):
+    return await db.get(models.Tontine, tontine_id)
+
+async def get_tontines(db: AsyncSession, apres=None, limit: int = 100):
+    result = await db.execute(pagination.keyset(select(models.Tontine), crud.CLE_TONTINES, apres, limit))
+    return result.scalars().all()
+
+async def get_tontines_by_tresorier(db: AsyncSession, tresorier_id: int):
+    result = await db.execute(select(models.Tontine).where(models.Tontine.id_tresorier == tresorier_id))
+    return result.scalars().all()
+
+async def get_tontines_by_ids(db: AsyncSession, tontine_ids: List[int]):
+    result = await db.execute(select(models.Tontine).where(models.Tontine.id.in_(tontine_ids)))
+    return result.scalars().all()
+
+# CRUD Membre
+async def get_membres_by_tontine(db: AsyncSession, tontine_id: int):
+    result = await db.execute(select(models.Membre).where(models.Membre.id_tontine == tontine_id))
+    return result.scalars().all()
+
+async def get_membres_by_utilisateur(db: AsyncSession, utilisateur_id: int):
+    result = await db.execute(select(models.Membre).where(models.Membre.id_utilisateur == utilisateur_id))
+    return result.scalars().all()
+
+async def get_membre_by_user_tontine(db: AsyncSession, utilisateur_id: int, tontine_id: int):
+    result = await db.execute(select(models.Membre).where(
+        models.Membre.id_utilisateur == utilisateur_id,
+        models.Membre.id_tontine == tontine_id
+    ))
+    return result.scalars().first()
+
+async def count_membres_tontine(db: AsyncSession, tontine_id: int):
+    result = await db.execute(select(func.count(models.Membre.id)).where(
+        models.Membre.id_tontine == tontine_id
+    ))
+    return result.scalar()
+
+# CRUD Paiement
+async def get_paiements_by_tontine(db: AsyncSession, tontine_id: int):
+    result = await db.execute(select(models.Paiement).where(models.Paiement.id_tontine == tontine_id))
+    return result.scalars().all()
+
+async def get_paiements_by_utilisateur(db: AsyncSession, utilisateur_id: int):
+    result = await db.execute(select(models.Paiement).where(models.Paiement.id_utilisateur == utilisateur_id))
+    return result.scalars().all()
+
+# CRUD Tour
+async def get_tours_by_tontine(db: AsyncSession, tontine_id: int):
+    result = await db.execute(select(models.Tour).where(models.Tour.id_tontine == tontine_id))
+    return result.scalars().all()
+
+# Statistiques
+async def get_statistiques_tontine(db: AsyncSession, tontine_id: int):
+    stat = await db.get(models.StatistiqueTontine, tontine_id)
+    if stat is None:
+        # Compteurs absents : reconstruction via le chemin synchrone
+        return await db.run_sync(crud.get_statistiques_tontine, tontine_id)
+
+    return {
+        "total_cotisations": stat.total_cotisations,
+        "total_distribue": stat.total_distribue,
+        "solde_restant": stat.total_cotisations - stat.total_distribue,
+        "membres_actifs": stat.membres_actifs,
+        "tours_realises": stat.tours_realises
+    }
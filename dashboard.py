@@ -0,0 +1,106 @@
+from collections import defaultdict
+from datetime import date
+from typing import Optional
+from sqlalchemy import func, select, union
+from sqlalchemy.orm import Session
+import archivage
+import models
+import scheduler
+import statistiques
+
+# Tableau de bord d'un utilisateur : toutes ses tontines (membre ou trésorier) en un nombre fixe de requêtes,
+# quel que soit le nombre de tontines. Remplace mes-tontines + statistiques/membres/tours par tontine.
+
+def tableau_de_bord(db: Session, utilisateur_id: int, jour: Optional[date] = None) -> dict:
+    jour = jour or date.today()
+    T, M, P, S, U = (models.Tontine.__table__, models.Membre.__table__, models.Paiement.__table__,
+                     models.StatistiqueTontine.__table__, models.Utilisateur.__table__)
+
+    # 1. Tontines de l'utilisateur (adhésions et tontines gérées) avec sa position
+    ids = union(
+        select(M.c.id_tontine.label("id")).where(M.c.id_utilisateur == utilisateur_id),
+        select(T.c.id.label("id")).where(T.c.id_tresorier == utilisateur_id),
+    ).subquery()
+    tontines = db.execute(
+        select(T, M.c.position)
+        .join(ids, ids.c.id == T.c.id)
+        .outerjoin(M, (M.c.id_tontine == T.c.id) & (M.c.id_utilisateur == utilisateur_id))
+        .order_by(T.c.id)
+    ).all()
+    tontine_ids = [t.id for t in tontines]
+    if not tontine_ids:
+        return {"tontines": [], "totaux": _totaux([])}
+
+    # 2. Compteurs maintenus (membres, cotisations, distributions), lecture par clé primaire
+    compteurs = {
+        ligne.id_tontine: ligne._asdict()
+        for ligne in db.execute(select(S).where(S.c.id_tontine.in_(tontine_ids)))
+    }
+    manquantes = [tid for tid in tontine_ids if tid not in compteurs]
+    if manquantes:
+        compteurs.update(statistiques.calculer_statistiques(db, manquantes))
+
+    # 3. Cotisations de l'utilisateur par tontine et période
+    payes = defaultdict(dict)
+    for tid, periode, total in db.execute(
+        select(P.c.id_tontine, P.c.periode, func.sum(P.c.montant))
+        .where(P.c.id_utilisateur == utilisateur_id, P.c.id_tontine.in_(tontine_ids))
+        .group_by(P.c.id_tontine, P.c.periode)
+    ):
+        payes[tid][periode] = int(total or 0)
+    # Cycles archivés : cumul par membre tenu à l'archivage, sans relire l'archive
+    archivees = archivage.cotisations_archivees(db, tontine_ids, utilisateur_id)
+
+    # 4. Prochains tours : même calcul ensembliste que le générateur de tours
+    etats = scheduler.planifier(db, jour, tontine_ids)
+
+    # 5. Noms des bénéficiaires des prochains tours
+    beneficiaires = {e.prochain_tour[1] for e in etats.values() if e.prochain_tour}
+    noms = dict(db.execute(
+        select(U.c.id, U.c.nom_utilisateur).where(U.c.id.in_(beneficiaires))
+    ).all()) if beneficiaires else {}
+
+    lignes = []
+    for t in tontines:
+        courante = scheduler.periode_courante(t.frequence, t.date_demarrage, jour)
+        paye_periode = payes[t.id].get(courante, 0) if courante else 0
+        membre = t.position is not None
+        prochain = None
+        etat = etats.get(t.id)
+        if etat and etat.prochain_tour:
+            periode, beneficiaire, date_tour = etat.prochain_tour
+            prochain = {"periode": periode, "date": date_tour, "id_utilisateur": beneficiaire,
+                        "nom_utilisateur": noms.get(beneficiaire)}
+        elif courante == 0:
+            # Pas encore démarrée : premier tour à la date de démarrage
+            prochain = {"periode": 1, "date": t.date_demarrage, "id_utilisateur": None, "nom_utilisateur": None}
+        stats = compteurs[t.id]
+        lignes.append({
+            "id": t.id,
+            "nom": t.nom,
+            "frequence": t.frequence,
+            "mode_rotation": t.mode_rotation,
+            "montant_cotisation": t.montant_cotisation,
+            "role": "membre" if membre else "trésorier",
+            "position": t.position,
+            "nombre_membres": stats["membres_actifs"],
+            "nombre_max_membres": t.nombre_max_membres,
+            "periode_courante": courante,
+            "montant_paye_periode": paye_periode,
+            "a_jour": (not membre) or courante == 0 or paye_periode >= t.montant_cotisation,
+            "total_paye": sum(payes[t.id].values()) + archivees.get(t.id, {}).get(utilisateur_id, 0),
+            "total_cotisations": stats["total_cotisations"],
+            "total_distribue": stats["total_distribue"],
+            "prochain_tour": prochain,
+        })
+    return {"tontines": lignes, "totaux": _totaux(lignes)}
+
+def _totaux(lignes) -> dict:
+    adhesions = [l for l in lignes if l["role"] == "membre"]
+    en_retard = [l for l in adhesions if not l["a_jour"]]
+    return {
+        "nombre_tontines": len(lignes),
+        "tontines_en_retard": len(en_retard),
+        "montant_en_retard": sum(l["montant_cotisation"] - l["montant_paye_periode"] for l in en_retard),
+        "total_paye": sum(l["total_paye"] for l in adhesions),
+    }
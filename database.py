@@ -1,11 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from fastapi import Request
 import os
-from dotenv import load_dotenv
-
-# Charge les variables du fichier .env
-load_dotenv()
+import threading
+import time
+import config
+import metrics
 
 # Récupère l'URL. Si elle n'existe pas, renvoie None.
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -14,14 +17,229 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("❌ Erreur : La variable DATABASE_URL est introuvable. Vérifie ton fichier .env !")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Réplique en lecture seule (optionnelle). Vide = toutes les lectures sur la base principale
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+# Shards des données de tontines (URLs séparées par des virgules). Vide = une seule base.
+# La base DATABASE_URL reste la base globale (utilisateurs, idempotence) ; voir shards.py
+DATABASE_SHARD_URLS = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+
+# Réglages du pool de connexions (par moteur)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 3600))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Après une écriture, les lectures du même utilisateur restent sur la base principale pendant ce délai (s)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+
+# Pools qui mesurent l'attente d'une connexion libre (exposée dans /metrics)
+class PoolMesure(QueuePool):
+    nom = "primaire"
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.nom = self.nom
+        return pool
+
+    def _do_get(self):
+        debut = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.registre.observer_attente_pool(self.nom, time.perf_counter() - debut)
+
+class AsyncPoolMesure(AsyncAdaptedQueuePool, PoolMesure):
+    pass
+
+def _options_pool(url: str, asynchrone: bool = False) -> dict:
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and (asynchrone or url.database in (None, "", ":memory:")):
+        return {}  # SQLite : pool imposé par le pilote (connexion unique en mémoire, NullPool en async)
+    return {
+        "poolclass": AsyncPoolMesure if asynchrone else PoolMesure,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+
+def _creer_moteur(url: str, nom: str):
+    moteur = create_engine(url, pool_pre_ping=True, **_options_pool(url))
+    moteur.pool.nom = nom
+    metrics.registre.pools[nom] = moteur.pool
+    return moteur
+
+# Moteurs et fabriques de sessions créés au premier usage : importer l'application n'importe pas
+# le pilote et n'ouvre aucune connexion (démarrage rapide des workers)
+_moteurs = {}
+_fabriques = {}
+_lock_moteurs = threading.Lock()
+
+def _moteur(nom: str, url: str):
+    moteur = _moteurs.get(nom)
+    if moteur is None:
+        with _lock_moteurs:
+            moteur = _moteurs.get(nom)
+            if moteur is None:
+                moteur = _moteurs[nom] = _creer_moteur(url, nom)
+    return moteur
+
+def get_engine():
+    return _moteur("primaire", DATABASE_URL)
+
+def get_replica_engine():
+    if not DATABASE_REPLICA_URL:
+        return get_engine()
+    return _moteur("replique", DATABASE_REPLICA_URL)
+
+def get_shard_engines() -> dict:
+    return {f"shard{i}": _moteur(f"shard{i}", url) for i, url in enumerate(DATABASE_SHARD_URLS)}
+
+def _fabrique(nom: str, creer):
+    fabrique = _fabriques.get(nom)
+    if fabrique is None:
+        fabrique = _fabriques[nom] = creer()
+    return fabrique
+
+def _fabrique_shards():
+    import shards  # routage par tontine, chargé uniquement en mode shardé
+    return shards.fabrique_sessions()
+
+def SessionLocal(**kwargs) -> Session:
+    if DATABASE_SHARD_URLS:
+        return _fabrique("shards", _fabrique_shards)(**kwargs)
+    return _fabrique("primaire", lambda: sessionmaker(autocommit=False, autoflush=False, bind=get_engine()))(**kwargs)
+
+# En mode shardé, la réplique n'est pas utilisée : les lectures passent par les shards
+def ReplicaSessionLocal(**kwargs) -> Session:
+    if DATABASE_SHARD_URLS or not DATABASE_REPLICA_URL:
+        return SessionLocal(**kwargs)
+    return _fabrique("replique", lambda: sessionmaker(autocommit=False, autoflush=False, bind=get_replica_engine()))(**kwargs)
+
+# Compatibilité : `from database import engine` crée le moteur à la demande
+def __getattr__(nom: str):
+    if nom == "engine":
+        return get_engine()
+    if nom == "replica_engine":
+        return get_replica_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {nom!r}")
 
 Base = declarative_base()
 
-def get_db():
+# --- Sondes de disponibilité ---
+
+# Ouvre et valide jusqu'à DB_POOL_SIZE connexions par moteur, une seule fois : les premières requêtes
+# trouvent ensuite des connexions prêtes. Les appels suivants se contentent d'un ping.
+_pools_prechauffes = set()
+
+def prechauffer():
+    moteurs = {"primaire": get_engine(), **get_shard_engines()}
+    if DATABASE_REPLICA_URL:
+        moteurs["replique"] = get_replica_engine()
+    for nom, moteur in moteurs.items():
+        taille = DB_POOL_SIZE if nom not in _pools_prechauffes and isinstance(moteur.pool, QueuePool) else 1
+        connexions = []
+        try:
+            for _ in range(taille):
+                conn = moteur.connect()
+                connexions.append(conn)
+                conn.exec_driver_sql("SELECT 1")
+        finally:
+            for conn in connexions:
+                conn.close()
+        _pools_prechauffes.add(nom)
+
+# --- Lire ses propres écritures ---
+
+# Utilisateur -> instant jusqu'auquel ses lectures restent sur la base principale (mémoire du processus)
+_ecritures_recentes = {}
+_lock = threading.Lock()
+
+def cle_lecteur(request: Request):
+    # Identifiant utilisateur lu dans le jeton, sans vérification : il ne sert qu'au routage,
+    # l'authentification reste faite par auth.get_current_user
+    autorisation = request.headers.get("authorization", "")
+    if not autorisation.lower().startswith("bearer "):
+        return None
+    from jose import jwt, JWTError
+    try:
+        return jwt.get_unverified_claims(autorisation[7:]).get("uid")
+    except JWTError:
+        return None
+
+def marquer_ecriture(cle):
+    if cle is None:
+        return
+    maintenant = time.monotonic()
+    with _lock:
+        _ecritures_recentes[cle] = maintenant + READ_YOUR_WRITES_SECONDS
+        if len(_ecritures_recentes) > 10000:
+            for c in [c for c, fin in _ecritures_recentes.items() if fin < maintenant]:
+                del _ecritures_recentes[c]
+
+def a_ecrit_recemment(cle) -> bool:
+    fin = _ecritures_recentes.get(cle)
+    return fin is not None and fin >= time.monotonic()
+
+# Tout commit d'une session liée à un utilisateur (sync ou async) ouvre sa fenêtre de lecture sur la base principale
+@event.listens_for(Session, "after_commit")
+def _apres_commit(session):
+    marquer_ecriture(session.info.get("lecteur"))
+
+def get_db(request: Request):
     db = SessionLocal()
+    db.info["lecteur"] = cle_lecteur(request)
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Routes en lecture seule : réplique, sauf juste après une écriture du même utilisateur
+def get_db_lecture(request: Request):
+    cle = cle_lecteur(request)
+    db = SessionLocal() if a_ecrit_recemment(cle) or not DATABASE_REPLICA_URL else ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# --- Accès asynchrone ---
+
+# Pilote asynchrone équivalent au pilote synchrone de DATABASE_URL
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+mysqlconnector": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql+mysqldb": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+def get_async_database_url() -> str:
+    # ASYNC_DATABASE_URL permet de forcer un autre pilote (ex : mysql+asyncmy)
+    url_async = os.getenv("ASYNC_DATABASE_URL")
+    if url_async:
+        return url_async
+    url = make_url(DATABASE_URL)
+    driver = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+# Moteur asynchrone créé au premier usage : le pilote (aiomysql, aiosqlite) n'est importé que si besoin
+async_engine = None
+AsyncSessionLocal = None
+
+def get_async_engine():
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        url = get_async_database_url()
+        async_engine = create_async_engine(url, pool_pre_ping=True, **_options_pool(url, asynchrone=True))
+        async_engine.pool.nom = "primaire_async"
+        metrics.registre.pools["primaire_async"] = async_engine.pool
+        AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+async def get_async_db(request: Request):
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        db.sync_session.info["lecteur"] = cle_lecteur(request)
+        yield db
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Optional
+import orjson
+import config
+
+# Flux d'activité d'une tontine (GET /tontines/{id}/evenements, Server-Sent Events) : remplace le sondage des listes.
+# Les écritures de crud.py publient un événement compact après commit ; chaque worker le diffuse à ses abonnés.
+# Un abonné inactif ne coûte qu'une file asyncio : pas de thread ni de session de base par connexion.
+
+# Relais entre workers (ex : redis://localhost:6379/2). Vide = diffusion dans le processus seulement
+EVENTS_BACKEND_URL = os.getenv("EVENTS_BACKEND_URL", "")
+# Événements en attente par abonné ; au-delà le flux est fermé et le client se reconnecte
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 100))
+# Commentaire SSE envoyé sur un flux inactif (secondes) : garde la connexion ouverte derrière les proxys
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", 15))
+
+# Marqueur de fin de flux déposé dans la file d'un abonné trop lent
+FIN = None
+
+
+def _deposer(files, message: bytes):
+    for file in files:
+        if file.full():
+            # Abonné en retard : flux fermé plutôt que de perdre des événements en silence
+            while not file.empty():
+                file.get_nowait()
+            file.put_nowait(FIN)
+        else:
+            file.put_nowait(message)
+
+
+# Diffusion dans le processus : abonnés indexés par tontine, une file asyncio par abonné
+class MemoryBroker:
+    def __init__(self, taille_file: int = EVENTS_QUEUE_SIZE):
+        self.taille_file = taille_file
+        self._abonnes: Dict[int, set] = {}  # id_tontine -> {(boucle, file)}
+        self._lock = threading.Lock()
+
+    def publier(self, tontine_id: int, message: bytes):
+        self._diffuser(tontine_id, message)
+
+    def abonner(self, tontine_id: int) -> asyncio.Queue:
+        file = asyncio.Queue(self.taille_file)
+        with self._lock:
+            self._abonnes.setdefault(tontine_id, set()).add((asyncio.get_running_loop(), file))
+        return file
+
+    def desabonner(self, tontine_id: int, file: asyncio.Queue):
+        with self._lock:
+            abonnes = self._abonnes.get(tontine_id)
+            if abonnes is None:
+                return
+            abonnes.difference_update([a for a in abonnes if a[1] is file])
+            if not abonnes:
+                del self._abonnes[tontine_id]
+
+    def nombre_abonnes(self) -> int:
+        with self._lock:
+            return sum(len(abonnes) for abonnes in self._abonnes.values())
+
+    def _diffuser(self, tontine_id: int, message: bytes):
+        with self._lock:
+            abonnes = tuple(self._abonnes.get(tontine_id, ()))
+        if not abonnes:
+            return
+        # Publication depuis un thread (crud synchrone, group commit) : un seul réveil par boucle,
+        # qui remplit toutes les files de ses abonnés
+        par_boucle = defaultdict(list)
+        for boucle, file in abonnes:
+            par_boucle[boucle].append(file)
+        for boucle, files in par_boucle.items():
+            try:
+                boucle.call_soon_threadsafe(_deposer, files, message)
+            except RuntimeError:
+                # Boucle fermée (arrêt du worker) : ses abonnés sont partis
+                pass
+
+
+# Relais Redis pub/sub : la publication passe par Redis, un thread par worker écoute toutes les tontines
+# et diffuse localement comme MemoryBroker
+class RedisBroker(MemoryBroker):
+    def __init__(self, url: str, taille_file: int = EVENTS_QUEUE_SIZE, prefix: str = "tontine:evenements:"):
+        super().__init__(taille_file)
+        import redis  # dépendance optionnelle, uniquement si EVENTS_BACKEND_URL est défini
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._thread = None
+
+    def publier(self, tontine_id: int, message: bytes):
+        self.client.publish(f"{self.prefix}{tontine_id}", message)
+
+    def abonner(self, tontine_id: int) -> asyncio.Queue:
+        self._demarrer()
+        return super().abonner(tontine_id)
+
+    def _demarrer(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._ecouter, name="evenements-redis", daemon=True)
+                    self._thread.start()
+
+    def _ecouter(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{self.prefix}*")
+                for message in pubsub.listen():
+                    canal = message["channel"].decode()
+                    self._diffuser(int(canal[len(self.prefix):]), message["data"])
+            except Exception:
+                # Connexion Redis perdue : nouvel abonnement après une courte pause
+                time.sleep(1)
+
+
+_broker = None
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        if EVENTS_BACKEND_URL:
+            _broker = RedisBroker(EVENTS_BACKEND_URL)
+        else:
+            _broker = MemoryBroker()
+    return _broker
+
+def set_broker(broker):
+    global _broker
+    _broker = broker
+
+# Appelé après commit : la diffusion ne doit jamais faire échouer une écriture déjà validée
+def publier(tontine_id: int, evenement: str, **donnees):
+    try:
+        get_broker().publier(tontine_id, orjson.dumps({"type": evenement, "id_tontine": tontine_id, **donnees}))
+    except Exception:
+        pass
+
+def paiement(p):
+    publier(p.id_tontine, "paiement", id=p.id, id_utilisateur=p.id_utilisateur, montant=p.montant, periode=p.periode)
+
+def tour(t):
+    publier(t.id_tontine, "tour", id=t.id, id_utilisateur=t.id_utilisateur, periode=t.periode, montant_recu=t.montant_recu)
+
+def membre(m, evenement: str):
+    publier(m.id_tontine, evenement, id=m.id, id_utilisateur=m.id_utilisateur, position=m.position)
+
+# Corps de la réponse SSE : un `data:` JSON par événement, un commentaire à chaque période d'inactivité.
+# Rien n'est rejoué à la reconnexion : le client relit les listes (cursor, periode_min) pour combler l'écart.
+async def flux(tontine_id: int, keepalive: Optional[float] = None) -> AsyncIterator[bytes]:
+    broker = get_broker()
+    file = broker.abonner(tontine_id)
+    keepalive = keepalive or EVENTS_KEEPALIVE_SECONDS
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(file.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            if message is FIN:
+                return
+            yield b"data: " + message + b"\n\n"
+    finally:
+        broker.desabonner(tontine_id, file)
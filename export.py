@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from typing import Iterator
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+import archivage
+import config
+import models
+from database import ReplicaSessionLocal
+
+# Nombre de lignes lues par aller-retour (curseur serveur) et écrites par morceau de réponse
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+COLONNES_PAIEMENTS = ("id", "id_tontine", "id_utilisateur", "montant", "periode", "date_versement")
+COLONNES_TOURS = ("id", "id_tontine", "id_utilisateur", "periode", "montant_recu", "date_reception")
+
+# Historique complet : table chaude et archive des cycles clos, filtrées chacune avant la réunion
+def _select_historique(modele, colonnes, tontine_id: int = None, utilisateur_id: int = None):
+    def filtre(table):
+        conditions = []
+        if tontine_id is not None:
+            conditions.append(table.c.id_tontine == tontine_id)
+        if utilisateur_id is not None:
+            conditions.append(table.c.id_utilisateur == utilisateur_id)
+        return conditions
+    table = archivage.union(modele, filtre)
+    return select(*(table.c[nom] for nom in colonnes)).order_by(table.c.id)
+
+def select_paiements(tontine_id: int = None, utilisateur_id: int = None):
+    return _select_historique(models.Paiement, COLONNES_PAIEMENTS, tontine_id, utilisateur_id)
+
+def select_tours(tontine_id: int = None, utilisateur_id: int = None):
+    return _select_historique(models.Tour, COLONNES_TOURS, tontine_id, utilisateur_id)
+
+def _valeur(v):
+    return v.isoformat() if isinstance(v, (date, datetime)) else v
+
+def _lignes(stmt, colonnes, format: str) -> Iterator[bytes]:
+    # Session propre au flux (réplique si configurée) : elle vit aussi longtemps que la réponse, indépendamment de get_db
+    db = ReplicaSessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE, stream_results=True))
+        if format == "csv":
+            tampon = io.StringIO()
+            writer = csv.writer(tampon)
+            writer.writerow(colonnes)
+            for lot in result.partitions():
+                writer.writerows([_valeur(v) for v in row] for row in lot)
+                yield tampon.getvalue().encode()
+                tampon.seek(0)
+                tampon.truncate()
+            if tampon.tell():
+                yield tampon.getvalue().encode()
+        else:
+            for lot in result.partitions():
+                yield "".join(
+                    json.dumps(dict(zip(colonnes, map(_valeur, row))), ensure_ascii=False) + "\n"
+                    for row in lot
+                ).encode()
+    finally:
+        db.close()
+
+def reponse_export(stmt, colonnes, format: str, nom_fichier: str) -> StreamingResponse:
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Format d'export inconnu (csv ou ndjson)")
+    return StreamingResponse(
+        _lignes(stmt, colonnes, format),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{nom_fichier}.{format}"'},
+    )
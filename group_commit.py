@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import groupby
+from typing import List, Optional
+from sqlalchemy import insert, text
+import config
+import crud
+import database
+import evenements
+import idempotence
+import models
+import schemas
+import shards
+
+logger = logging.getLogger("tontine.group_commit")
+
+# Mode opt-in : les paiements sont regroupés en micro-lots (un INSERT multi-lignes, un commit)
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "False").lower() in ("1", "true", "yes")
+# Un lot part dès qu'il atteint cette taille...
+GROUP_COMMIT_MAX_SIZE = int(os.getenv("GROUP_COMMIT_MAX_SIZE", 200))
+# ... ou quand son premier paiement a attendu ce délai (ms)
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", 20))
+# Paiements en attente au-delà desquels on répond 503 plutôt que d'allonger la file
+GROUP_COMMIT_MAX_QUEUE = int(os.getenv("GROUP_COMMIT_MAX_QUEUE", 10000))
+
+
+class FileSaturee(Exception):
+    pass
+
+
+@dataclass
+class _Element:
+    paiement: schemas.PaiementCreate
+    utilisateur_id: int
+    demande: Optional[idempotence.Demande]
+    future: Future = field(default_factory=Future)
+
+
+class FileCommits:
+    def __init__(self, max_size: int = GROUP_COMMIT_MAX_SIZE, max_delay_ms: float = GROUP_COMMIT_MAX_DELAY_MS,
+                 max_queue: int = GROUP_COMMIT_MAX_QUEUE):
+        self.max_size = max_size
+        self.max_delay = max_delay_ms / 1000
+        self._file = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def soumettre(self, paiement: schemas.PaiementCreate, utilisateur_id: int,
+                  demande: Optional[idempotence.Demande] = None) -> Future:
+        self._demarrer()
+        element = _Element(paiement, utilisateur_id, demande)
+        try:
+            self._file.put_nowait(element)
+        except queue.Full:
+            raise FileSaturee()
+        return element.future
+
+    def _demarrer(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._boucle, name="group-commit", daemon=True)
+                    self._thread.start()
+
+    def _boucle(self):
+        while True:
+            lot = [self._file.get()]
+            try:
+                limite = time.monotonic() + self.max_delay
+                while len(lot) < self.max_size:
+                    reste = limite - time.monotonic()
+                    if reste <= 0:
+                        break
+                    try:
+                        lot.append(self._file.get(timeout=reste))
+                    except queue.Empty:
+                        break
+                self._ecrire(lot)
+            except Exception as exc:
+                # Erreur inattendue (session, connexion) : le thread survit, les paiements en attente échouent
+                logger.exception("Lot de %d paiement(s) non traité", len(lot))
+                for element in lot:
+                    if not element.future.done():
+                        element.future.set_exception(exc)
+
+    def _ecrire(self, lot: List[_Element]):
+        db = database.SessionLocal()
+        try:
+            # Seuls l'insertion et le commit sont rejoués en cas d'échec : rien n'est réinséré après un commit réussi
+            try:
+                resultats = _ecrire_lot(db, lot)
+            except Exception:
+                db.rollback()
+                # Lot refusé (doublon, clé d'idempotence concurrente, contrainte) : chaque paiement
+                # repasse seul par crud.create_paiement pour que les autres soient quand même acquittés
+                for element in lot:
+                    try:
+                        db_paiement = crud.create_paiement(db, element.paiement, element.utilisateur_id, element.demande)
+                    except Exception as exc:
+                        db.rollback()
+                        element.future.set_exception(exc)
+                        continue
+                    resultat = schemas.Paiement.model_validate(db_paiement) if db_paiement else None
+                    if resultat is not None:
+                        _sans_echec(database.marquer_ecriture, element.utilisateur_id)
+                    element.future.set_result(resultat)
+                return
+            _apres_commit(lot, resultats)
+            for element, resultat in zip(lot, resultats):
+                element.future.set_result(resultat)
+        finally:
+            db.close()
+
+
+# Effets secondaires après commit : une erreur est journalisée sans toucher aux paiements déjà validés
+def _sans_echec(fonction, *args):
+    try:
+        fonction(*args)
+    except Exception:
+        logger.exception("Suite du commit en échec : %s", getattr(fonction, "__qualname__", fonction))
+
+def _apres_commit(lot: List[_Element], resultats: List[Optional[schemas.Paiement]]):
+    for e, resultat in zip(lot, resultats):
+        if resultat is None:
+            continue
+        _sans_echec(database.marquer_ecriture, e.utilisateur_id)
+        _sans_echec(evenements.paiement, resultat)
+        if e.demande is not None:
+            _sans_echec(idempotence.memoriser, e.demande, resultat.model_dump_json())
+
+
+def _ecrire_lot(db, lot: List[_Element]) -> List[Optional[schemas.Paiement]]:
+    # Règle d'unicité : doublons en base ou dans le lot écartés avant l'insertion, en une requête
+    refuses = set()
+    if crud.PAIEMENT_UNIQUE_PAR_PERIODE:
+        existants = crud.paiements_existants(
+            db, {e.paiement.id_tontine for e in lot}, {e.utilisateur_id for e in lot}, {e.paiement.periode for e in lot}
+        )
+        for i, e in enumerate(lot):
+            triplet = (e.paiement.id_tontine, e.utilisateur_id, e.paiement.periode)
+            if triplet in existants:
+                refuses.add(i)
+            existants.add(triplet)
+
+    # date_versement posée côté client (UTC, à la seconde comme CURRENT_TIMESTAMP) : rien à relire après l'insertion
+    maintenant = datetime.utcnow().replace(microsecond=0)
+    acceptes = [i for i in range(len(lot)) if i not in refuses]
+    lignes = [
+        dict(lot[i].paiement.dict(), id_utilisateur=lot[i].utilisateur_id, date_versement=maintenant)
+        for i in acceptes
+    ]
+    ids = dict(zip(acceptes, _inserer_paiements(db, lignes))) if lignes else {}
+
+    totaux = defaultdict(int)
+    resultats = []
+    reponses = []
+    for i, e in enumerate(lot):
+        if i in refuses:
+            resultats.append(None)
+            continue
+        resultat = schemas.Paiement(id=ids[i], id_utilisateur=e.utilisateur_id, date_versement=maintenant,
+                                    **e.paiement.dict())
+        totaux[resultat.id_tontine] += resultat.montant
+        if e.demande is not None:
+            reponses.append(idempotence.ligne(e.demande, resultat.model_dump_json()))
+        resultats.append(resultat)
+    if reponses:
+        db.execute(insert(models.Idempotence.__table__), reponses)
+    crud.incrementer_statistiques_groupes(db, "total_cotisations", totaux)
+    db.commit()
+    return resultats
+
+# Insère les paiements du lot et renvoie leurs ids dans l'ordre de `lignes`
+def _inserer_paiements(db, lignes: List[dict]) -> List[int]:
+    table = models.Paiement.__table__
+    ids = [None] * len(lignes)
+
+    if db.get_bind().dialect.insert_executemany_returning:
+        # SQLite, PostgreSQL, MariaDB : INSERT ... VALUES (...), (...) RETURNING. Exiger l'ordre des paramètres
+        # (sort_by_parameter_order) repasserait à un INSERT par ligne faute de colonne sentinelle : chaque id est
+        # rattaché à sa ligne par son contenu, deux paiements identiques étant interchangeables
+        colonnes = ("id_tontine", "id_utilisateur", "periode", "montant")
+        en_attente = defaultdict(list)
+        for i, ligne in enumerate(lignes):
+            en_attente[tuple(ligne[c] for c in colonnes)].append(i)
+        result = db.execute(insert(table).returning(table.c.id, *(table.c[c] for c in colonnes)), lignes)
+        for id_, *valeurs in result:
+            ids[en_attente[tuple(valeurs)].pop()] = id_
+        return ids
+
+    # MySQL (pas de RETURNING) : un INSERT multi-lignes par shard, ids contigus à partir de LAST_INSERT_ID()
+    # si InnoDB les alloue d'un bloc (innodb_autoinc_lock_mode <= 1), sinon un INSERT par ligne
+    multi_lignes = _ids_contigus(db)
+    shard = (lambda i: shards.shard_de(lignes[i]["id_tontine"])) if shards.actif() else (lambda i: None)
+    for nom, groupe in groupby(sorted(range(len(lignes)), key=lambda i: shard(i) or ""), key=shard):
+        groupe = list(groupe)
+        options = {"bind_arguments": {"shard_id": nom}} if nom is not None else {}
+        if multi_lignes:
+            premier = db.execute(insert(table).values([lignes[i] for i in groupe]), **options).lastrowid
+            for decalage, i in enumerate(groupe):
+                ids[i] = premier + decalage
+        else:
+            for i in groupe:
+                ids[i] = db.execute(insert(table).values(lignes[i]), **options).lastrowid
+    return ids
+
+_autoinc_lock_mode = None
+
+def _ids_contigus(db) -> bool:
+    global _autoinc_lock_mode
+    if _autoinc_lock_mode is None:
+        _autoinc_lock_mode = int(db.execute(text("SELECT @@innodb_autoinc_lock_mode")).scalar())
+        if _autoinc_lock_mode > 1:
+            logger.warning("innodb_autoinc_lock_mode=%d : ids d'un INSERT multi-lignes non garantis contigus, "
+                           "lots insérés ligne par ligne (régler innodb_autoinc_lock_mode=1)", _autoinc_lock_mode)
+    return _autoinc_lock_mode <= 1
+
+
+_file = None
+
+def get_file() -> FileCommits:
+    global _file
+    if _file is None:
+        _file = FileCommits()
+    return _file
+
+# Attend que le lot contenant ce paiement soit validé en base (acquittement après commit)
+async def enregistrer_paiement(paiement: schemas.PaiementCreate, utilisateur_id: int,
+                               demande: Optional[idempotence.Demande] = None) -> Optional[schemas.Paiement]:
+    return await asyncio.wrap_future(get_file().soumettre(paiement, utilisateur_id, demande))
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+import config
+
+# Coût bcrypt : augmenter cette valeur entraîne un re-hachage transparent à la prochaine connexion
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# Nombre de hachages simultanés (bcrypt libère le GIL : des threads suffisent)
+HASH_MAX_WORKERS = int(os.getenv("HASH_MAX_WORKERS", os.cpu_count() or 2))
+# Nombre de demandes autorisées à attendre un thread libre ; au-delà, réponse 503 immédiate
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", 32))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class HachageSature(Exception):
+    pass
+
+
+_executor = None
+_lock = threading.Lock()
+_en_cours = 0
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=HASH_MAX_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+def _liberer(_future=None):
+    global _en_cours
+    with _lock:
+        _en_cours -= 1
+
+def _soumettre(fn, *args) -> Future:
+    global _en_cours
+    executor = _get_executor()
+    # Contrôle d'admission : threads occupés + file d'attente bornée
+    with _lock:
+        if _en_cours >= HASH_MAX_WORKERS + HASH_MAX_QUEUE:
+            raise HachageSature()
+        _en_cours += 1
+    try:
+        future = executor.submit(fn, *args)
+    except BaseException:
+        _liberer()
+        raise
+    future.add_done_callback(_liberer)
+    return future
+
+# Versions bloquantes : pour les routes synchrones (déjà exécutées hors de la boucle d'événements)
+def hash_password(password: str) -> str:
+    return _soumettre(pwd_context.hash, password).result()
+
+def verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return _soumettre(pwd_context.verify_and_update, password, hashed).result()
+
+# Versions asynchrones : la boucle d'événements n'exécute jamais bcrypt elle-même
+async def hash_password_async(password: str) -> str:
+    return await asyncio.wrap_future(_soumettre(pwd_context.hash, password))
+
+async def verify_and_update_async(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return await asyncio.wrap_future(_soumettre(pwd_context.verify_and_update, password, hashed))
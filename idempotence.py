@@ -0,0 +1,145 @@
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from fastapi import HTTPException, Request, Response
+from sqlalchemy.orm import Session
+import config
+import models
+
+# Durée pendant laquelle une clé rejoue la réponse d'origine (mémoire et base)
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 86400))
+# Clés conservées en mémoire par processus (éviction LRU au-delà) ; la base sert de repli
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 50000))
+
+EN_TETE = "Idempotency-Key"
+LONGUEUR_MAX_CLE = 255
+
+# Réponse mémorisée : (route, empreinte de la requête, statut, corps JSON)
+Enregistrement = Tuple[str, str, int, bytes]
+
+
+@dataclass(frozen=True)
+class Demande:
+    utilisateur_id: int
+    cle: str
+    route: str
+    empreinte: str
+
+
+# Dernières réponses en mémoire du processus : (utilisateur, clé) -> (expire, enregistrement)
+class MemoryIdempotenceStore:
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES, ttl: int = IDEMPOTENCY_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entrees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, utilisateur_id: int, cle: str) -> Optional[Enregistrement]:
+        with self._lock:
+            valeur = self._entrees.get((utilisateur_id, cle))
+            if valeur is None:
+                return None
+            expire, enregistrement = valeur
+            if expire < time.monotonic():
+                del self._entrees[(utilisateur_id, cle)]
+                return None
+            self._entrees.move_to_end((utilisateur_id, cle))
+            return enregistrement
+
+    def set(self, utilisateur_id: int, cle: str, enregistrement: Enregistrement):
+        with self._lock:
+            self._entrees[(utilisateur_id, cle)] = (time.monotonic() + self.ttl, enregistrement)
+            self._entrees.move_to_end((utilisateur_id, cle))
+            while len(self._entrees) > self.max_entries:
+                self._entrees.popitem(last=False)
+
+
+_store = MemoryIdempotenceStore()
+
+def get_store():
+    return _store
+
+def set_store(store):
+    global _store
+    _store = store
+
+# --- Utilisation dans les routes ---
+
+def demande(request: Request, utilisateur_id: int, route: str, corps) -> Optional[Demande]:
+    cle = request.headers.get(EN_TETE)
+    if cle is None:
+        return None
+    cle = cle.strip()
+    if not cle or len(cle) > LONGUEUR_MAX_CLE:
+        raise HTTPException(status_code=400, detail=f"En-tête {EN_TETE} invalide (1 à {LONGUEUR_MAX_CLE} caractères)")
+    # Empreinte du corps validé : une même clé ne peut pas servir pour une autre requête
+    empreinte = hashlib.sha256(corps.model_dump_json().encode()).hexdigest()
+    return Demande(utilisateur_id, cle, route, empreinte)
+
+def rejouer(db: Session, demande: Optional[Demande]) -> Optional[Response]:
+    if demande is None:
+        return None
+    enregistrement = get_store().get(demande.utilisateur_id, demande.cle)
+    if enregistrement is None:
+        # Repli sur la base : autre processus, redémarrage ou éviction
+        ligne = db.query(models.Idempotence).filter(
+            models.Idempotence.id_utilisateur == demande.utilisateur_id,
+            models.Idempotence.cle == demande.cle,
+        ).first()
+        if ligne is None or ligne.date_creation < datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS):
+            return None
+        enregistrement = (ligne.route, ligne.empreinte, ligne.statut, ligne.corps.encode())
+        get_store().set(demande.utilisateur_id, demande.cle, enregistrement)
+
+    route, empreinte, statut, corps = enregistrement
+    if route != demande.route or empreinte != demande.empreinte:
+        raise HTTPException(status_code=422, detail=f"{EN_TETE} déjà utilisée pour une autre requête")
+    return Response(content=corps, status_code=statut, media_type="application/json",
+                    headers={"Idempotent-Replayed": "true"})
+
+# Appelé par crud avant le commit : la réponse est enregistrée dans la transaction de l'écriture.
+# L'index unique (id_utilisateur, cle) fait échouer le commit d'un doublon concurrent.
+def enregistrer(db: Session, demande: Demande, corps: str, statut: int = 200):
+    db.add(models.Idempotence(**ligne(demande, corps, statut)))
+
+# Colonnes d'une ligne idempotence (aussi insérées en executemany par group_commit)
+def ligne(demande: Demande, corps: str, statut: int = 200) -> dict:
+    return dict(
+        id_utilisateur=demande.utilisateur_id, cle=demande.cle, route=demande.route,
+        empreinte=demande.empreinte, statut=statut, corps=corps, date_creation=datetime.utcnow(),
+    )
+
+# Appelé après le commit réussi
+def memoriser(demande: Demande, corps: str, statut: int = 200):
+    get_store().set(demande.utilisateur_id, demande.cle, (demande.route, demande.empreinte, statut, corps.encode()))
+
+def purger(db: Session) -> int:
+    limite = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+    supprimees = db.query(models.Idempotence).filter(
+        models.Idempotence.date_creation < limite
+    ).delete(synchronize_session=False)
+    db.commit()
+    return supprimees
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintenance des clés d'idempotence")
+    parser.add_argument("commande", choices=["purge"])
+    parser.parse_args(argv)
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        supprimees = purger(db)
+    finally:
+        db.close()
+    print(f"✅ {supprimees} clé(s) d'idempotence expirée(s) supprimée(s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
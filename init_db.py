@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+import time
+
+# Initialisation explicite de la base, à lancer une fois avant de démarrer les workers (déploiement, CI) :
+#   python init_db.py
+# Remplace le create_all exécuté à l'import de main.py : les workers démarrent sans connexion ni réflexion
+# du schéma. Les tables sont créées via les migrations pour que schema_version reste cohérente.
+
+def init_db(verbose: bool = True):
+    import migrations
+    import shards
+    appliquees = migrations.upgrade(verbose=verbose)
+    if shards.actif():
+        # Mode shardé : tables de tontines et plages d'identifiants sur chaque shard
+        shards.initialiser()
+    return appliquees
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crée ou met à jour le schéma de la base tontine")
+    parser.add_argument("--database-url", default=None, help="Base cible (défaut : DATABASE_URL)")
+    args = parser.parse_args(argv)
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    debut = time.perf_counter()
+    appliquees = init_db()
+    if not appliquees:
+        print("✅ Schéma à jour")
+    print(f"   Initialisation terminée en {time.perf_counter() - debut:.2f} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
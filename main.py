@@ -1,10 +1,21 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import List
-import crud, models, schemas
-from database import engine, get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from typing import List, Optional
+import crud, crud_async, models, schemas, hashing, pagination, metrics, cache, idempotence, database, serialisation
+# Sous-systèmes optionnels (situation et NumPy, group commit, relances, exports, administration, flux SSE) :
+# importés dans les routes qui s'en servent, au premier appel, pour ne pas alourdir le démarrage
+from database import get_db, get_db_lecture, get_async_db
 from datetime import date, timedelta
+import csv
+import io
+import json
+import os
 from auth import (
     authenticate_user, create_access_token, 
     get_current_user, get_current_active_user,
@@ -12,7 +23,10 @@ from auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 
-models.Base.metadata.create_all(bind=engine)
+# Le schéma n'est plus créé à l'import : `python init_db.py` (ou migrations.py) avant le premier démarrage
+
+# Nombre maximal de lignes acceptées par POST /paiements/batch
+BATCH_MAX_PAIEMENTS = int(os.getenv("BATCH_MAX_PAIEMENTS", 50000))
 
 app = FastAPI(title="API Gestion Tontine", version="1.0.0")
 
@@ -23,13 +37,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "Link", "Server-Timing", "ETag", "Idempotent-Replayed"],
 )
 
+# Instrumentation : requêtes SQL et temps en base par requête HTTP, latences par route (/metrics)
+metrics.installer()
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Pool de hachage ou file de group commit saturés : on refuse vite plutôt que d'empiler les requêtes
+@app.exception_handler(hashing.HachageSature)
+async def service_sature_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Service temporairement surchargé, réessayez"},
+        headers={"Retry-After": "1"},
+    )
+
 # --- AUTHENTIFICATION ---
 
 @app.post("/login", response_model=schemas.Token)
-async def login(user: schemas.UtilisateurLogin, db: Session = Depends(get_db)):
-    utilisateur = authenticate_user(db, user.telephone, user.mot_de_passe)
+async def login(user: schemas.UtilisateurLogin, db: AsyncSession = Depends(get_async_db)):
+    utilisateur = await authenticate_user(db, user.telephone, user.mot_de_passe)
     if not utilisateur:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -38,7 +66,7 @@ async def login(user: schemas.UtilisateurLogin, db: Session = Depends(get_db)):
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": utilisateur.telephone, "role": utilisateur.role},
+        data={"sub": utilisateur.telephone, "role": utilisateur.role, "uid": utilisateur.id},
         expires_delta=access_token_expires
     )
     return {
@@ -64,28 +92,46 @@ def creer_utilisateur(utilisateur: schemas.UtilisateurCreate, db: Session = Depe
 
 @app.get("/utilisateurs", response_model=List[schemas.Utilisateur])
 def lire_utilisateurs(
-    skip: int = 0, limit: int = 100, 
-    db: Session = Depends(get_db),
+    request: Request, response: Response,
+    cursor: Optional[str] = None, limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1),
+    db: Session = Depends(get_db_lecture),
     current_user = Depends(require_role("admin")) # Seul l'admin voit tout le monde
 ):
-    return crud.get_utilisateurs(db, skip=skip, limit=limit)
+    taille = pagination.taille_page(limit)
+    apres = pagination.decoder_curseur(cursor, crud.CLE_UTILISATEURS)
+    utilisateurs = crud.get_utilisateurs(db, apres=apres, limit=taille + 1, lignes=serialisation.FAST_LIST_RESPONSES)
+    return serialisation.page(request, response, utilisateurs, taille, lambda u: (u.id,), schemas.Utilisateur)
 
 @app.get("/utilisateurs/{utilisateur_id}", response_model=schemas.Utilisateur)
-def lire_utilisateur(utilisateur_id: int, db: Session = Depends(get_db)):
+def lire_utilisateur(utilisateur_id: int, db: Session = Depends(get_db_lecture)):
     db_utilisateur = crud.get_utilisateur(db, utilisateur_id=utilisateur_id)
     if db_utilisateur is None:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     return db_utilisateur
 
+@app.put("/utilisateurs/{utilisateur_id}/role", response_model=schemas.Utilisateur)
+def modifier_role_utilisateur(
+    utilisateur_id: int,
+    role_update: schemas.UtilisateurRoleUpdate,
+    db: Session = Depends(get_db),
+    current_user = Depends(require_role("admin")) # Seul l'admin change les rôles
+):
+    db_utilisateur = crud.update_role_utilisateur(db, utilisateur_id, role_update.role)
+    if db_utilisateur is None:
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    return db_utilisateur
+
 @app.delete("/utilisateurs/{utilisateur_id}")
 def supprimer_utilisateur(
     utilisateur_id: int, 
     db: Session = Depends(get_db),
     current_user = Depends(require_role("admin")) # Seul l'admin peut supprimer
 ):
-    success = crud.delete_utilisateur(db, utilisateur_id)
-    if not success:
+    _, erreur = crud.delete_utilisateur(db, utilisateur_id)
+    if erreur == "introuvable":
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    if erreur == "tresorier":
+        raise HTTPException(status_code=409, detail="L'utilisateur gère encore des tontines : à supprimer ou réattribuer d'abord")
     return {"message": "Utilisateur supprimé"}
 
 # --- TONTINES ---
@@ -101,38 +147,75 @@ def creer_tontine(
 
 @app.get("/tontines", response_model=List[schemas.Tontine])
 def lire_tontines(
-    skip: int = 0, limit: int = 100, 
+    request: Request, response: Response,
+    cursor: Optional[str] = None, limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     # Si Admin ou Trésorier, voit tout, sinon logic à adapter si besoin
     # Pour l'instant on laisse voir la liste publique des tontines
-    return crud.get_tontines(db, skip=skip, limit=limit)
+    def calculer():
+        taille = pagination.taille_page(limit)
+        apres = pagination.decoder_curseur(cursor, crud.CLE_TONTINES)
+        tontines = crud.get_tontines(db, apres=apres, limit=taille + 1, lignes=serialisation.FAST_LIST_RESPONSES)
+        return pagination.page(request, response, tontines, taille, lambda t: (t.id,))
+    return cache.reponse(request, response, [cache.tag_tontines()], List[schemas.Tontine], calculer)
 
 @app.get("/tontines/mes-tontines", response_model=List[schemas.Tontine])
 def lire_mes_tontines(
-    db: Session = Depends(get_db),
+    request: Request, response: Response,
+    cursor: Optional[str] = None, limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1),
+    db: Session = Depends(get_db_lecture),
     current_user = Depends(get_current_user)
 ):
+    taille = pagination.taille_page(limit)
+    apres = pagination.decoder_curseur(cursor, crud.CLE_TONTINES)
+    lignes = serialisation.FAST_LIST_RESPONSES
     if current_user.role == "membre":
         # Récupérer les tontines où l'utilisateur est membre
-        membres = crud.get_membres_by_utilisateur(db, current_user.id)
-        tontines_ids = [m.id_tontine for m in membres]
-        return crud.get_tontines_by_ids(db, tontines_ids)
-    
-    # Si trésorier, voir celles qu'il gère
-    if current_user.role == "trésorier":
-        return crud.get_tontines_by_tresorier(db, current_user.id)
-        
-    # Admin voit tout
-    return crud.get_tontines(db)
+        tontines = crud.get_tontines_by_membre(db, current_user.id, apres=apres, limit=taille + 1, lignes=lignes)
+    elif current_user.role == "trésorier":
+        # Si trésorier, voir celles qu'il gère
+        tontines = crud.get_tontines_by_tresorier(db, current_user.id, apres=apres, limit=taille + 1, lignes=lignes)
+    else:
+        # Admin voit tout
+        tontines = crud.get_tontines(db, apres=apres, limit=taille + 1, lignes=lignes)
+    return serialisation.page(request, response, tontines, taille, lambda t: (t.id,), schemas.Tontine)
+
+# Vue d'ensemble en un appel : remplace mes-tontines puis statistiques/membres/tours par tontine
+@app.get("/dashboard", response_model=schemas.TableauDeBord)
+def lire_tableau_de_bord(
+    db: Session = Depends(get_db_lecture),
+    current_user = Depends(get_current_user)
+):
+    import dashboard
+    return dashboard.tableau_de_bord(db, current_user.id)
+
+@app.get("/tontines/mes-tontines/situation")
+def lire_situation_mes_tontines(
+    periode_min: int = Query(1, ge=1),
+    periode_max: Optional[int] = Query(None, ge=1),
+    detail: bool = False,
+    tresorier_id: Optional[int] = None,
+    db: Session = Depends(get_db_lecture),
+    current_user = Depends(require_role_admin_tresorier)
+):
+    import situation
+    # Toutes les tontines d'un trésorier en une seule requête groupée (l'admin choisit le trésorier)
+    if current_user.role != "admin" or tresorier_id is None:
+        tresorier_id = current_user.id
+    tontines = crud.get_tontines_by_tresorier(db, tresorier_id)
+    situations = situation.situation_tontines(db, tontines, periode_min=periode_min, periode_max=periode_max, detail=detail)
+    return ORJSONResponse(list(situations.values()))
 
 @app.get("/tontines/{tontine_id}", response_model=schemas.Tontine)
-def lire_tontine(tontine_id: int, db: Session = Depends(get_db)):
-    db_tontine = crud.get_tontine(db, tontine_id=tontine_id)
-    if db_tontine is None:
-        raise HTTPException(status_code=404, detail="Tontine non trouvée")
-    return db_tontine
+def lire_tontine(tontine_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    def calculer():
+        db_tontine = crud.get_tontine(db, tontine_id=tontine_id)
+        if db_tontine is None:
+            raise HTTPException(status_code=404, detail="Tontine non trouvée")
+        return db_tontine
+    return cache.reponse(request, response, [cache.tag_tontine(tontine_id)], schemas.Tontine, calculer)
 
 @app.put("/tontines/{tontine_id}", response_model=schemas.Tontine)
 def modifier_tontine(
@@ -154,38 +237,61 @@ def supprimer_tontine(
         raise HTTPException(status_code=404, detail="Tontine non trouvée")
     return {"message": "Tontine supprimée"}
 
-@app.get("/tontines/{tontine_id}/statistiques")
-def lire_statistiques_tontine(tontine_id: int, db: Session = Depends(get_db)):
-    return crud.get_statistiques_tontine(db, tontine_id=tontine_id)
+def _lire_statistiques_shard(tontine_id: int):
+    db = database.SessionLocal()
+    try:
+        return crud.get_statistiques_tontine(db, tontine_id)
+    finally:
+        db.close()
+
+@app.get("/tontines/{tontine_id}/statistiques", response_model=schemas.StatistiquesTontine)
+async def lire_statistiques_tontine(tontine_id: int, db: AsyncSession = Depends(get_async_db)):
+    # Lecture par clé primaire des compteurs maintenus à chaque écriture
+    if database.DATABASE_SHARD_URLS:
+        # Mode shardé : les compteurs sont sur le shard de la tontine, lus par la session synchrone routée
+        statistiques = await run_in_threadpool(_lire_statistiques_shard, tontine_id)
+    else:
+        statistiques = await crud_async.get_statistiques_tontine(db, tontine_id=tontine_id)
+    if statistiques is None:
+        raise HTTPException(status_code=404, detail="Tontine non trouvée")
+    return statistiques
+
+@app.get("/tontines/{tontine_id}/situation")
+def lire_situation_tontine(
+    tontine_id: int,
+    periode_min: int = Query(1, ge=1),
+    periode_max: Optional[int] = Query(None, ge=1),
+    detail: bool = True,
+    db: Session = Depends(get_db_lecture),
+    current_user = Depends(require_role_admin_tresorier)
+):
+    import situation
+    # Montants payés, arriérés et solde cumulé par membre et par période
+    tontine = crud.get_tontine(db, tontine_id)
+    if tontine is None:
+        raise HTTPException(status_code=404, detail="Tontine non trouvée")
+    situations = situation.situation_tontines(db, [tontine], periode_min=periode_min, periode_max=periode_max, detail=detail)
+    return ORJSONResponse(situations[tontine_id])
 
 # --- MEMBRES ---
 
-@app.post("/tontines/{tontine_id}/rejoindre")
+@app.post("/tontines/{tontine_id}/rejoindre", response_model=schemas.Membre)
 def rejoindre_tontine(
     tontine_id: int,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    # Vérifications...
-    tontine = crud.get_tontine(db, tontine_id)
-    if not tontine:
+    # Vérifications et insertion en une seule transaction (voir crud.rejoindre_tontine)
+    membre, erreur = crud.rejoindre_tontine(db, tontine_id, current_user.id, date.today())
+    if erreur == "introuvable":
         raise HTTPException(status_code=404, detail="Tontine non trouvée")
-    
-    existing = crud.get_membre_by_user_tontine(db, current_user.id, tontine_id)
-    if existing:
+    if erreur == "deja_membre":
         raise HTTPException(status_code=400, detail="Vous êtes déjà membre")
-    
-    nb_membres = crud.count_membres_tontine(db, tontine_id)
-    if nb_membres >= tontine.nombre_max_membres:
-         raise HTTPException(status_code=400, detail="Tontine complète")
-
-    membre_data = schemas.MembreCreate(
-        id_tontine=tontine_id,
-        id_utilisateur=current_user.id,
-        position=nb_membres + 1,
-        date_adhesion=date.today()
-    )
-    return crud.add_membre(db, membre_data)
+    if erreur == "complete":
+        raise HTTPException(status_code=400, detail="Tontine complète")
+    if erreur == "conflit":
+        raise HTTPException(status_code=409, detail="Trop d'adhésions simultanées, réessayez")
+    return membre
 
 @app.post("/membres", response_model=schemas.Membre)
 def ajouter_membre_manuel(
@@ -194,11 +300,26 @@ def ajouter_membre_manuel(
     current_user = Depends(require_role_admin_tresorier) # Réservé aux gestionnaires
 ):
     # Logique d'ajout manuel par un trésorier
-    return crud.add_membre(db=db, membre=membre)
+    try:
+        return crud.add_membre(db=db, membre=membre)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Utilisateur déjà membre ou position déjà attribuée")
 
 @app.get("/tontines/{tontine_id}/membres", response_model=List[schemas.Membre])
-def lire_membres_tontine(tontine_id: int, db: Session = Depends(get_db)):
-    return crud.get_membres_by_tontine(db, tontine_id=tontine_id)
+def lire_membres_tontine(
+    tontine_id: int,
+    request: Request, response: Response,
+    cursor: Optional[str] = None, limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1),
+    db: Session = Depends(get_db)
+):
+    def calculer():
+        taille = pagination.taille_page(limit)
+        apres = pagination.decoder_curseur(cursor, crud.CLE_MEMBRES)
+        membres = crud.get_membres_by_tontine(db, tontine_id=tontine_id, apres=apres, limit=taille + 1,
+                                              lignes=serialisation.FAST_LIST_RESPONSES)
+        return pagination.page(request, response, membres, taille, lambda m: (m.id,))
+    return cache.reponse(request, response, [cache.tag_membres(tontine_id)], List[schemas.Membre], calculer)
 
 @app.delete("/membres/{membre_id}")
 def retirer_membre(
@@ -213,31 +334,311 @@ def retirer_membre(
 
 # --- PAIEMENTS & TOURS ---
 
+# Route async : en mode GROUP_COMMIT, des centaines de paiements peuvent attendre leur lot
+# sans occuper chacun un thread ; les appels à la session synchrone passent par run_in_threadpool
 @app.post("/paiements", response_model=schemas.Paiement)
-def effectuer_paiement(
+async def effectuer_paiement(
     paiement: schemas.PaiementCreate, 
+    request: Request,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
+    # Réessai d'un client (même Idempotency-Key) : réponse d'origine, sans nouvelle écriture
+    demande = idempotence.demande(request, current_user.id, "paiements", paiement)
+    if demande is not None:
+        rejeu = await run_in_threadpool(idempotence.rejouer, db, demande)
+        if rejeu is not None:
+            return rejeu
+    import group_commit
     # On force l'ID utilisateur avec celui connecté (sécurité)
-    return crud.create_paiement(db=db, paiement=paiement, utilisateur_id=current_user.id)
+    if group_commit.GROUP_COMMIT:
+        # Acquitté seulement une fois le micro-lot validé en base
+        try:
+            db_paiement = await group_commit.enregistrer_paiement(paiement, current_user.id, demande)
+        except group_commit.FileSaturee as exc:
+            return await service_sature_handler(request, exc)
+    else:
+        db_paiement = await run_in_threadpool(crud.create_paiement, db, paiement, current_user.id, demande)
+    if db_paiement is None:
+        rejeu = await run_in_threadpool(idempotence.rejouer, db, demande)
+        if rejeu is not None:
+            return rejeu
+        raise HTTPException(status_code=409, detail="Cotisation déjà enregistrée pour cette période")
+    return db_paiement
+
+# Lit un lot JSON (liste d'objets) ou CSV (en-tête id_tontine,id_utilisateur,montant,periode)
+def _lire_lot_paiements(contenu: bytes, est_csv: bool):
+    try:
+        if est_csv:
+            brutes = list(csv.DictReader(io.StringIO(contenu.decode("utf-8-sig"))))
+        else:
+            brutes = json.loads(contenu)
+    except (ValueError, csv.Error):
+        raise HTTPException(status_code=400, detail="Fichier de paiements illisible")
+    if not isinstance(brutes, list):
+        raise HTTPException(status_code=400, detail="Une liste de paiements est attendue")
+    if len(brutes) > BATCH_MAX_PAIEMENTS:
+        raise HTTPException(status_code=413, detail=f"Lot limité à {BATCH_MAX_PAIEMENTS} paiements")
+
+    lignes, erreurs = [], {}
+    for i, brute in enumerate(brutes):
+        try:
+            if not isinstance(brute, dict):
+                raise TypeError
+            lignes.append(schemas.PaiementBatchItem(**brute))
+        except (ValidationError, TypeError):
+            lignes.append(None)
+            erreurs[i] = "Ligne invalide : id_tontine, id_utilisateur, montant et periode entiers attendus"
+    return lignes, erreurs
+
+@app.post("/paiements/batch", response_model=schemas.ResultatBatchPaiements)
+async def importer_paiements(
+    request: Request,
+    atomique: bool = False,
+    db: Session = Depends(get_db),
+    current_user = Depends(require_role_admin_tresorier)
+):
+    # JSON dans le corps, CSV brut (text/csv) ou fichier CSV en multipart
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        formulaire = await request.form()
+        fichiers = [v for v in formulaire.values() if hasattr(v, "read")]
+        if not fichiers:
+            raise HTTPException(status_code=400, detail="Aucun fichier CSV reçu")
+        contenu, est_csv = await fichiers[0].read(), True
+    else:
+        contenu, est_csv = await request.body(), "csv" in content_type
+
+    lignes, erreurs = await run_in_threadpool(_lire_lot_paiements, contenu, est_csv)
+    # Un trésorier n'importe que dans les tontines qu'il gère
+    tresorier_id = current_user.id if current_user.role == "trésorier" else None
+    return await run_in_threadpool(
+        crud.create_paiements_batch, db, lignes, erreurs, tresorier_id, atomique
+    )
 
 @app.get("/tontines/{tontine_id}/paiements", response_model=List[schemas.Paiement])
-def lire_paiements_tontine(tontine_id: int, db: Session = Depends(get_db)):
-    return crud.get_paiements_by_tontine(db, tontine_id=tontine_id)
+def lire_paiements_tontine(
+    tontine_id: int,
+    request: Request, response: Response,
+    cursor: Optional[str] = None, limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1),
+    periode_min: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db_lecture)
+):
+    # periode_min au-delà des cycles archivés : seule la table chaude est lue
+    taille = pagination.taille_page(limit)
+    apres = pagination.decoder_curseur(cursor, crud.CLE_PAIEMENTS)
+    paiements = crud.get_paiements_by_tontine(db, tontine_id=tontine_id, apres=apres, limit=taille + 1,
+                                              periode_min=periode_min, lignes=serialisation.FAST_LIST_RESPONSES)
+    return serialisation.page(request, response, paiements, taille, lambda p: (p.id,), schemas.Paiement)
 
 @app.post("/tours", response_model=schemas.Tour)
 def creer_tour(
     tour: schemas.TourCreate, 
+    request: Request,
     db: Session = Depends(get_db),
     current_user = Depends(require_role_admin_tresorier)
 ):
-    return crud.create_tour(db=db, tour=tour)
+    demande = idempotence.demande(request, current_user.id, "tours", tour)
+    rejeu = idempotence.rejouer(db, demande)
+    if rejeu is not None:
+        return rejeu
+    db_tour = crud.create_tour(db=db, tour=tour, demande=demande)
+    if db_tour is None:
+        rejeu = idempotence.rejouer(db, demande)
+        if rejeu is not None:
+            return rejeu
+        raise HTTPException(status_code=409, detail="Tour déjà attribué pour cette période")
+    return db_tour
 
 @app.get("/tontines/{tontine_id}/tours", response_model=List[schemas.Tour])
-def lire_tours_tontine(tontine_id: int, db: Session = Depends(get_db)):
-    return crud.get_tours_by_tontine(db, tontine_id=tontine_id)
+def lire_tours_tontine(
+    tontine_id: int,
+    request: Request, response: Response,
+    cursor: Optional[str] = None, limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1),
+    periode_min: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    def calculer():
+        taille = pagination.taille_page(limit)
+        apres = pagination.decoder_curseur(cursor, crud.CLE_TOURS)
+        tours = crud.get_tours_by_tontine(db, tontine_id=tontine_id, apres=apres, limit=taille + 1,
+                                          periode_min=periode_min, lignes=serialisation.FAST_LIST_RESPONSES)
+        return pagination.page(request, response, tours, taille, lambda t: (t.id,))
+    return cache.reponse(request, response, [cache.tag_tours(tontine_id)], List[schemas.Tour], calculer)
+
+# --- ÉVÉNEMENTS ---
+
+def _verifier_abonnement(tontine_id: int, current_user):
+    db = database.SessionLocal()
+    try:
+        _verifier_acces_tontine(db, tontine_id, current_user, membres=True)
+    finally:
+        db.close()
+
+# Flux SSE des paiements, tours et adhésions de la tontine, à la place du sondage des listes.
+# Accès contrôlé à l'ouverture (session synchrone, routée en mode shardé), puis plus aucune session :
+# une connexion ouverte n'occupe ni thread ni connexion à la base
+@app.get("/tontines/{tontine_id}/evenements")
+async def suivre_tontine(
+    tontine_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_user)
+):
+    import evenements
+    await run_in_threadpool(_verifier_abonnement, tontine_id, current_user)
+    # Session de l'authentification rendue au pool : elle ne serait fermée qu'à la fin du flux
+    await db.close()
+    return StreamingResponse(
+        evenements.flux(tontine_id), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- ADMINISTRATION ---
+
+@app.post("/admin/tours/generer")
+def generer_tours_echus(
+    jour: Optional[date] = None,
+    dry_run: bool = False,
+    rattrapage: bool = False,
+    db: Session = Depends(get_db),
+    current_user = Depends(require_role("admin"))
+):
+    import scheduler
+    # Même traitement que `python scheduler.py` : toutes les tontines actives en une passe
+    return scheduler.generer_tours(db, jour, dry_run, rattrapage)
+
+@app.post("/admin/archivage")
+def archiver_cycles_clos(
+    jour: Optional[date] = None,
+    dry_run: bool = False,
+    db: Session = Depends(get_db),
+    current_user = Depends(require_role("admin"))
+):
+    import archivage
+    # Même traitement que `python archivage.py run`
+    return archivage.archiver(db, dry_run=dry_run, jour=jour)
+
+@app.post("/admin/relances", status_code=202)
+async def relancer_impayes(
+    jour: Optional[date] = None,
+    frequence: Optional[List[str]] = Query(None),
+    dry_run: bool = False,
+    recommencer: bool = False,
+    current_user = Depends(require_role("admin"))
+):
+    import relances
+    # Même traitement que `python relances.py run`, en tâche de fond : suivi par GET /admin/relances/{id}.
+    # Une passe déjà terminée n'est pas renvoyée
+    if frequence and not set(frequence) <= set(relances.FREQUENCES):
+        raise HTTPException(status_code=400, detail="Fréquence inconnue (journalier, hebdomadaire ou mensuel)")
+    if relances.passe_en_cours() is not None:
+        raise HTTPException(status_code=409, detail="Une passe de relances est déjà en cours")
+    return relances.lancer(jour, frequence, dry_run, recommencer)
+
+@app.get("/admin/relances/{passe_id}")
+def etat_relances(passe_id: str, current_user = Depends(require_role("admin"))):
+    import relances
+    passe = relances.etat_passe(passe_id)
+    if passe is None:
+        raise HTTPException(status_code=404, detail="Passe de relances inconnue")
+    return passe
+
+# --- EXPORTS ---
+
+def _verifier_acces_tontine(db: Session, tontine_id: int, current_user, membres: bool = False):
+    # Un trésorier exporte les tontines qu'il gère ; l'admin exporte toutes les tontines.
+    # `membres` : les membres de la tontine y ont aussi accès (flux d'événements)
+    db_tontine = crud.get_tontine(db, tontine_id=tontine_id)
+    if db_tontine is None:
+        raise HTTPException(status_code=404, detail="Tontine non trouvée")
+    if db_tontine.id_tresorier != current_user.id and current_user.role != "admin":
+        if not membres:
+            raise HTTPException(status_code=403, detail="Accès réservé au trésorier de la tontine ou à un admin")
+        if crud.get_membre_by_user_tontine(db, current_user.id, tontine_id) is None:
+            raise HTTPException(status_code=403, detail="Accès réservé aux membres de la tontine, à son trésorier ou à un admin")
+    # Le flux lit sur sa propre connexion : celle de la session est rendue au pool avant l'export
+    db.close()
+
+@app.get("/tontines/{tontine_id}/export/paiements")
+def exporter_paiements_tontine(
+    tontine_id: int,
+    format: str = "csv",
+    db: Session = Depends(get_db_lecture),
+    current_user = Depends(require_role_admin_tresorier)
+):
+    import export
+    _verifier_acces_tontine(db, tontine_id, current_user)
+    return export.reponse_export(
+        export.select_paiements(tontine_id=tontine_id), export.COLONNES_PAIEMENTS,
+        format, f"paiements_tontine_{tontine_id}"
+    )
+
+@app.get("/tontines/{tontine_id}/export/tours")
+def exporter_tours_tontine(
+    tontine_id: int,
+    format: str = "csv",
+    db: Session = Depends(get_db_lecture),
+    current_user = Depends(require_role_admin_tresorier)
+):
+    import export
+    _verifier_acces_tontine(db, tontine_id, current_user)
+    return export.reponse_export(
+        export.select_tours(tontine_id=tontine_id), export.COLONNES_TOURS,
+        format, f"tours_tontine_{tontine_id}"
+    )
+
+def _verifier_acces_utilisateur(utilisateur_id: int, current_user):
+    # Un utilisateur exporte son propre historique ; l'admin exporte celui de tout le monde
+    if current_user.id != utilisateur_id and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès réservé à l'utilisateur concerné ou à un admin")
+
+@app.get("/utilisateurs/{utilisateur_id}/export/paiements")
+def exporter_paiements_utilisateur(
+    utilisateur_id: int,
+    format: str = "csv",
+    current_user = Depends(get_current_user)
+):
+    import export
+    _verifier_acces_utilisateur(utilisateur_id, current_user)
+    return export.reponse_export(
+        export.select_paiements(utilisateur_id=utilisateur_id), export.COLONNES_PAIEMENTS,
+        format, f"paiements_utilisateur_{utilisateur_id}"
+    )
+
+@app.get("/utilisateurs/{utilisateur_id}/export/tours")
+def exporter_tours_utilisateur(
+    utilisateur_id: int,
+    format: str = "csv",
+    current_user = Depends(get_current_user)
+):
+    import export
+    _verifier_acces_utilisateur(utilisateur_id, current_user)
+    return export.reponse_export(
+        export.select_tours(utilisateur_id=utilisateur_id), export.COLONNES_TOURS,
+        format, f"tours_utilisateur_{utilisateur_id}"
+    )
+
+# --- SUPERVISION ---
+
+@app.get("/metrics", include_in_schema=False)
+def lire_metriques():
+    return Response(content=metrics.registre.exporter(), media_type=metrics.CONTENT_TYPE)
+
+# Vivacité : le processus répond, sans toucher à la base
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+# Disponibilité : base joignable et pool de connexions préchauffé (hors de la boucle d'événements)
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    try:
+        database.prechauffer()
+    except SQLAlchemyError:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"status": "indisponible", "detail": "Base de données injoignable"})
+    return {"status": "pret"}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
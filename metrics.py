@@ -0,0 +1,209 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import config
+
+# Requêtes SQL plus lentes que ce seuil (ms) journalisées avec leur route. 0 = désactivé
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 0))
+# Mode debug : signale une même requête SQL répétée au moins N_PLUS_1_SEUIL fois dans une requête HTTP
+DEBUG_N_PLUS_1 = os.getenv("DEBUG_N_PLUS_1", "False").lower() in ("1", "true", "yes")
+N_PLUS_1_SEUIL = int(os.getenv("N_PLUS_1_SEUIL", 5))
+
+# Bornes des histogrammes de latence, en secondes
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger("tontine.sql")
+
+
+# Mesures de la requête HTTP en cours. L'objet est partagé par référence avec les threads
+# des routes synchrones (run_in_threadpool copie le contexte), les compteurs y remontent donc.
+@dataclass
+class MesuresRequete:
+    scope: dict = field(default_factory=dict)
+    requetes: int = 0
+    duree_db: float = 0.0
+    instructions: Counter = field(default_factory=Counter)
+
+    @property
+    def route(self) -> str:
+        # Gabarit de la route (/tontines/{tontine_id}) plutôt que le chemin : cardinalité bornée.
+        # Le routeur renseigne scope["route"] avant d'exécuter les dépendances et la route.
+        route = self.scope.get("route")
+        return getattr(route, "path", "inconnue")
+
+_courante: ContextVar[Optional[MesuresRequete]] = ContextVar("mesures_requete", default=None)
+
+# --- Registre des métriques (format texte Prometheus) ---
+
+class Histogramme:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.somme = 0.0
+        self.nombre = 0
+
+    def observer(self, valeur: float):
+        for i, borne in enumerate(BUCKETS):
+            if valeur <= borne:
+                self.buckets[i] += 1
+        self.somme += valeur
+        self.nombre += 1
+
+class Registre:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requetes_http = Counter()            # (methode, route, statut) -> nombre
+        self.latences = defaultdict(Histogramme)  # (methode, route) -> histogramme
+        self.requetes_sql = Counter()             # route -> requêtes SQL
+        self.duree_sql = Counter()                # route -> secondes passées en base
+        self.requetes_lentes = Counter()          # route -> requêtes au-delà de SLOW_QUERY_MS
+        self.n_plus_1 = Counter()                 # route -> requêtes HTTP signalées
+        self.attentes_pool = defaultdict(Histogramme)  # pool -> attente d'une connexion libre
+        self.pools = {}                           # nom -> pool SQLAlchemy (état lu à l'export)
+
+    def enregistrer(self, methode: str, statut: int, duree: float, mesures: MesuresRequete):
+        with self._lock:
+            self.requetes_http[(methode, mesures.route, str(statut))] += 1
+            self.latences[(methode, mesures.route)].observer(duree)
+            self.requetes_sql[mesures.route] += mesures.requetes
+            self.duree_sql[mesures.route] += mesures.duree_db
+
+    def observer_attente_pool(self, pool: str, duree: float):
+        with self._lock:
+            self.attentes_pool[pool].observer(duree)
+
+    def signaler(self, compteur: Counter, route: str):
+        with self._lock:
+            compteur[route] += 1
+
+    def exporter(self) -> str:
+        lignes = []
+        def serie(nom, type_, aide, valeurs):
+            lignes.append(f"# HELP {nom} {aide}")
+            lignes.append(f"# TYPE {nom} {type_}")
+            lignes.extend(valeurs)
+
+        with self._lock:
+            serie("tontine_http_requests_total", "counter", "Requêtes HTTP par route et statut", [
+                f'tontine_http_requests_total{{method="{m}",route="{r}",status="{s}"}} {n}'
+                for (m, r, s), n in sorted(self.requetes_http.items())
+            ])
+            serie("tontine_http_request_duration_seconds", "histogram", "Latence des requêtes HTTP", [
+                ligne for (m, r), h in sorted(self.latences.items())
+                for ligne in _histogramme("tontine_http_request_duration_seconds", f'method="{m}",route="{r}"', h)
+            ])
+            for nom, aide, compteur in (
+                ("tontine_db_queries_total", "Requêtes SQL émises par route", self.requetes_sql),
+                ("tontine_db_duration_seconds_total", "Temps passé en base par route", self.duree_sql),
+                ("tontine_db_slow_queries_total", "Requêtes SQL au-delà de SLOW_QUERY_MS", self.requetes_lentes),
+                ("tontine_db_n_plus_1_total", "Requêtes HTTP avec une requête SQL répétée (N+1)", self.n_plus_1),
+            ):
+                serie(nom, "counter", aide, [
+                    f'{nom}{{route="{r}"}} {v:.6f}' if isinstance(v, float) else f'{nom}{{route="{r}"}} {v}'
+                    for r, v in sorted(compteur.items())
+                ])
+            serie("tontine_db_pool_wait_seconds", "histogram", "Attente d'une connexion libre dans le pool", [
+                ligne for nom, h in sorted(self.attentes_pool.items())
+                for ligne in _histogramme("tontine_db_pool_wait_seconds", f'pool="{nom}"', h)
+            ])
+            etats = {nom: pool for nom, pool in self.pools.items() if hasattr(pool, "checkedout")}
+            for nom, aide, lire in (
+                ("tontine_db_pool_checked_out", "Connexions empruntées", lambda p: p.checkedout()),
+                ("tontine_db_pool_size", "Taille du pool", lambda p: p.size()),
+                ("tontine_db_pool_overflow", "Connexions en débordement", lambda p: p.overflow()),
+            ):
+                serie(nom, "gauge", aide, [f'{nom}{{pool="{p}"}} {lire(pool)}' for p, pool in sorted(etats.items())])
+        return "\n".join(lignes) + "\n"
+
+def _histogramme(nom: str, etiquettes: str, h: Histogramme):
+    lignes = [f'{nom}_bucket{{{etiquettes},le="{borne}"}} {n}' for borne, n in zip(BUCKETS, h.buckets)]
+    lignes.append(f'{nom}_bucket{{{etiquettes},le="+Inf"}} {h.nombre}')
+    lignes.append(f"{nom}_sum{{{etiquettes}}} {h.somme:.6f}")
+    lignes.append(f"{nom}_count{{{etiquettes}}} {h.nombre}")
+    return lignes
+
+registre = Registre()
+
+# --- Hooks SQLAlchemy ---
+
+# Début porté par le contexte d'exécution (un par instruction) : une instruction en échec n'a pas
+# d'after_cursor_execute, son début disparaît avec le contexte au lieu de décaler les mesures suivantes
+def _avant_execution(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_debut = time.perf_counter()
+
+def _apres_execution(conn, cursor, statement, parameters, context, executemany):
+    debut = getattr(context, "_metrics_debut", None)
+    if debut is None:
+        return
+    duree = time.perf_counter() - debut
+    mesures = _courante.get()
+    if mesures is None:
+        return
+    mesures.requetes += 1
+    mesures.duree_db += duree
+    if DEBUG_N_PLUS_1:
+        mesures.instructions[statement] += 1
+    if SLOW_QUERY_MS and duree * 1000 >= SLOW_QUERY_MS:
+        registre.signaler(registre.requetes_lentes, mesures.route)
+        logger.warning("Requête lente (%.1f ms) sur %s : %s", duree * 1000, mesures.route, " ".join(statement.split()))
+
+_installe = False
+
+def installer():
+    # Écoute au niveau de la classe Engine : couvre le moteur synchrone et le moteur asynchrone (sync_engine)
+    global _installe
+    if not _installe:
+        event.listen(Engine, "before_cursor_execute", _avant_execution)
+        event.listen(Engine, "after_cursor_execute", _apres_execution)
+        _installe = True
+
+# --- Middleware ASGI ---
+
+class MetricsMiddleware:
+    # Middleware ASGI pur (pas BaseHTTPMiddleware) : n'interfère pas avec les réponses en flux
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        mesures = MesuresRequete(scope)
+        jeton = _courante.set(mesures)
+        debut = time.perf_counter()
+        statut = 500
+
+        async def send_instrumente(message):
+            nonlocal statut
+            if message["type"] == "http.response.start":
+                statut = message["status"]
+                # En-têtes HTTP : ASCII uniquement
+                timing = (f'db;dur={mesures.duree_db * 1000:.1f};desc="{mesures.requetes} SQL", '
+                          f"app;dur={(time.perf_counter() - debut) * 1000:.1f}")
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_instrumente)
+        finally:
+            _courante.reset(jeton)
+            registre.enregistrer(scope["method"], statut, time.perf_counter() - debut, mesures)
+            if DEBUG_N_PLUS_1:
+                _detecter_n_plus_1(mesures)
+
+def _detecter_n_plus_1(mesures: MesuresRequete):
+    repetees = [(n, sql) for sql, n in mesures.instructions.items() if n >= N_PLUS_1_SEUIL]
+    if not repetees:
+        return
+    registre.signaler(registre.n_plus_1, mesures.route)
+    for n, sql in sorted(repetees, reverse=True):
+        logger.warning("N+1 probable sur %s : %d exécutions de %s", mesures.route, n, " ".join(sql.split()))
@@ -0,0 +1,254 @@
+import argparse
+import sys
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, TIMESTAMP, MetaData, Table, bindparam, event, func, inspect, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+import models
+from database import Base, get_engine
+
+# Migrations versionnées : chaque étape est appliquée une seule fois et enregistrée dans schema_version.
+# Les étapes sont idempotentes (checkfirst) pour pouvoir reprendre une base créée par create_all.
+# Une étape qui renvoie False est optionnelle et désactivée : elle n'est pas enregistrée et reste en attente.
+
+version_metadata = MetaData()
+schema_version = Table(
+    "schema_version", version_metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(255), nullable=False),
+    Column("date_application", TIMESTAMP, nullable=False),
+)
+
+def _creer_tables(conn: Connection):
+    Base.metadata.create_all(bind=conn, checkfirst=True)
+
+def _initialiser_statistiques(conn: Connection):
+    import statistiques
+    db = Session(bind=conn)
+    statistiques.reconstruire_statistiques(db)
+    db.flush()
+
+def _creer_table(*noms):
+    def etape(conn: Connection):
+        for nom in noms:
+            Base.metadata.tables[nom].create(bind=conn, checkfirst=True)
+    return etape
+
+# Optionnelle (PAIEMENT_UNIQUE_PAR_PERIODE) : hors des modèles pour que create_all ne la pose pas d'office
+def _index_unique_paiements(conn: Connection):
+    import crud
+    if not crud.PAIEMENT_UNIQUE_PAR_PERIODE:
+        return False
+    if "uq_paiements_tontine_utilisateur_periode" not in {i["name"] for i in inspect(conn).get_indexes("paiements")}:
+        doublons = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM paiements GROUP BY id_tontine, id_utilisateur, periode "
+            "HAVING COUNT(*) > 1) d"
+        ).scalar()
+        if doublons:
+            raise RuntimeError(f"{doublons} cotisation(s) en double (tontine, utilisateur, période) : "
+                               "à dédoublonner avant d'activer PAIEMENT_UNIQUE_PAR_PERIODE")
+        conn.exec_driver_sql(
+            "CREATE UNIQUE INDEX uq_paiements_tontine_utilisateur_periode "
+            "ON paiements (id_tontine, id_utilisateur, periode)"
+        )
+
+# Bases antérieures aux index uniques : l'ancien calcul count+1 a pu attribuer deux fois la même position.
+# Positions renumérotées par tontine (ordre position puis id conservé) ; adhésions en double refusées.
+def _index_uniques_membres(conn: Connection):
+    existants = {i["name"] for i in inspect(conn).get_indexes("membres")}
+    if "uq_membres_tontine_utilisateur" not in existants:
+        doublons = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM membres GROUP BY id_tontine, id_utilisateur HAVING COUNT(*) > 1) d"
+        ).scalar()
+        if doublons:
+            raise RuntimeError(f"{doublons} adhésion(s) en double (tontine, utilisateur) : "
+                               "à dédoublonner avant de poser uq_membres_tontine_utilisateur")
+    if "uq_membres_tontine_position" not in existants:
+        M = models.Membre.__table__
+        tontines = [tid for (tid,) in conn.execute(
+            select(M.c.id_tontine).group_by(M.c.id_tontine, M.c.position).having(func.count() > 1).distinct()
+        )]
+        if tontines:
+            renumerotes = []
+            for tid in tontines:
+                ids = conn.execute(select(M.c.id).where(M.c.id_tontine == tid).order_by(M.c.position, M.c.id)).scalars()
+                renumerotes += [{"mid": mid, "rang": rang} for rang, mid in enumerate(ids, start=1)]
+            conn.execute(update(M).where(M.c.id == bindparam("mid")).values(position=bindparam("rang")), renumerotes)
+            print(f"   Positions renumérotées dans {len(tontines)} tontine(s) (positions en double)")
+    _creer_index("uq_membres_tontine_utilisateur", "uq_membres_tontine_position")(conn)
+
+# Un tour par (tontine, période) : les tours en double sont des versements réels, jamais supprimés d'office.
+# L'index unique remplace l'ancien index ix_tours_tontine_periode sur les mêmes colonnes.
+def _index_unique_tours(conn: Connection):
+    existants = {i["name"] for i in inspect(conn).get_indexes("tours")}
+    if "uq_tours_tontine_periode" not in existants:
+        doublons = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM tours GROUP BY id_tontine, periode HAVING COUNT(*) > 1) d"
+        ).scalar()
+        if doublons:
+            raise RuntimeError(f"{doublons} période(s) avec plusieurs tours (tontine, période) : "
+                               "à régulariser avant de poser uq_tours_tontine_periode")
+    _creer_index("uq_tours_tontine_periode")(conn)
+    if "ix_tours_tontine_periode" in existants:
+        # Syntaxe MySQL : DROP INDEX ... ON table ; SQLite : DROP INDEX seul
+        conn.exec_driver_sql("DROP INDEX ix_tours_tontine_periode" + (" ON tours" if conn.dialect.name == "mysql" else ""))
+
+def _ajouter_colonne(table: str, colonne: str):
+    def etape(conn: Connection):
+        if colonne in {c["name"] for c in inspect(conn).get_columns(table)}:
+            return
+        definition = Base.metadata.tables[table].c[colonne]
+        type_sql = definition.type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {colonne} {type_sql} NULL")
+    return etape
+
+def _creer_index(*noms):
+    def etape(conn: Connection):
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in noms:
+                    index.create(bind=conn, checkfirst=True)
+    return etape
+
+MIGRATIONS = [
+    (1, "Tables manquantes (schéma initial, statistiques_tontines)", _creer_tables),
+    (2, "Initialisation des compteurs de statistiques", _initialiser_statistiques),
+    (3, "Index uniques des adhésions (tontine, utilisateur) et (tontine, position)",
+        _index_uniques_membres),
+    (4, "Index composites des requêtes fréquentes",
+        _creer_index(
+            "ix_tontines_tresorier", "ix_membres_utilisateur",
+            "ix_paiements_tontine_id", "ix_paiements_tontine_periode", "ix_paiements_utilisateur",
+            "ix_tours_utilisateur",
+        )),
+    (5, "Table idempotence (réponses rejouables des créations)", _creer_table("idempotence")),
+    (6, "Index unique des paiements (tontine, utilisateur, période) si PAIEMENT_UNIQUE_PAR_PERIODE",
+        _index_unique_paiements),
+    (7, "Table sequence_tontines (identifiants des tontines en mode shardé)", _creer_table("sequence_tontines")),
+    (8, "Tables d'archives des cycles clos (paiements, tours, périodes archivées, cumuls)",
+        _creer_table("paiements_archive", "tours_archive", "archives_tontines", "cotisations_archivees")),
+    (9, "Index unique des tours (tontine, période)", _index_unique_tours),
+    (10, "Colonne utilisateurs.date_suppression (comptes supprimés conservés anonymisés)",
+        _ajouter_colonne("utilisateurs", "date_suppression")),
+]
+
+def versions_appliquees(conn: Connection):
+    version_metadata.create_all(bind=conn, checkfirst=True)
+    return {v for (v,) in conn.execute(select(schema_version.c.version))}
+
+def upgrade(bind=None, verbose: bool = True):
+    bind = bind or get_engine()
+    appliquees = []
+    with bind.begin() as conn:
+        deja = versions_appliquees(conn)
+    for version, description, etape in MIGRATIONS:
+        if version in deja:
+            continue
+        # Une transaction par étape : une étape en échec n'est pas enregistrée et sera rejouée
+        with bind.begin() as conn:
+            if etape(conn) is False:
+                if verbose:
+                    print(f"⏭️  Migration {version} ignorée (désactivée) : {description}")
+                continue
+            conn.execute(schema_version.insert().values(
+                version=version, description=description, date_application=datetime.utcnow()
+            ))
+        appliquees.append(version)
+        if verbose:
+            print(f"✅ Migration {version} appliquée : {description}")
+    return appliquees
+
+def status(bind=None):
+    bind = bind or get_engine()
+    with bind.begin() as conn:
+        deja = versions_appliquees(conn)
+    for version, description, _ in MIGRATIONS:
+        print(f"{'✅' if version in deja else '⏳'} {version:>3}  {description}")
+    return [v for v, _, _ in MIGRATIONS if v not in deja]
+
+# --- Vérification des plans d'exécution ---
+
+# Requêtes critiques de crud.py, exécutées sur la base pour capturer le SQL réel puis passées à EXPLAIN
+def requetes_critiques():
+    import crud
+    return [
+        ("get_utilisateur_by_telephone", lambda db: crud.get_utilisateur_by_telephone(db, "0")),
+        ("get_tontines_by_tresorier", lambda db: crud.get_tontines_by_tresorier(db, 1, limit=10)),
+        ("get_tontines_by_membre", lambda db: crud.get_tontines_by_membre(db, 1, limit=10)),
+        ("get_membres_by_tontine", lambda db: crud.get_membres_by_tontine(db, 1, apres=[0], limit=10)),
+        ("get_membre_by_user_tontine", lambda db: crud.get_membre_by_user_tontine(db, 1, 1)),
+        ("get_membres_by_utilisateur", lambda db: crud.get_membres_by_utilisateur(db, 1)),
+        ("count_membres_tontine", lambda db: crud.count_membres_tontine(db, 1)),
+        ("get_paiements_by_tontine", lambda db: crud.get_paiements_by_tontine(db, 1, apres=[0], limit=10)),
+        ("get_paiements_by_utilisateur", lambda db: crud.get_paiements_by_utilisateur(db, 1, apres=[0], limit=10)),
+        ("get_tours_by_tontine", lambda db: crud.get_tours_by_tontine(db, 1, apres=[0], limit=10)),
+        ("get_statistiques_tontine", lambda db: crud.get_statistiques_tontine(db, 1)),
+    ]
+
+def _scans_complets(conn: Connection, statement: str, parameters):
+    dialecte = conn.dialect.name
+    if dialecte == "sqlite":
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+        # Sous-requêtes (UNION avec l'archive) : leur parcours relit un résultat déjà borné, pas une table
+        sous_requetes = {ligne[-1].split()[-1] for ligne in plan if ligne[-1].startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+        # "SCAN table" sans index = parcours complet ; "SEARCH ... USING INDEX" = accès indexé.
+        # "SEARCH table USING INTEGER PRIMARY KEY (rowid>?)" : seule la borne du curseur keyset est indexée,
+        # le filtre (tontine, utilisateur) est évalué sur toute la table, autre forme de parcours complet
+        return [
+            ligne[-1] for ligne in plan
+            if len(ligne[-1].split()) > 1 and ligne[-1].split()[1] not in sous_requetes and (
+                (ligne[-1].startswith("SCAN ") and " USING " not in ligne[-1] and "CONSTANT ROW" not in ligne[-1])
+                or (ligne[-1].startswith("SEARCH ") and "INTEGER PRIMARY KEY (rowid" in ligne[-1]
+                    and "rowid=" not in ligne[-1])
+            )
+        ]
+    if dialecte == "mysql":
+        result = conn.exec_driver_sql("EXPLAIN " + statement, parameters)
+        colonnes = list(result.keys())
+        return [
+            f"{ligne[colonnes.index('table')]}: type=ALL" for ligne in result.fetchall()
+            if ligne[colonnes.index("type")] == "ALL"
+        ]
+    raise RuntimeError(f"EXPLAIN non pris en charge pour le dialecte {dialecte}")
+
+# Parcours complets des SELECT émis par `appel(db)`, transaction annulée ensuite
+def scans_complets(bind, appel):
+    captures = []
+    def capturer(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captures.append((statement, parameters))
+    with bind.connect() as conn:
+        event.listen(conn, "before_cursor_execute", capturer)
+        db = Session(bind=conn)
+        try:
+            appel(db)
+        finally:
+            event.remove(conn, "before_cursor_execute", capturer)
+            db.rollback()
+        return [scan for statement, parameters in captures for scan in _scans_complets(conn, statement, parameters)]
+
+def check(bind=None):
+    bind = bind or get_engine()
+    echecs = {}
+    for nom, appel in requetes_critiques():
+        scans = scans_complets(bind, appel)
+        if scans:
+            echecs[nom] = scans
+        print(f"{'❌' if scans else '✅'} {nom}" + (f" : {', '.join(scans)}" if scans else ""))
+    return echecs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrations du schéma de la base tontine")
+    parser.add_argument("commande", nargs="?", default="upgrade", choices=["upgrade", "status", "check"])
+    args = parser.parse_args(argv)
+    if args.commande == "upgrade":
+        if not upgrade():
+            print("✅ Schéma à jour")
+        return 0
+    if args.commande == "status":
+        status()
+        return 0
+    return 1 if check() else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Enum, Date, TIMESTAMP, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Enum, Date, TIMESTAMP, ForeignKey, Index, PrimaryKeyConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -13,6 +13,8 @@ class Utilisateur(Base):
     mot_de_passe = Column(String(255), nullable=False)
     role = Column(Enum('membre', 'trésorier', 'admin', name='role_enum'), default='membre')
     date_creation = Column(TIMESTAMP, server_default=func.now())
+    # Compte supprimé : ligne conservée (anonymisée) pour les paiements et tours qui y font référence
+    date_suppression = Column(TIMESTAMP, nullable=True)
     
     tontines_crees = relationship("Tontine", back_populates="tresorier")
     membres = relationship("Membre", back_populates="utilisateur")
@@ -37,6 +39,10 @@ class Tontine(Base):
     membres = relationship("Membre", back_populates="tontine")
     paiements = relationship("Paiement", back_populates="tontine")
     tours = relationship("Tour", back_populates="tontine")
+    
+    __table_args__ = (
+        Index('ix_tontines_tresorier', 'id_tresorier'),
+    )
 
 class Membre(Base):
     __tablename__ = "membres"
@@ -49,6 +55,15 @@ class Membre(Base):
     
     tontine = relationship("Tontine", back_populates="membres")
     utilisateur = relationship("Utilisateur", back_populates="membres")
+    
+    # Garanties en base : une seule adhésion par utilisateur et une position unique par tontine
+    __table_args__ = (
+        Index('uq_membres_tontine_utilisateur', 'id_tontine', 'id_utilisateur', unique=True),
+        Index('uq_membres_tontine_position', 'id_tontine', 'position', unique=True),
+        Index('ix_membres_utilisateur', 'id_utilisateur', 'id_tontine'),
+        # SQLite : AUTOINCREMENT, pour que chaque shard garde sa propre plage d'identifiants (shards.py)
+        {'sqlite_autoincrement': True},
+    )
 
 class Paiement(Base):
     __tablename__ = "paiements"
@@ -62,6 +77,15 @@ class Paiement(Base):
     
     tontine = relationship("Tontine", back_populates="paiements")
     payeur = relationship("Utilisateur", back_populates="paiements")
+    
+    # (id_tontine, id) sert les listes paginées par tontine, (id_tontine, periode) les filtres et
+    # regroupements par période, (id_utilisateur, ...) l'historique d'un membre
+    __table_args__ = (
+        Index('ix_paiements_tontine_id', 'id_tontine', 'id'),
+        Index('ix_paiements_tontine_periode', 'id_tontine', 'periode'),
+        Index('ix_paiements_utilisateur', 'id_utilisateur', 'id_tontine', 'periode'),
+        {'sqlite_autoincrement': True},
+    )
 
 class Tour(Base):
     __tablename__ = "tours"
@@ -74,4 +98,101 @@ class Tour(Base):
     date_reception = Column(TIMESTAMP, server_default=func.now())
     
     tontine = relationship("Tontine", back_populates="tours")
-    beneficiaire = relationship("Utilisateur", back_populates="tours")
\ No newline at end of file
+    beneficiaire = relationship("Utilisateur", back_populates="tours")
+    
+    __table_args__ = (
+        # Un seul bénéficiaire par période : le scheduler peut tourner deux fois sans doubler les versements
+        Index('uq_tours_tontine_periode', 'id_tontine', 'periode', unique=True),
+        Index('ix_tours_utilisateur', 'id_utilisateur'),
+        {'sqlite_autoincrement': True},
+    )
+
+# Compteurs maintenus à chaque écriture (paiement, tour, adhésion, retrait) dans la même transaction
+class StatistiqueTontine(Base):
+    __tablename__ = "statistiques_tontines"
+    
+    id_tontine = Column(Integer, ForeignKey('tontines.id'), primary_key=True)
+    total_cotisations = Column(BigInteger, nullable=False, default=0, server_default="0")
+    total_distribue = Column(BigInteger, nullable=False, default=0, server_default="0")
+    membres_actifs = Column(Integer, nullable=False, default=0, server_default="0")
+    tours_realises = Column(Integer, nullable=False, default=0, server_default="0")
+
+# --- Archives des cycles clos (archivage.py) ---
+# Mêmes colonnes que les tables chaudes, ids d'origine conservés : une lecture peut réunir les deux (UNION ALL)
+
+class PaiementArchive(Base):
+    __tablename__ = "paiements_archive"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    id_tontine = Column(Integer, ForeignKey('tontines.id'), nullable=False)
+    id_utilisateur = Column(Integer, ForeignKey('utilisateurs.id'), nullable=False)
+    montant = Column(Integer, nullable=False)
+    periode = Column(Integer, nullable=False)
+    date_versement = Column(TIMESTAMP)
+    
+    __table_args__ = (
+        Index('ix_paiements_archive_tontine_id', 'id_tontine', 'id'),
+        Index('ix_paiements_archive_tontine_periode', 'id_tontine', 'periode'),
+        Index('ix_paiements_archive_utilisateur', 'id_utilisateur', 'id_tontine', 'periode'),
+    )
+
+class TourArchive(Base):
+    __tablename__ = "tours_archive"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    id_tontine = Column(Integer, ForeignKey('tontines.id'), nullable=False)
+    id_utilisateur = Column(Integer, ForeignKey('utilisateurs.id'), nullable=False)
+    periode = Column(Integer, nullable=False)
+    montant_recu = Column(Integer, nullable=False)
+    date_reception = Column(TIMESTAMP)
+    
+    __table_args__ = (
+        Index('ix_tours_archive_tontine_periode', 'id_tontine', 'periode'),
+        Index('ix_tours_archive_utilisateur', 'id_utilisateur'),
+    )
+
+# Périodes archivées par tontine : toutes les lignes de période <= periode_archivee sont dans les archives
+class ArchiveTontine(Base):
+    __tablename__ = "archives_tontines"
+    
+    id_tontine = Column(Integer, ForeignKey('tontines.id'), primary_key=True)
+    periode_archivee = Column(Integer, nullable=False)
+    date_archivage = Column(TIMESTAMP, nullable=False)
+
+# Cumul des cotisations archivées par membre : les totaux (priorité, tableau de bord) ne relisent pas l'archive
+class CotisationArchivee(Base):
+    __tablename__ = "cotisations_archivees"
+    
+    id_tontine = Column(Integer, ForeignKey('tontines.id'), nullable=False)
+    id_utilisateur = Column(Integer, ForeignKey('utilisateurs.id'), nullable=False)
+    montant = Column(BigInteger, nullable=False, default=0, server_default="0")
+    
+    __table_args__ = (
+        PrimaryKeyConstraint('id_tontine', 'id_utilisateur'),
+    )
+
+# Réponses des créations rejouables (en-tête Idempotency-Key), une clé par utilisateur
+class Idempotence(Base):
+    __tablename__ = "idempotence"
+    
+    id = Column(Integer, primary_key=True)
+    id_utilisateur = Column(Integer, nullable=False)
+    cle = Column(String(255), nullable=False)
+    route = Column(String(50), nullable=False)
+    empreinte = Column(String(64), nullable=False)
+    statut = Column(Integer, nullable=False)
+    corps = Column(Text, nullable=False)
+    date_creation = Column(TIMESTAMP, nullable=False)
+    
+    __table_args__ = (
+        Index('uq_idempotence_utilisateur_cle', 'id_utilisateur', 'cle', unique=True),
+        Index('ix_idempotence_date', 'date_creation'),
+    )
+
+# Identifiants des tontines en mode shardé, alloués dans la base globale : l'id choisit le shard (shards.py)
+class SequenceTontine(Base):
+    __tablename__ = "sequence_tontines"
+    
+    id = Column(Integer, primary_key=True)
+    
+    __table_args__ = {'sqlite_autoincrement': True}
@@ -0,0 +1,71 @@
+import base64
+import json
+import os
+from datetime import date, datetime
+from typing import Callable, List, Optional, Sequence
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import and_, or_
+import config
+
+# Taille de page par défaut et plafond imposé par le serveur (le client ne peut pas le dépasser)
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 500))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def taille_page(limit: Optional[int]) -> int:
+    return max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+# Curseur opaque : valeurs de la clé de tri du dernier élément, en JSON base64 url-safe
+def encoder_curseur(valeurs: Sequence) -> str:
+    brut = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in valeurs])
+    return base64.urlsafe_b64encode(brut.encode()).decode().rstrip("=")
+
+def decoder_curseur(curseur: Optional[str], colonnes: Sequence) -> Optional[list]:
+    if not curseur:
+        return None
+    try:
+        brut = base64.urlsafe_b64decode(curseur + "=" * (-len(curseur) % 4))
+        valeurs = json.loads(brut)
+        if not isinstance(valeurs, list) or len(valeurs) != len(colonnes):
+            raise ValueError(curseur)
+        return [_convertir(colonne, valeur) for colonne, valeur in zip(colonnes, valeurs)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+
+def _convertir(colonne, valeur):
+    if valeur is None:
+        return None
+    type_python = colonne.type.python_type
+    if type_python is datetime:
+        return datetime.fromisoformat(valeur)
+    if type_python is date:
+        return date.fromisoformat(valeur)
+    return type_python(valeur)
+
+# Filtre "strictement après" sur une clé composite, développé en OR/AND pour rester exploitable par les index
+def apres(colonnes: Sequence, valeurs: Sequence):
+    conditions = []
+    for i, colonne in enumerate(colonnes):
+        egalites = [colonnes[j] == valeurs[j] for j in range(i)]
+        conditions.append(and_(*egalites, colonne > valeurs[i]))
+    return or_(*conditions)
+
+def keyset(query, colonnes: Sequence, apres_valeurs: Optional[Sequence] = None, limit: Optional[int] = None):
+    if apres_valeurs is not None:
+        query = query.filter(apres(colonnes, apres_valeurs))
+    query = query.order_by(*colonnes)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+# Les crud sont appelés avec limit = taille + 1 : l'élément en trop signale qu'une page suivante existe
+def page(request: Request, response: Response, items: List, taille: int, cle: Callable) -> List:
+    if len(items) <= taille:
+        return items
+    items = items[:taille]
+    curseur = encoder_curseur(cle(items[-1]))
+    response.headers[NEXT_CURSOR_HEADER] = curseur
+    suivante = request.url.include_query_params(cursor=curseur, limit=taille)
+    response.headers["Link"] = f'<{suivante}>; rel="next"'
+    return items
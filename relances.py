@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import date
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import Column, Date, Integer, MetaData, String, Table, and_, insert, or_, select
+import config
+import database
+import models
+import scheduler
+
+# Relances des cotisations : chaque membre d'une tontine démarrée sans paiement pour la période courante
+# reçoit un rappel (SMS, email...) via un canal d'envoi. À lancer à chaque échéance, par fréquence :
+#   python relances.py run --frequence journalier            # chaque jour
+#   python relances.py run --frequence hebdomadaire          # chaque semaine, etc.
+# Les membres sont lus par lots (keyset sur membres.id) et envoyés par un pool borné de tâches asyncio :
+# la mémoire ne dépend pas du nombre de membres. Un point de reprise est écrit après chaque lot envoyé ;
+# une passe interrompue reprend au lot suivant (le lot en cours d'envoi peut être renvoyé).
+
+logger = logging.getLogger("tontine.relances")
+
+# Canal d'envoi : "fichier" (NDJSON dans RELANCES_FICHIER) ou "journal" (logger tontine.relances)
+RELANCES_CANAL = os.getenv("RELANCES_CANAL", "fichier")
+RELANCES_FICHIER = os.getenv("RELANCES_FICHIER", "relances.ndjson")
+# Point de reprise de la dernière passe (derniers membres envoyés par base)
+RELANCES_CHECKPOINT = os.getenv("RELANCES_CHECKPOINT", "relances.checkpoint.json")
+# Membres lus par requête, envois simultanés, et débit maximal (messages par seconde, 0 = illimité)
+RELANCES_TAILLE_LOT = int(os.getenv("RELANCES_TAILLE_LOT", 1000))
+RELANCES_WORKERS = int(os.getenv("RELANCES_WORKERS", 8))
+RELANCES_DEBIT = float(os.getenv("RELANCES_DEBIT", 0))
+
+FREQUENCES = ("journalier", "hebdomadaire", "mensuel")
+
+
+@dataclass
+class Relance:
+    id_membre: int
+    id_tontine: int
+    nom_tontine: str
+    periode: int
+    montant: int
+    # La période précédente est aussi impayée
+    retard: bool
+    id_utilisateur: int
+    nom_utilisateur: str
+    telephone: str
+    email: str
+
+    def message(self) -> str:
+        texte = (f"Bonjour {self.nom_utilisateur}, votre cotisation de {self.montant} pour la période {self.periode} "
+                 f"de la tontine « {self.nom_tontine} » est attendue.")
+        if self.retard:
+            texte += " La cotisation de la période précédente est également impayée."
+        return texte
+
+
+# --- Canaux d'envoi ---
+# Un fournisseur SMS ou email hérite de Canal et implémente envoyer() ; set_canal() l'installe.
+
+class Canal(ABC):
+    @abstractmethod
+    async def envoyer(self, relance: Relance):
+        ...
+
+    # Appelé avant chaque point de reprise : ce qui est compté comme envoyé doit être parti
+    async def vider(self):
+        pass
+
+    async def fermer(self):
+        pass
+
+
+# Remplaçant local : une ligne JSON par relance, pour les essais et la recette
+class FichierCanal(Canal):
+    def __init__(self, chemin: str = RELANCES_FICHIER):
+        self._fichier = open(chemin, "a", encoding="utf-8")
+
+    async def envoyer(self, relance: Relance):
+        self._fichier.write(json.dumps({**asdict(relance), "message": relance.message()}, ensure_ascii=False) + "\n")
+
+    async def vider(self):
+        self._fichier.flush()
+
+    async def fermer(self):
+        self._fichier.close()
+
+
+class JournalCanal(Canal):
+    async def envoyer(self, relance: Relance):
+        logger.info("Relance %s <%s> : %s", relance.telephone, relance.email, relance.message())
+
+
+_canal = None
+
+def _creer_canal() -> Canal:
+    if RELANCES_CANAL == "journal":
+        return JournalCanal()
+    if RELANCES_CANAL == "fichier":
+        return FichierCanal()
+    raise RuntimeError(f"Canal de relance inconnu : {RELANCES_CANAL}")
+
+def get_canal() -> Canal:
+    global _canal
+    if _canal is None:
+        _canal = _creer_canal()
+    return _canal
+
+def set_canal(canal: Canal):
+    global _canal
+    _canal = canal
+
+# --- Débit ---
+
+# Créneaux espacés de 1/débit secondes, partagés par toutes les tâches d'envoi (une seule boucle asyncio)
+class Limiteur:
+    def __init__(self, debit: float = RELANCES_DEBIT):
+        self.intervalle = 1 / debit if debit > 0 else 0
+        self._prochain = 0.0
+
+    async def attendre(self):
+        if not self.intervalle:
+            return
+        maintenant = asyncio.get_running_loop().time()
+        creneau = max(self._prochain, maintenant)
+        self._prochain = creneau + self.intervalle
+        if creneau > maintenant:
+            await asyncio.sleep(creneau - maintenant)
+
+# --- Points de reprise ---
+
+def _lire_reprise(cle: str) -> dict:
+    try:
+        with open(RELANCES_CHECKPOINT, encoding="utf-8") as f:
+            reprise = json.load(f)
+    except (OSError, ValueError):
+        return {"cle": cle, "bases": {}, "termine": False}
+    if reprise.get("cle") != cle:
+        return {"cle": cle, "bases": {}, "termine": False}
+    return reprise
+
+def _ecrire_reprise(reprise: dict):
+    # Remplacement atomique : un arrêt pendant l'écriture laisse l'ancien point de reprise intact
+    provisoire = RELANCES_CHECKPOINT + ".tmp"
+    with open(provisoire, "w", encoding="utf-8") as f:
+        json.dump(reprise, f)
+    os.replace(provisoire, RELANCES_CHECKPOINT)
+
+# --- Lecture ensembliste ---
+
+# Période courante de chaque tontine démarrée, calculée en Python (calendrier mensuel) puis posée dans une
+# table temporaire : la recherche des impayés reste une seule requête jointe, quel que soit le nombre de tontines
+_PERIODES = Table(
+    "relances_periodes", MetaData(),
+    Column("id_tontine", Integer, primary_key=True),
+    Column("nom", String(100)),
+    Column("periode", Integer, nullable=False),
+    Column("debut", Date, nullable=False),
+    Column("montant", Integer, nullable=False),
+    prefixes=["TEMPORARY"],
+)
+
+def _poser_periodes(conn, jour: date, frequences: Iterable[str]):
+    # Connexion du pool : la table d'une passe interrompue peut y survivre
+    _PERIODES.drop(conn, checkfirst=True)
+    _PERIODES.create(conn)
+    T = models.Tontine.__table__
+    resultat = conn.execution_options(yield_per=RELANCES_TAILLE_LOT).execute(
+        select(T.c.id, T.c.nom, T.c.frequence, T.c.date_demarrage, T.c.montant_cotisation)
+        .where(T.c.date_demarrage <= jour, T.c.frequence.in_(list(frequences)))
+    )
+    for lot in resultat.partitions():
+        lignes = []
+        for t in lot:
+            periode = scheduler.periode_courante(t.frequence, t.date_demarrage, jour)
+            lignes.append({"id_tontine": t.id, "nom": t.nom, "periode": periode, "montant": t.montant_cotisation,
+                           "debut": scheduler.date_periode(t.frequence, t.date_demarrage, periode)})
+        if lignes:
+            conn.execute(insert(_PERIODES), lignes)
+
+def _paye(table, periode):
+    M = models.Membre.__table__
+    return select(1).where(
+        table.c.id_utilisateur == M.c.id_utilisateur, table.c.id_tontine == M.c.id_tontine, table.c.periode == periode
+    ).exists()
+
+# Membres sans paiement pour la période courante, après `dernier` (keyset) : NOT EXISTS servi par
+# ix_paiements_utilisateur. La période précédente peut être archivée (ARCHIVE_CYCLES_CONSERVES=0) : archive relue.
+def _select_impayes(dernier: int, taille: int):
+    M, P, A = models.Membre.__table__, models.Paiement.__table__, models.PaiementArchive.__table__
+    precedente = _PERIODES.c.periode - 1
+    retard = and_(
+        _PERIODES.c.periode > 1, M.c.date_adhesion < _PERIODES.c.debut,
+        ~or_(_paye(P, precedente), _paye(A, precedente)),
+    )
+    return (
+        select(M.c.id, M.c.id_tontine, M.c.id_utilisateur, _PERIODES.c.nom, _PERIODES.c.periode,
+               _PERIODES.c.montant, retard.label("retard"))
+        .join(_PERIODES, _PERIODES.c.id_tontine == M.c.id_tontine)
+        .where(M.c.id > dernier, ~_paye(P, _PERIODES.c.periode))
+        .order_by(M.c.id)
+        .limit(taille)
+    )
+
+# Un lot de relances : membres impayés de la base, coordonnées lues dans la base globale (utilisateurs).
+# Renvoie aussi le dernier membre lu (None en fin de table) : le lot peut être vide si aucun membre n'a de
+# coordonnées, la lecture continue quand même après lui.
+def _lire_lot(conn, dernier: int, taille: int) -> Tuple[List[Relance], Optional[int]]:
+    lignes = conn.execute(_select_impayes(dernier, taille)).all()
+    if not lignes:
+        return [], None
+    U = models.Utilisateur.__table__
+    with database.get_engine().connect() as globale:
+        contacts = {u.id: u for u in globale.execute(
+            select(U.c.id, U.c.nom_utilisateur, U.c.telephone, U.c.email)
+            .where(U.c.id.in_({l.id_utilisateur for l in lignes}))
+        )}
+    return [
+        Relance(l.id, l.id_tontine, l.nom, l.periode, l.montant, bool(l.retard), l.id_utilisateur,
+                contacts[l.id_utilisateur].nom_utilisateur, contacts[l.id_utilisateur].telephone,
+                contacts[l.id_utilisateur].email)
+        for l in lignes if l.id_utilisateur in contacts
+    ], lignes[-1].id
+
+def _bases() -> dict:
+    if database.DATABASE_SHARD_URLS:
+        return database.get_shard_engines()
+    return {"global": database.get_engine()}
+
+# --- Passe complète ---
+
+async def relancer(jour: Optional[date] = None, frequences: Optional[Iterable[str]] = None, dry_run: bool = False,
+                   recommencer: bool = False, canal: Optional[Canal] = None) -> dict:
+    jour = jour or date.today()
+    frequences = sorted(set(frequences or FREQUENCES))
+    reprise = _lire_reprise(f"{jour.isoformat()}:{','.join(frequences)}")
+    if recommencer or dry_run:
+        reprise.update(bases={}, termine=False)
+    resume = {"date": jour.isoformat(), "frequences": frequences, "dry_run": dry_run, "relances": 0, "retards": 0,
+              "envoyees": 0, "echecs": 0, "deja_effectuee": reprise["termine"]}
+    if reprise["termine"]:
+        return resume
+
+    canal = canal or (None if dry_run else get_canal())
+    limiteur = Limiteur()
+    file = asyncio.Queue(RELANCES_WORKERS * 2)
+
+    async def ouvrier():
+        while True:
+            relance = await file.get()
+            try:
+                await limiteur.attendre()
+                await canal.envoyer(relance)
+                resume["envoyees"] += 1
+            except Exception:
+                resume["echecs"] += 1
+                logger.exception("Relance du membre %s non envoyée", relance.id_membre)
+            finally:
+                file.task_done()
+
+    ouvriers = [asyncio.create_task(ouvrier()) for _ in range(RELANCES_WORKERS)] if not dry_run else []
+    try:
+        for nom, moteur in _bases().items():
+            dernier = reprise["bases"].get(nom, 0)
+            conn = await asyncio.to_thread(moteur.connect)
+            lecture = None
+            try:
+                await asyncio.to_thread(_poser_periodes, conn, jour, frequences)
+                # Lot suivant lu pendant l'envoi du lot courant
+                lecture = asyncio.create_task(asyncio.to_thread(_lire_lot, conn, dernier, RELANCES_TAILLE_LOT))
+                while True:
+                    lot, fin = await lecture
+                    if fin is None:
+                        break
+                    lecture = asyncio.create_task(asyncio.to_thread(_lire_lot, conn, fin, RELANCES_TAILLE_LOT))
+                    resume["relances"] += len(lot)
+                    resume["retards"] += sum(1 for r in lot if r.retard)
+                    if dry_run:
+                        continue
+                    for relance in lot:
+                        await file.put(relance)
+                    await file.join()
+                    await canal.vider()
+                    reprise["bases"][nom] = fin
+                    await asyncio.to_thread(_ecrire_reprise, reprise)
+            finally:
+                if lecture is not None and not lecture.done():
+                    # Interruption : la lecture en cours utilise encore la connexion
+                    await asyncio.wait([lecture])
+                await asyncio.to_thread(_PERIODES.drop, conn, True)
+                await asyncio.to_thread(conn.close)
+        if not dry_run:
+            reprise["termine"] = True
+            await asyncio.to_thread(_ecrire_reprise, reprise)
+    finally:
+        for tache in ouvriers:
+            tache.cancel()
+    return resume
+
+# --- Passes lancées par l'API (POST /admin/relances) ---
+# Exécutées en tâche de fond dans la boucle du worker, suivies par identifiant (GET /admin/relances/{id}).
+# Une seule passe à la fois par worker : elles partagent le point de reprise.
+
+# Passes terminées conservées pour consultation
+RELANCES_PASSES_CONSERVEES = 20
+
+_passes = OrderedDict()  # id -> état de la passe
+
+def passe_en_cours() -> Optional[dict]:
+    return next((p for p in _passes.values() if p["etat"] == "en_cours"), None)
+
+def lancer(jour: Optional[date] = None, frequences: Optional[Iterable[str]] = None, dry_run: bool = False,
+           recommencer: bool = False) -> dict:
+    passe = {"id": uuid.uuid4().hex, "etat": "en_cours", "resume": None, "erreur": None}
+    _passes[passe["id"]] = passe
+    while len(_passes) > RELANCES_PASSES_CONSERVEES:
+        ancienne = next(iter(_passes))
+        if _passes[ancienne]["etat"] == "en_cours":
+            break
+        del _passes[ancienne]
+    tache = asyncio.get_running_loop().create_task(_executer(passe, jour, frequences, dry_run, recommencer))
+    # Référence gardée jusqu'à la fin : une tâche sans référence peut être collectée en cours de route
+    passe["tache"] = tache
+    tache.add_done_callback(lambda _: passe.pop("tache", None))
+    return etat_passe(passe["id"])
+
+async def _executer(passe: dict, jour, frequences, dry_run: bool, recommencer: bool):
+    # Canal propre à la passe s'il n'y en a pas d'installé (set_canal) : fichier fermé à la fin, même en échec
+    canal = None if dry_run else (_canal or _creer_canal())
+    try:
+        passe["resume"] = await relancer(jour, frequences, dry_run, recommencer, canal)
+        passe["etat"] = "terminee"
+    except Exception as e:
+        logger.exception("Passe de relances %s interrompue", passe["id"])
+        passe["etat"], passe["erreur"] = "echec", str(e)
+    finally:
+        if canal is not None:
+            try:
+                await (canal.vider() if canal is _canal else canal.fermer())
+            except Exception:
+                logger.exception("Fermeture du canal de relances")
+
+def etat_passe(passe_id: str) -> Optional[dict]:
+    passe = _passes.get(passe_id)
+    if passe is None:
+        return None
+    return {cle: valeur for cle, valeur in passe.items() if cle != "tache"}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relances des cotisations impayées de la période courante")
+    parser.add_argument("commande", choices=["run"])
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Date de référence (défaut : aujourd'hui)")
+    parser.add_argument("--frequence", choices=FREQUENCES, action="append", help="Limiter à une fréquence (répétable)")
+    parser.add_argument("--dry-run", action="store_true", help="Compte les relances sans les envoyer")
+    parser.add_argument("--recommencer", action="store_true", help="Ignore le point de reprise de la même passe")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        resume = asyncio.run(relancer(args.date, args.frequence, args.dry_run, args.recommencer))
+    finally:
+        if _canal is not None:
+            asyncio.run(_canal.fermer())
+    if resume["deja_effectuee"]:
+        print(f"⏭️  Relances du {resume['date']} déjà envoyées (--recommencer pour les renvoyer)")
+    elif args.dry_run:
+        print(f"⏭️  {resume['relances']} relance(s) à envoyer dont {resume['retards']} en retard (dry-run)")
+    else:
+        print(f"✅ {resume['envoyees']} relance(s) envoyée(s) dont {resume['retards']} en retard, {resume['echecs']} échec(s)")
+    return 0 if not resume["echecs"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
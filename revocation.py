@@ -0,0 +1,120 @@
+import os
+import time
+import threading
+from typing import Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+import config
+
+# Durée de vie d'une révocation : au-delà, tout jeton émis avant la révocation a expiré de lui-même
+REVOCATION_TTL_SECONDS = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30)) * 60
+# Backend partagé entre workers (ex : redis://localhost:6379/0). Vide = mémoire du processus
+REVOCATION_BACKEND_URL = os.getenv("REVOCATION_BACKEND_URL", "")
+# Backend Redis : réponse gardée localement N secondes par utilisateur (délai max de prise en compte d'une
+# révocation faite par un autre worker). 0 = Redis interrogé à chaque requête
+REVOCATION_CACHE_SECONDS = float(os.getenv("REVOCATION_CACHE_SECONDS", 2))
+
+
+# Révocations en mémoire du processus : id utilisateur -> instant de révocation
+class MemoryRevocationStore:
+    def __init__(self, ttl: int = REVOCATION_TTL_SECONDS):
+        self.ttl = ttl
+        self._revocations = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, utilisateur_id: int, instant: Optional[float] = None):
+        instant = instant if instant is not None else time.time()
+        with self._lock:
+            self._purger(time.time())
+            self._revocations[utilisateur_id] = (instant, instant + self.ttl)
+
+    def revoked_since(self, utilisateur_id: int) -> Optional[float]:
+        entry = self._revocations.get(utilisateur_id)
+        if entry is None:
+            return None
+        instant, expire = entry
+        if expire < time.time():
+            with self._lock:
+                self._revocations.pop(utilisateur_id, None)
+            return None
+        return instant
+
+    # Lecture en mémoire, jamais bloquante : toujours disponible sans passer par un thread
+    def en_cache(self, utilisateur_id: int) -> Tuple[bool, Optional[float]]:
+        return True, self.revoked_since(utilisateur_id)
+
+    def _purger(self, maintenant: float):
+        expirees = [uid for uid, (_, expire) in self._revocations.items() if expire < maintenant]
+        for uid in expirees:
+            del self._revocations[uid]
+
+
+# Révocations partagées entre workers via Redis (clé expirante par utilisateur)
+class RedisRevocationStore:
+    def __init__(self, url: str, ttl: int = REVOCATION_TTL_SECONDS, prefix: str = "tontine:revocation:",
+                 cache_seconds: float = REVOCATION_CACHE_SECONDS, max_entries: int = 10000):
+        import redis  # dépendance optionnelle, uniquement si REVOCATION_BACKEND_URL est défini
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.cache_seconds = cache_seconds
+        self.max_entries = max_entries
+        self._cache = {}  # id utilisateur -> (instant de révocation ou None, expiration locale)
+
+    def revoke(self, utilisateur_id: int, instant: Optional[float] = None):
+        instant = instant if instant is not None else time.time()
+        self.client.set(f"{self.prefix}{utilisateur_id}", repr(instant), ex=self.ttl)
+        # Prise en compte immédiate dans ce worker
+        self._memoriser(utilisateur_id, instant)
+
+    def revoked_since(self, utilisateur_id: int) -> Optional[float]:
+        valeur = self.client.get(f"{self.prefix}{utilisateur_id}")
+        instant = float(valeur) if valeur is not None else None
+        self._memoriser(utilisateur_id, instant)
+        return instant
+
+    def en_cache(self, utilisateur_id: int) -> Tuple[bool, Optional[float]]:
+        entree = self._cache.get(utilisateur_id)
+        if entree is None or entree[1] < time.monotonic():
+            return False, None
+        return True, entree[0]
+
+    def _memoriser(self, utilisateur_id: int, instant: Optional[float]):
+        if not self.cache_seconds:
+            return
+        if len(self._cache) >= self.max_entries:
+            # Remise à zéro plutôt qu'une éviction fine : le cache ne fait qu'éviter des allers-retours Redis
+            self._cache = {}
+        self._cache[utilisateur_id] = (instant, time.monotonic() + self.cache_seconds)
+
+
+_store = None
+
+def get_revocation_store():
+    global _store
+    if _store is None:
+        if REVOCATION_BACKEND_URL:
+            _store = RedisRevocationStore(REVOCATION_BACKEND_URL)
+        else:
+            _store = MemoryRevocationStore()
+    return _store
+
+def set_revocation_store(store):
+    global _store
+    _store = store
+
+def revoquer_utilisateur(utilisateur_id: int):
+    get_revocation_store().revoke(utilisateur_id)
+
+def est_revoque(utilisateur_id: int, emis_le: float) -> bool:
+    # Un jeton est révoqué s'il a été émis avant (ou au moment de) la dernière révocation
+    revoque_le = get_revocation_store().revoked_since(utilisateur_id)
+    return revoque_le is not None and emis_le <= revoque_le
+
+# Variante pour la boucle asyncio (get_current_user) : le cache local répond sans bloquer,
+# sinon l'appel réseau au backend part dans le pool de threads
+async def est_revoque_async(utilisateur_id: int, emis_le: float) -> bool:
+    store = get_revocation_store()
+    trouve, revoque_le = store.en_cache(utilisateur_id)
+    if not trouve:
+        revoque_le = await run_in_threadpool(store.revoked_since, utilisateur_id)
+    return revoque_le is not None and emis_le <= revoque_le
@@ -0,0 +1,260 @@
+import argparse
+import calendar
+import heapq
+import os
+import random
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.orm import Session
+import archivage
+import config
+import cache
+import evenements
+import models
+import statistiques
+
+# Sel de la permutation 'aléatoire' : même sel + même tontine + même cycle = même ordre
+SCHEDULER_SEED = os.getenv("SCHEDULER_SEED", "tontine")
+
+# --- Calendrier des périodes ---
+
+def _ajouter_mois(d: date, mois: int) -> date:
+    annee, mois_index = divmod(d.month - 1 + mois, 12)
+    annee += d.year
+    jour = min(d.day, calendar.monthrange(annee, mois_index + 1)[1])
+    return date(annee, mois_index + 1, jour)
+
+# Période 1 = première période à partir de date_demarrage ; 0 si la tontine n'a pas démarré
+def periode_courante(frequence: str, date_demarrage: date, jour: date) -> int:
+    if jour < date_demarrage:
+        return 0
+    if frequence == "journalier":
+        return (jour - date_demarrage).days + 1
+    if frequence == "hebdomadaire":
+        return (jour - date_demarrage).days // 7 + 1
+    mois = (jour.year - date_demarrage.year) * 12 + jour.month - date_demarrage.month
+    if _ajouter_mois(date_demarrage, mois) > jour:
+        mois -= 1
+    return mois + 1
+
+def date_periode(frequence: str, date_demarrage: date, periode: int) -> date:
+    if frequence == "journalier":
+        return date_demarrage + timedelta(days=periode - 1)
+    if frequence == "hebdomadaire":
+        return date_demarrage + timedelta(weeks=periode - 1)
+    return _ajouter_mois(date_demarrage, periode - 1)
+
+# --- Ordre de rotation ---
+
+@dataclass
+class EtatRotation:
+    id_tontine: int
+    periode_courante: int
+    montant_tour: int
+    # Tours des périodes échues sans bénéficiaire : (periode, id_utilisateur)
+    tours_dus: List[Tuple[int, int]] = field(default_factory=list)
+    # Prochain tour à venir (après la période courante) : (periode, id_utilisateur, date)
+    prochain_tour: Optional[Tuple[int, int, date]] = None
+
+def _ordre_cycle(mode: str, tontine_id: int, cycle: int, membres: List[Tuple[int, int]],
+                 restants: set, payes: Dict[int, int]) -> List[int]:
+    # membres : [(position, id_utilisateur)] triés par position
+    if mode == "aléatoire":
+        ordre = [uid for _, uid in membres]
+        random.Random(f"{SCHEDULER_SEED}:{tontine_id}:{cycle}").shuffle(ordre)
+        return [uid for uid in ordre if uid in restants]
+    if mode == "priorité":
+        # File de priorité : les meilleurs cotisants d'abord, la position départage
+        tas = [(-payes.get(uid, 0), position, uid) for position, uid in membres if uid in restants]
+        heapq.heapify(tas)
+        return [heapq.heappop(tas)[2] for _ in range(len(tas))]
+    return [uid for _, uid in membres if uid in restants]
+
+# borne None : aucun tour ni archive. Sans rattrapage, seul le cycle en cours est planifié : une tontine
+# démarrée avant la mise en service du scheduler ne reçoit pas de versements fictifs pour les cycles passés.
+def _planifier_tontine(tontine, jour: date, membres, tours, payes, borne: Optional[int] = None,
+                       rattrapage: bool = False) -> EtatRotation:
+    courante = periode_courante(tontine.frequence, tontine.date_demarrage, jour)
+    etat = EtatRotation(tontine.id, courante, tontine.montant_cotisation * len(membres))
+    if not membres:
+        return etat
+    n = len(membres)
+    if borne is None:
+        borne = 0 if rattrapage else max(courante - 1, 0) // n * n
+    # Bénéficiaire de chaque période déjà servie
+    servies = {periode: uid for uid, periode in tours}
+    # Périodes <= borne : hors de la fenêtre chargée, considérées comme servies.
+    # On planifie jusqu'à la période suivant la période courante pour connaître le prochain tour
+    a_planifier = [p for p in range(borne + 1, courante + 2) if p not in servies]
+    if not a_planifier:
+        return etat
+    attribution = {}
+    for cycle in sorted({(p - 1) // n for p in a_planifier}):
+        debut, fin = cycle * n + 1, (cycle + 1) * n
+        restants = {uid for _, uid in membres} - {uid for p, uid in servies.items() if debut <= p <= fin}
+        ordre = _ordre_cycle(tontine.mode_rotation, tontine.id, cycle, membres, restants, payes)
+        periodes = [p for p in a_planifier if debut <= p <= fin]
+        attribution.update(zip(periodes, ordre))
+    for periode in sorted(attribution):
+        if periode <= courante:
+            etat.tours_dus.append((periode, attribution[periode]))
+        elif etat.prochain_tour is None:
+            etat.prochain_tour = (periode, attribution[periode], date_periode(tontine.frequence, tontine.date_demarrage, periode))
+    return etat
+
+# --- Calcul ensembliste ---
+
+# Requêtes en nombre fixe, quel que soit le nombre de tontines (pas de requête par tontine)
+def planifier(db: Session, jour: Optional[date] = None, tontine_ids: Optional[Iterable[int]] = None,
+              rattrapage: bool = False) -> Dict[int, EtatRotation]:
+    jour = jour or date.today()
+    T, M, P, R = (models.Tontine.__table__, models.Membre.__table__,
+                  models.Paiement.__table__, models.Tour.__table__)
+    demarrees = select(T.c.id).where(T.c.date_demarrage <= jour)
+    if tontine_ids is not None:
+        demarrees = demarrees.where(T.c.id.in_(list(tontine_ids)))
+
+    tontines = db.execute(
+        select(T.c.id, T.c.frequence, T.c.mode_rotation, T.c.montant_cotisation, T.c.date_demarrage)
+        .where(T.c.id.in_(demarrees))
+    ).all()
+
+    membres = defaultdict(list)
+    for tid, position, uid in db.execute(
+        select(M.c.id_tontine, M.c.position, M.c.id_utilisateur)
+        .where(M.c.id_tontine.in_(demarrees))
+        .order_by(M.c.id_tontine, M.c.position)
+        .execution_options(yield_per=10000)
+    ):
+        membres[tid].append((position, uid))
+
+    # Seuls les tours du cycle en cours comptent : fenêtre ]max(periode) - nb membres, max(periode)].
+    # L'historique plus ancien n'est jamais relu, le coût reste stable quand les tours s'accumulent.
+    # Les périodes antérieures au premier tour ne sont pas rattrapées (tontine reprise en cours de route).
+    derniers = (
+        select(R.c.id_tontine, func.max(R.c.periode).label("derniere"), func.min(R.c.periode).label("premiere"))
+        .where(R.c.id_tontine.in_(demarrees))
+        .group_by(R.c.id_tontine)
+        .subquery()
+    )
+    effectifs = (
+        select(M.c.id_tontine, func.count(M.c.id).label("nombre"))
+        .where(M.c.id_tontine.in_(demarrees))
+        .group_by(M.c.id_tontine)
+        .subquery()
+    )
+    borne = func.coalesce(derniers.c.derniere, 0) - func.coalesce(effectifs.c.nombre, 0)
+    bornes = {}
+    tours = defaultdict(list)
+    for tid, uid, periode, b, premiere in db.execute(
+        select(derniers.c.id_tontine, R.c.id_utilisateur, R.c.periode, borne, derniers.c.premiere)
+        .select_from(derniers)
+        .outerjoin(effectifs, effectifs.c.id_tontine == derniers.c.id_tontine)
+        .join(R, (R.c.id_tontine == derniers.c.id_tontine) & (R.c.periode > borne))
+        .execution_options(yield_per=10000)
+    ):
+        tours[tid].append((uid, periode))
+        bornes[tid] = max(b, premiere - 1, 0)
+    # Périodes archivées : cycles clos, tous servis (leurs tours ont quitté la table chaude)
+    for tid, limite in archivage.limites(db, [t.id for t in tontines]).items():
+        bornes[tid] = max(bornes.get(tid, 0), limite)
+
+    payes = defaultdict(dict)
+    if any(t.mode_rotation == "priorité" for t in tontines):
+        prioritaires = demarrees.where(T.c.mode_rotation == "priorité")
+        for tid, uid, total in db.execute(
+            select(P.c.id_tontine, P.c.id_utilisateur, func.sum(P.c.montant))
+            .where(P.c.id_tontine.in_(prioritaires))
+            .group_by(P.c.id_tontine, P.c.id_utilisateur)
+        ):
+            payes[tid][uid] = int(total or 0)
+        # Cotisations des cycles archivés, cumulées par membre à l'archivage
+        for tid, cumuls in archivage.cotisations_archivees(db, [t.id for t in tontines if t.mode_rotation == "priorité"]).items():
+            for uid, montant in cumuls.items():
+                payes[tid][uid] = payes[tid].get(uid, 0) + montant
+
+    return {
+        t.id: _planifier_tontine(t, jour, membres.get(t.id, []), tours.get(t.id, []), payes.get(t.id, {}),
+                                 bornes.get(t.id), rattrapage)
+        for t in tontines
+    }
+
+def generer_tours(db: Session, jour: Optional[date] = None, dry_run: bool = False, rattrapage: bool = False) -> dict:
+    etats = planifier(db, jour, rattrapage=rattrapage)
+    lignes = [
+        {"id_tontine": e.id_tontine, "id_utilisateur": uid, "periode": periode, "montant_recu": e.montant_tour}
+        for e in etats.values() for periode, uid in e.tours_dus
+    ]
+    resume = {
+        "date": (jour or date.today()).isoformat(),
+        "tontines_actives": sum(1 for e in etats.values() if e.periode_courante > 0 and e.montant_tour > 0),
+        "tours_generes": len(lignes),
+        "dry_run": dry_run,
+        "rattrapage": rattrapage,
+    }
+    if dry_run or not lignes:
+        return resume
+
+    # Insertion multi-lignes puis mise à jour groupée des compteurs, dans une seule transaction.
+    # Deux passes concurrentes : l'index uq_tours_tontine_periode écarte les périodes déjà servies
+    inseres = db.execute(
+        insert(models.Tour.__table__).prefix_with("OR IGNORE", dialect="sqlite").prefix_with("IGNORE", dialect="mysql"),
+        lignes,
+    ).rowcount
+    deltas = defaultdict(lambda: [0, 0])
+    for ligne in lignes:
+        deltas[ligne["id_tontine"]][0] += ligne["montant_recu"]
+        deltas[ligne["id_tontine"]][1] += 1
+    if inseres is None or inseres < 0 or inseres != len(lignes):
+        # Périodes servies entre-temps (ou nombre inconnu) : compteurs relus depuis les tables brutes,
+        # événements laissés à la passe qui a inséré ces tours
+        statistiques.reconstruire_statistiques(db, list(deltas))
+        db.commit()
+        cache.invalider(*(cache.tag_tours(tid) for tid in deltas))
+        resume["tours_generes"] = max(inseres or 0, 0)
+        return resume
+    S = models.StatistiqueTontine.__table__
+    result = db.execute(
+        update(S)
+        .where(S.c.id_tontine == bindparam("tid"))
+        .values(total_distribue=S.c.total_distribue + bindparam("montant"),
+                tours_realises=S.c.tours_realises + bindparam("nombre")),
+        [{"tid": tid, "montant": montant, "nombre": nombre} for tid, (montant, nombre) in deltas.items()],
+    )
+    if result.rowcount is not None and 0 <= result.rowcount < len(deltas):
+        # Compteurs absents pour certaines tontines : reconstruction depuis les tables brutes
+        presentes = {tid for (tid,) in db.execute(select(S.c.id_tontine).where(S.c.id_tontine.in_(list(deltas))))}
+        manquantes = [tid for tid in deltas if tid not in presentes]
+        statistiques.reconstruire_statistiques(db, manquantes)
+    db.commit()
+    cache.invalider(*(cache.tag_tours(tid) for tid in deltas))
+    for ligne in lignes:
+        # Insertion sans RETURNING : événements sans id, le client relit la liste des tours s'il en a besoin
+        evenements.publier(ligne["id_tontine"], "tour", id_utilisateur=ligne["id_utilisateur"],
+                           periode=ligne["periode"], montant_recu=ligne["montant_recu"])
+    return resume
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Génère les tours échus de toutes les tontines actives")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Date de référence (AAAA-MM-JJ)")
+    parser.add_argument("--dry-run", action="store_true", help="Calculer sans insérer")
+    parser.add_argument("--rattrapage", action="store_true",
+                        help="Tontines sans aucun tour : générer aussi les cycles passés depuis la date de démarrage")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        resume = generer_tours(db, args.date, args.dry_run, args.rattrapage)
+    finally:
+        db.close()
+    print(f"✅ {resume['tours_generes']} tour(s) {'à générer' if args.dry_run else 'générés'} "
+          f"pour {resume['tontines_actives']} tontine(s) active(s) au {resume['date']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
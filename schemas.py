@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from datetime import date, datetime
-from typing import Optional
+from typing import List, Optional, Literal
 
 # --- Schémas Utilisateur ---
 class UtilisateurBase(BaseModel):
@@ -19,6 +19,9 @@ class Utilisateur(UtilisateurBase):
     class Config:
         from_attributes = True
 
+class UtilisateurRoleUpdate(BaseModel):
+    role: Literal["membre", "trésorier", "admin"]
+
 class UtilisateurLogin(BaseModel):
     telephone: str
     mot_de_passe: str
@@ -77,6 +80,21 @@ class Paiement(PaiementBase):
     class Config:
         from_attributes = True
 
+# Ligne d'un import groupé : le trésorier saisit le paiement pour le compte du membre
+class PaiementBatchItem(PaiementBase):
+    id_utilisateur: int
+
+class ResultatLignePaiement(BaseModel):
+    ligne: int
+    statut: Literal["ok", "erreur"]
+    erreur: Optional[str] = None
+
+class ResultatBatchPaiements(BaseModel):
+    total: int
+    inseres: int
+    rejetes: int
+    resultats: List[ResultatLignePaiement]
+
 # --- Schémas Tour ---
 class TourBase(BaseModel):
     id_tontine: int
@@ -102,6 +120,41 @@ class StatistiquesTontine(BaseModel):
     membres_actifs: int
     tours_realises: int
 
+# --- Tableau de bord ---
+class ProchainTour(BaseModel):
+    periode: int
+    date: date
+    id_utilisateur: Optional[int] = None
+    nom_utilisateur: Optional[str] = None
+
+class TontineTableauDeBord(BaseModel):
+    id: int
+    nom: str
+    frequence: str
+    mode_rotation: str
+    montant_cotisation: int
+    role: Literal["membre", "trésorier"]
+    position: Optional[int] = None
+    nombre_membres: int
+    nombre_max_membres: int
+    periode_courante: int
+    montant_paye_periode: int
+    a_jour: bool
+    total_paye: int
+    total_cotisations: int
+    total_distribue: int
+    prochain_tour: Optional[ProchainTour] = None
+
+class TotauxTableauDeBord(BaseModel):
+    nombre_tontines: int
+    tontines_en_retard: int
+    montant_en_retard: int
+    total_paye: int
+
+class TableauDeBord(BaseModel):
+    tontines: List[TontineTableauDeBord]
+    totaux: TotauxTableauDeBord
+
 # --- Authentification ---
 class Token(BaseModel):
     access_token: str
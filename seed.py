@@ -0,0 +1,142 @@
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+# Jeu de données synthétique reproductible : même graine + mêmes volumes = même base.
+# Exemple : DATABASE_URL=sqlite:///bench.db python seed.py --utilisateurs 5000 --tontines 500
+
+MOT_DE_PASSE = "motdepasse"
+FREQUENCES = ("journalier", "hebdomadaire", "mensuel")
+MODES = ("ordre", "aléatoire", "priorité")
+TAILLE_LOT = 5000
+
+def telephone(index: int) -> str:
+    return f"77{index:07d}"
+
+def _date_demarrage(frequence: str, jour: date, periodes: int) -> date:
+    # Démarrage choisi pour que la période courante soit exactement `periodes`
+    import scheduler
+    if frequence == "journalier":
+        return jour - timedelta(days=periodes - 1)
+    if frequence == "hebdomadaire":
+        return jour - timedelta(weeks=periodes - 1)
+    return scheduler._ajouter_mois(jour, -(periodes - 1))
+
+def _inserer(db, table, lignes):
+    from sqlalchemy import insert
+    for debut in range(0, len(lignes), TAILLE_LOT):
+        db.execute(insert(table), lignes[debut:debut + TAILLE_LOT])
+
+def generer(db, utilisateurs: int = 1000, tontines: int = 100, membres: int = 12, periodes: int = 12,
+            taux_paiement: float = 0.9, graine: int = 42, jour: date = None) -> dict:
+    import models
+    import statistiques
+    from hashing import pwd_context
+
+    rng = random.Random(graine)
+    jour = jour or date.today()
+    membres = min(membres, utilisateurs - 1)
+    # Un seul hachage bcrypt partagé : le coût de hachage ne doit pas dominer la génération
+    hash_commun = pwd_context.hash(MOT_DE_PASSE)
+    nb_tresoriers = max(1, tontines // 5)
+
+    # Index 0 : admin ; 1..nb_tresoriers : trésoriers ; le reste : membres
+    lignes_utilisateurs = [
+        {
+            "nom_utilisateur": f"utilisateur{i}",
+            "telephone": telephone(i),
+            "email": f"utilisateur{i}@exemple.com",
+            "mot_de_passe": hash_commun,
+            "role": "admin" if i == 0 else "trésorier" if i <= nb_tresoriers else "membre",
+        }
+        for i in range(utilisateurs)
+    ]
+    _inserer(db, models.Utilisateur.__table__, lignes_utilisateurs)
+    premier_id = db.query(models.Utilisateur.id).filter(models.Utilisateur.telephone == telephone(0)).scalar()
+    ids_utilisateurs = list(range(premier_id, premier_id + utilisateurs))
+    ids_tresoriers = ids_utilisateurs[1:nb_tresoriers + 1]
+
+    lignes_tontines = []
+    for i in range(tontines):
+        frequence = rng.choice(FREQUENCES)
+        lignes_tontines.append({
+            "nom": f"Tontine {i}",
+            "description": "Tontine générée pour les tests de charge",
+            "montant_cotisation": rng.randrange(1, 21) * 500,
+            "frequence": frequence,
+            "mode_rotation": rng.choice(MODES),
+            "id_tresorier": rng.choice(ids_tresoriers),
+            # Quelques places libres pour les scénarios d'adhésion
+            "nombre_max_membres": membres + rng.randrange(0, 4),
+            "date_demarrage": _date_demarrage(frequence, jour, periodes),
+        })
+    _inserer(db, models.Tontine.__table__, lignes_tontines)
+    premiere_tontine = db.query(models.Tontine.id).order_by(models.Tontine.id.desc()).limit(1).scalar() - tontines + 1
+
+    lignes_membres, lignes_paiements, lignes_tours = [], [], []
+    for i, ligne in enumerate(lignes_tontines):
+        tid = premiere_tontine + i
+        participants = rng.sample(ids_utilisateurs[1:], membres)
+        for position, uid in enumerate(participants, start=1):
+            lignes_membres.append({
+                "id_tontine": tid, "id_utilisateur": uid, "position": position,
+                "date_adhesion": ligne["date_demarrage"],
+            })
+        montant = ligne["montant_cotisation"]
+        for periode in range(1, periodes + 1):
+            for uid in participants:
+                if rng.random() < taux_paiement:
+                    lignes_paiements.append({"id_tontine": tid, "id_utilisateur": uid, "montant": montant, "periode": periode})
+            # Tours déjà servis, sauf la période courante laissée au planificateur
+            if periode < periodes:
+                lignes_tours.append({
+                    "id_tontine": tid, "id_utilisateur": participants[(periode - 1) % membres],
+                    "periode": periode, "montant_recu": montant * membres,
+                })
+    _inserer(db, models.Membre.__table__, lignes_membres)
+    _inserer(db, models.Paiement.__table__, lignes_paiements)
+    _inserer(db, models.Tour.__table__, lignes_tours)
+
+    statistiques.reconstruire_statistiques(db, list(range(premiere_tontine, premiere_tontine + tontines)))
+    db.commit()
+    return {
+        "utilisateurs": len(lignes_utilisateurs),
+        "tontines": len(lignes_tontines),
+        "membres": len(lignes_membres),
+        "paiements": len(lignes_paiements),
+        "tours": len(lignes_tours),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Génère un jeu de données synthétique reproductible")
+    parser.add_argument("--database-url", default=None, help="Base cible (défaut : DATABASE_URL), ex : sqlite:///bench.db")
+    parser.add_argument("--utilisateurs", type=int, default=1000)
+    parser.add_argument("--tontines", type=int, default=100)
+    parser.add_argument("--membres", type=int, default=12, help="Membres par tontine")
+    parser.add_argument("--periodes", type=int, default=12, help="Périodes écoulées par tontine")
+    parser.add_argument("--taux-paiement", type=float, default=0.9)
+    parser.add_argument("--graine", type=int, default=42)
+    args = parser.parse_args(argv)
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    # Imports différés : DATABASE_URL doit être fixée avant la création du moteur
+    import migrations
+    from database import SessionLocal
+    migrations.upgrade(verbose=False)
+    db = SessionLocal()
+    debut = time.perf_counter()
+    try:
+        volumes = generer(db, args.utilisateurs, args.tontines, args.membres, args.periodes,
+                          args.taux_paiement, args.graine)
+    finally:
+        db.close()
+    print("✅ " + ", ".join(f"{n} {nom}" for nom, n in volumes.items()) + f" en {time.perf_counter() - debut:.1f} s")
+    print(f"   Mot de passe commun : {MOT_DE_PASSE} (admin : {telephone(0)})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import os
+from typing import Callable, List, Sequence
+import orjson
+from fastapi import Request, Response
+from sqlalchemy.engine import Row
+import config
+import pagination
+
+# Chemin rapide des listes (opt-in) : les crud lisent seulement les colonnes du schéma de réponse, en tuples,
+# sans hydratation ORM ; les routes encodent ces lignes avec orjson sans validation pydantic par ligne.
+# Le JSON produit est identique à celui de response_model=List[schemas.X].
+FAST_LIST_RESPONSES = os.getenv("FAST_LIST_RESPONSES", "False").lower() in ("1", "true", "yes")
+
+# Colonnes du modèle dans l'ordre des champs du schéma : ordre des clés du JSON pydantic
+def champs(schema) -> List[str]:
+    return list(schema.model_fields)
+
+def colonnes(schema, modele) -> list:
+    return [getattr(modele, nom) for nom in schema.model_fields]
+
+def est_lignes(valeur) -> bool:
+    return isinstance(valeur, list) and bool(valeur) and isinstance(valeur[0], Row)
+
+# Lignes venant de la base (types déjà ceux du schéma) : datetime et date ISO 8601, comme pydantic
+def encoder(schema, lignes: Sequence[Row]) -> bytes:
+    noms = tuple(schema.model_fields)
+    return orjson.dumps([dict(zip(noms, ligne)) for ligne in lignes])
+
+# Remplace pagination.page dans les routes de liste : instances ORM rendues telles quelles (response_model),
+# lignes encodées directement. Les en-têtes de pagination sont reportés sur la réponse construite.
+def page(request: Request, response: Response, items: List, taille: int, cle: Callable, schema):
+    items = pagination.page(request, response, items, taille, cle)
+    if not est_lignes(items):
+        return items
+    en_tetes = {nom: response.headers[nom] for nom in (pagination.NEXT_CURSOR_HEADER, "Link") if nom in response.headers}
+    return Response(content=encoder(schema, items), media_type="application/json", headers=en_tetes)
@@ -0,0 +1,340 @@
+import argparse
+import functools
+import heapq
+import inspect as inspect_py
+import os
+import sys
+import threading
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Callable, List
+from sqlalchemy import Table, event, func, insert, inspect, select
+from sqlalchemy.ext import horizontal_shard
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Mapper, Session, sessionmaker
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+import config
+import database
+import models
+
+# Partitionnement des données de tontines sur DATABASE_SHARD_URLS, par hachage de l'id de tontine.
+# Tout ce qui appartient à une tontine (tontine, membres, paiements, tours, compteurs) vit sur le même shard ;
+# utilisateurs et idempotence restent dans la base globale (DATABASE_URL).
+#   DATABASE_SHARD_URLS=sqlite:///shard0.db,sqlite:///shard1.db python shards.py init
+#   DATABASE_SHARD_URLS=... python shards.py repartir   # copie une base existante vers les shards
+
+# Taille de la plage d'identifiants de chaque shard (membres, paiements, tours) : ids uniques sur tous les shards
+SHARD_ID_RANGE = int(os.getenv("SHARD_ID_RANGE", 100_000_000))
+TAILLE_LOT = 5000
+
+GLOBAL = "global"
+TABLES_SHARDEES = ("tontines", "statistiques_tontines", "membres", "paiements", "tours",
+                   "paiements_archive", "tours_archive", "archives_tontines", "cotisations_archivees")
+TABLES_A_PLAGE = ("membres", "paiements", "tours")
+
+
+def actif() -> bool:
+    return bool(database.DATABASE_SHARD_URLS)
+
+def noms_shards() -> List[str]:
+    return [f"shard{i}" for i in range(len(database.DATABASE_SHARD_URLS))]
+
+def shard_de(tontine_id: int) -> str:
+    # crc32 plutôt que hash() : stable d'un processus à l'autre
+    return f"shard{zlib.crc32(str(int(tontine_id)).encode()) % len(database.DATABASE_SHARD_URLS)}"
+
+# --- Analyse des requêtes ---
+
+def _est_cle_tontine(colonne) -> bool:
+    # tontines.id ou <table shardée>.id_tontine, y compris via un alias ou une colonne annotée par l'ORM
+    for base in getattr(colonne, "proxy_set", ()):
+        table = getattr(base, "table", None)
+        if isinstance(table, Table) and table.name in TABLES_SHARDEES:
+            if base.name == "id_tontine" or (table.name == "tontines" and base.name == "id"):
+                return True
+    return False
+
+def _conjonctions(clause):
+    if clause is None:
+        return []
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        return [c for sous_clause in clause.clauses for c in _conjonctions(sous_clause)]
+    return [clause]
+
+def _restrictions(clause):
+    # Conditions "clé de tontine = valeur" ou "clé de tontine IN (valeurs)" au premier niveau du WHERE
+    for condition in _conjonctions(clause):
+        if (isinstance(condition, BinaryExpression) and isinstance(condition.right, BindParameter)
+                and condition.operator in (operators.eq, operators.in_op) and _est_cle_tontine(condition.left)):
+            yield condition.right
+
+def _where(statement):
+    if statement.is_insert:
+        # INSERT ... SELECT : la restriction est portée par le SELECT
+        return getattr(statement.select, "whereclause", None)
+    return getattr(statement, "whereclause", None)
+
+def _ids_tontines(orm_context):
+    # Ids de tontines visés par la requête, ou None si elle n'est pas restreinte (envoi à tous les shards)
+    statement = orm_context.statement
+    for parametre in _restrictions(_where(statement)):
+        if parametre.value is not None:
+            return parametre.value if parametre.expanding else [parametre.value]
+        if isinstance(orm_context.parameters, dict) and parametre.key in orm_context.parameters:
+            valeur = orm_context.parameters[parametre.key]
+            return valeur if parametre.expanding else [valeur]
+    if statement.is_insert and isinstance(orm_context.parameters, dict):
+        cle = "id" if statement.table.name == "tontines" else "id_tontine"
+        if cle in orm_context.parameters:
+            return [orm_context.parameters[cle]]
+    return None
+
+def _cle_executemany(statement):
+    # Paramètre qui porte l'id de tontine dans un executemany (INSERT multi-lignes, UPDATE ... WHERE id_tontine = :tid)
+    if statement.is_insert:
+        return "id" if statement.table.name == "tontines" else "id_tontine"
+    for parametre in _restrictions(_where(statement)):
+        if parametre.value is None:
+            return parametre.key
+    return None
+
+def _tables(statement) -> set:
+    tables = {e.name for e in visitors.iterate(statement) if isinstance(e, Table)}
+    if getattr(statement, "table", None) is not None:
+        tables.add(statement.table.name)
+    return tables
+
+# --- Routage (SQLAlchemy horizontal_shard) ---
+
+def _shard_impose(orm_context) -> bool:
+    # Chargement paresseux ou rafraîchissement d'une instance connue : le shard est déjà fixé
+    if orm_context.is_select:
+        options = orm_context.load_options
+    elif orm_context.is_update or orm_context.is_delete:
+        options = orm_context.update_delete_options
+    else:
+        options = None
+    return ((options is not None and options._identity_token is not None)
+            or "_sa_shard_id" in orm_context.execution_options or "shard_id" in orm_context.bind_arguments)
+
+def _sur_shard(orm_context, shard: str):
+    orm_context.update_execution_options(identity_token=shard)
+    return orm_context.invoke_statement(bind_arguments={"shard_id": shard})
+
+def _executer(orm_context):
+    if _shard_impose(orm_context):
+        return horizontal_shard.execute_and_instances(orm_context)
+    statement = orm_context.statement
+    tables = _tables(statement)
+    shardees = tables & set(TABLES_SHARDEES)
+    if not shardees:
+        return _sur_shard(orm_context, GLOBAL)
+    if tables - shardees:
+        raise RuntimeError(f"Requête mêlant tables globales et shardées : {', '.join(sorted(tables))}")
+
+    if orm_context.is_executemany:
+        # Lignes réparties par shard : un executemany par shard concerné
+        cle = _cle_executemany(statement)
+        if cle is None:
+            raise RuntimeError("executemany sans id de tontine : impossible de choisir le shard")
+        lots = defaultdict(list)
+        for parametres in orm_context.parameters:
+            lots[shard_de(parametres[cle])].append(parametres)
+        resultats = [
+            orm_context.session.execute(statement, lot, execution_options=orm_context.local_execution_options,
+                                        bind_arguments={**orm_context.bind_arguments, "shard_id": shard})
+            for shard, lot in sorted(lots.items())
+        ]
+    else:
+        ids = _ids_tontines(orm_context)
+        if ids is None and statement.is_insert:
+            raise RuntimeError("INSERT sans id de tontine : impossible de choisir le shard")
+        cibles = sorted({shard_de(tid) for tid in ids}) if ids is not None else noms_shards()
+        # IN () : un seul shard suffit pour obtenir un résultat vide
+        resultats = [_sur_shard(orm_context, shard) for shard in cibles or noms_shards()[:1]]
+    return resultats[0] if len(resultats) == 1 else resultats[0].merge(*resultats[1:])
+
+def _choisir_shard(mapper, instance, clause=None, **kw):
+    if mapper.local_table.name not in TABLES_SHARDEES:
+        return GLOBAL
+    if instance is None:
+        # Connexion sans instance (dialecte) : tous les shards partagent le même moteur de base
+        return noms_shards()[0]
+    return shard_de(instance.id if isinstance(instance, models.Tontine) else instance.id_tontine)
+
+def _choisir_identite(mapper, primary_key, **kw):
+    nom = mapper.local_table.name
+    if nom not in TABLES_SHARDEES:
+        return [GLOBAL]
+    if nom in ("tontines", "statistiques_tontines", "archives_tontines", "cotisations_archivees"):
+        # Clé primaire commençant par l'id de tontine
+        return [shard_de(primary_key[0])]
+    # Plages d'ids disjointes : l'id ne se trouve que sur un shard, mais on ne sait pas lequel
+    return noms_shards()
+
+
+class SessionShardee(ShardedSession):
+    def __init__(self, **kwargs):
+        super().__init__(shard_chooser=_choisir_shard, identity_chooser=_choisir_identite,
+                         execute_chooser=lambda orm_context: noms_shards(), **kwargs)
+        # Routage maison : restriction sur l'id de tontine, executemany réparti, pas de fusion pour un seul shard
+        event.remove(self, "do_orm_execute", horizontal_shard.execute_and_instances)
+        event.listen(self, "do_orm_execute", _executer, retval=True)
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        if mapper is not None and not isinstance(mapper, Mapper):
+            mapper = inspect(mapper)
+        if shard_id is None and mapper is None and instance is None:
+            shard_id = noms_shards()[0]
+        return super().get_bind(mapper, shard_id=shard_id, instance=instance, clause=clause, **kw)
+
+# L'id d'une nouvelle tontine décide de son shard : il est alloué dans la base globale avant le flush
+@event.listens_for(SessionShardee, "before_flush")
+def _allouer_ids_tontines(session, flush_context, instances):
+    nouvelles = [obj for obj in session.new if isinstance(obj, models.Tontine) and obj.id is None]
+    if not nouvelles:
+        return
+    with database.get_engine().begin() as conn:
+        for tontine in nouvelles:
+            tontine.id = conn.execute(insert(models.SequenceTontine.__table__)).inserted_primary_key[0]
+
+def fabrique_sessions():
+    return sessionmaker(class_=SessionShardee, autocommit=False, autoflush=False,
+                        shards={GLOBAL: database.get_engine(), **database.get_shard_engines()})
+
+# --- Lectures réparties en parallèle ---
+
+_executor = None
+_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=len(database.DATABASE_SHARD_URLS), thread_name_prefix="shard")
+    return _executor
+
+def _sur_chaque_shard(fonction: Callable, *args, **kwargs) -> List[list]:
+    def executer(moteur):
+        db = Session(bind=moteur)
+        try:
+            return fonction(db, *args, **kwargs)
+        finally:
+            db.close()
+    # copy_context : les requêtes SQL des threads restent comptées dans les métriques de la requête HTTP
+    futures = [
+        _get_executor().submit(copy_context().run, executer, moteur)
+        for moteur in database.get_shard_engines().values()
+    ]
+    return [future.result() for future in futures]
+
+# Listes paginées sur toutes les tontines (hors shard connu) : une requête par shard en parallèle,
+# fusion triée par la clé de pagination puis coupe à `limit`. Sans shards, appel direct.
+def en_parallele(cle: Callable):
+    def decorateur(fonction):
+        signature = inspect_py.signature(fonction)
+
+        @functools.wraps(fonction)
+        def envelopper(db, *args, **kwargs):
+            if not actif():
+                return fonction(db, *args, **kwargs)
+            limit = signature.bind(db, *args, **kwargs).arguments.get("limit")
+            fusion = list(heapq.merge(*_sur_chaque_shard(fonction, *args, **kwargs), key=cle))
+            return fusion[:limit] if limit is not None else fusion
+        return envelopper
+    return decorateur
+
+# --- Administration ---
+
+def _creer_schema(conn):
+    existantes = set(inspect(conn).get_table_names())
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in TABLES_SHARDEES or table.name in existantes:
+            continue
+        # Pas de clé étrangère vers la base globale (utilisateurs) : elle est sur un autre serveur
+        conn.execute(CreateTable(table, include_foreign_key_constraints=[
+            fk for fk in table.foreign_key_constraints if fk.referred_table.name in TABLES_SHARDEES
+        ]))
+        for index in table.indexes:
+            conn.execute(CreateIndex(index))
+
+def _poser_plages(conn, numero: int):
+    debut = (numero + 1) * SHARD_ID_RANGE
+    for nom in TABLES_A_PLAGE:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT ?, 0 "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)", (nom, nom))
+            conn.exec_driver_sql("UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?", (debut, nom, debut))
+        elif conn.dialect.name == "mysql":
+            # Sans effet si la table contient déjà des ids plus grands
+            conn.exec_driver_sql(f"ALTER TABLE {nom} AUTO_INCREMENT = {debut + 1}")
+        else:
+            raise RuntimeError(f"Plages d'identifiants non prises en charge pour le dialecte {conn.dialect.name}")
+
+# Schéma des shards (tables de tontines seulement) et plages d'ids ; idempotent
+def initialiser():
+    import migrations
+    for numero, (nom, moteur) in enumerate(database.get_shard_engines().items()):
+        with moteur.begin() as conn:
+            _creer_schema(conn)
+            _poser_plages(conn, numero)
+            migrations._index_unique_paiements(conn)
+        print(f"✅ {nom} initialisé")
+
+# Copie les données de tontines de la base globale (base unique d'avant le sharding) vers les shards vides.
+# Les lignes d'origine ne sont pas supprimées : à purger une fois le basculement validé.
+def repartir() -> dict:
+    source = database.get_engine()
+    shards = database.get_shard_engines()
+    for nom, moteur in shards.items():
+        with moteur.connect() as conn:
+            if conn.execute(select(func.count()).select_from(models.Tontine.__table__)).scalar():
+                raise RuntimeError(f"{nom} contient déjà des tontines : répartition annulée")
+
+    volumes = {}
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in TABLES_SHARDEES:
+            continue
+        cle = "id" if table.name == "tontines" else "id_tontine"
+        volumes[table.name] = 0
+        with source.connect() as conn:
+            result = conn.execution_options(yield_per=TAILLE_LOT).execute(select(table).order_by(*table.primary_key))
+            for lot in result.partitions():
+                lignes = defaultdict(list)
+                for ligne in lot:
+                    lignes[shard_de(ligne._mapping[cle])].append(dict(ligne._mapping))
+                for nom, valeurs in lignes.items():
+                    with shards[nom].begin() as cible:
+                        cible.execute(insert(table), valeurs)
+                volumes[table.name] += len(lot)
+
+    # Les prochaines tontines reçoivent des ids au-delà des ids existants
+    with source.begin() as conn:
+        dernier = conn.execute(select(func.max(models.Tontine.id))).scalar()
+        sequence = models.SequenceTontine.__table__
+        if dernier and (conn.execute(select(func.max(sequence.c.id))).scalar() or 0) < dernier:
+            conn.execute(insert(sequence).values(id=dernier))
+    return volumes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shards des données de tontines (DATABASE_SHARD_URLS)")
+    parser.add_argument("commande", choices=["init", "repartir"])
+    args = parser.parse_args(argv)
+    if not actif():
+        print("❌ DATABASE_SHARD_URLS n'est pas définie")
+        return 1
+    initialiser()
+    if args.commande == "repartir":
+        volumes = repartir()
+        print("✅ " + ", ".join(f"{n} {nom}" for nom, n in volumes.items()) + " répartis sur "
+              f"{len(database.DATABASE_SHARD_URLS)} shard(s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from datetime import date
+from typing import Dict, List, Optional
+import numpy as np
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+import archivage
+import config
+import models
+import scheduler
+
+# Matrice membres × périodes des cotisations. Relire tous les paiements de la fenêtre à chaque appel coûtait
+# ~0,6 s pour 490 000 paiements sur SQLite (lecture du curseur par le pilote, le calcul NumPy et l'encodage
+# restant sous 50 ms). Les cumuls (membre, période) de chaque tontine sont donc gardés en mémoire du processus
+# et complétés à chaque appel par les seuls paiements d'id supérieur au dernier cumulé (index (id_tontine, id)).
+# Les paiements ne sont jamais modifiés ; l'archivage les déplace avec leur id, déjà cumulé.
+
+# Tontines dont les cumuls restent en mémoire (éviction LRU au-delà)
+SITUATION_CACHE_TONTINES = int(os.getenv("SITUATION_CACHE_TONTINES", 256))
+# Délai (s) avant de figer dans les cumuls les paiements lus : un id plus petit encore en transaction reste
+# relu jusque-là. Doit dépasser la plus longue transaction d'écriture de paiements (import groupé compris)
+# augmentée du retard des réplicas de lecture
+SITUATION_CONSOLIDATION_SECONDS = float(os.getenv("SITUATION_CONSOLIDATION_SECONDS", 10))
+
+# Paiement lu sur le curseur : une ligne de tableau structuré, sans objet Row ni tuple conservé
+_PAIEMENT = np.dtype([("id", np.int64), ("id_tontine", np.int64), ("id_utilisateur", np.int64),
+                      ("periode", np.int64), ("montant", np.int64)])
+
+
+# Cumuls (payeur, période) des paiements d'id <= jusqu_a d'une tontine
+class _Cumuls:
+    def __init__(self):
+        self.uids = np.zeros(0, dtype=np.int64)       # payeurs connus, triés
+        self.lignes = np.zeros(0, dtype=np.int64)     # ligne de `payes` de chaque payeur de `uids`
+        self.premiere_periode = 1
+        self.payes = np.zeros((0, 0), dtype=np.int64)
+        self.jusqu_a = 0
+        self.lectures = deque()                       # (instant, plus grand id lu) des lectures pas encore figées
+        self.lock = threading.Lock()
+
+    def _rangs(self, uids: np.ndarray):
+        # Ligne de chaque payeur (recherche vectorisée) et masque des payeurs connus
+        if not len(self.uids):
+            return np.zeros(len(uids), dtype=np.int64), np.zeros(len(uids), dtype=bool)
+        rang = np.minimum(np.searchsorted(self.uids, uids), len(self.uids) - 1)
+        return self.lignes[rang], self.uids[rang] == uids
+
+    def ajouter(self, paiements: np.ndarray):
+        if not len(paiements):
+            return
+        nouveaux = np.setdiff1d(paiements["id_utilisateur"], self.uids)
+        uids = np.concatenate([self.uids, nouveaux])
+        lignes = np.concatenate([self.lignes, np.arange(len(self.uids), len(uids))])
+        ordre = np.argsort(uids, kind="stable")
+        self.uids, self.lignes = uids[ordre], lignes[ordre]
+
+        debut = min(self.premiere_periode, int(paiements["periode"].min()))
+        fin = max(self.premiere_periode + self.payes.shape[1] - 1, int(paiements["periode"].max()))
+        if (len(uids), fin - debut + 1) != self.payes.shape:
+            payes = np.zeros((len(uids), fin - debut + 1), dtype=np.int64)
+            decalage = self.premiere_periode - debut
+            payes[:self.payes.shape[0], decalage:decalage + self.payes.shape[1]] = self.payes
+            self.payes, self.premiere_periode = payes, debut
+        rangs, _ = self._rangs(paiements["id_utilisateur"])
+        np.add.at(self.payes, (rangs, paiements["periode"] - debut), paiements["montant"])
+
+    # Matrice membres × [periode_min, periode_max] ; `recents` : paiements lus mais pas encore figés
+    def fenetre(self, uids: np.ndarray, periode_min: int, periode_max: int, recents: np.ndarray) -> np.ndarray:
+        payes = np.zeros((len(uids), max(periode_max - periode_min + 1, 0)), dtype=np.int64)
+        debut = max(periode_min, self.premiere_periode)
+        fin = min(periode_max, self.premiere_periode + self.payes.shape[1] - 1)
+        if len(uids) and debut <= fin:
+            rangs, connus = self._rangs(uids)
+            payes[connus, debut - periode_min:fin - periode_min + 1] = (
+                self.payes[rangs[connus], debut - self.premiere_periode:fin - self.premiere_periode + 1]
+            )
+        if len(recents) and len(uids) and payes.shape[1]:
+            # Paiements d'anciens membres ou hors fenêtre ignorés
+            ordre = np.argsort(uids)
+            rang = np.minimum(np.searchsorted(uids[ordre], recents["id_utilisateur"]), len(uids) - 1)
+            gardes = ((uids[ordre][rang] == recents["id_utilisateur"])
+                      & (recents["periode"] >= periode_min) & (recents["periode"] <= periode_max))
+            np.add.at(payes, (ordre[rang[gardes]], recents["periode"][gardes] - periode_min), recents["montant"][gardes])
+        return payes
+
+    # Fige les paiements d'id au plus égal à celui vu par une lecture terminée depuis plus du délai :
+    # les ids inférieurs, alloués avant, étaient validés au début de la lecture `lus` (commencée à `debut`)
+    def consolider(self, lus: np.ndarray, debut: float, fin: float) -> np.ndarray:
+        lus = lus[lus["id"] > self.jusqu_a]
+        self.lectures.append((fin, int(lus["id"].max()) if len(lus) else self.jusqu_a))
+        seuil = self.jusqu_a
+        while self.lectures and self.lectures[0][0] <= debut - SITUATION_CONSOLIDATION_SECONDS:
+            seuil = max(seuil, self.lectures.popleft()[1])
+        figes = lus["id"] <= seuil
+        self.ajouter(lus[figes])
+        self.jusqu_a = seuil
+        return lus[~figes]
+
+
+_cumuls = OrderedDict()
+_cumuls_lock = threading.Lock()
+
+def _cumuls_de(tontine: models.Tontine) -> _Cumuls:
+    # date_creation dans la clé : un id de tontine supprimée puis réattribué repart de zéro
+    cle = (tontine.id, tontine.date_creation)
+    with _cumuls_lock:
+        cumuls = _cumuls.get(cle)
+        if cumuls is None:
+            cumuls = _cumuls[cle] = _Cumuls()
+            while len(_cumuls) > SITUATION_CACHE_TONTINES:
+                _cumuls.popitem(last=False)
+        _cumuls.move_to_end(cle)
+        return cumuls
+
+def _charger(db: Session, tontines: List[models.Tontine]):
+    P, M = models.Paiement.__table__, models.Membre.__table__
+    tontine_ids = [t.id for t in tontines]
+    membres = defaultdict(list)
+    for tid, uid, position in db.execute(
+        select(M.c.id_tontine, M.c.id_utilisateur, M.c.position)
+        .where(M.c.id_tontine.in_(tontine_ids))
+        .order_by(M.c.id_tontine, M.c.position)
+    ):
+        membres[tid].append((uid, position))
+
+    cumuls = {t.id: _cumuls_de(t) for t in tontines}
+    # Tontine archivée : un paiement tardif a pu passer à l'archive avant d'être cumulé, l'archive est réunie
+    if archivage.limites(db, tontine_ids):
+        P = archivage.union(models.Paiement, lambda table: (table.c.id_tontine.in_(tontine_ids),))
+    # Paiements d'id supérieur au dernier cumulé, lus directement sur le curseur DBAPI
+    debut = time.monotonic()
+    result = db.execute(
+        select(P.c.id, P.c.id_tontine, P.c.id_utilisateur, P.c.periode, P.c.montant)
+        .where(or_(*(and_(P.c.id_tontine == tid, P.c.id > c.jusqu_a) for tid, c in cumuls.items())))
+    )
+    try:
+        lus = np.fromiter(result.cursor, dtype=_PAIEMENT)
+    finally:
+        result.close()
+    lectures = (debut, time.monotonic())
+    lus = lus[np.argsort(lus["id_tontine"], kind="stable")]
+    tids, debuts = np.unique(lus["id_tontine"], return_index=True)
+    return membres, cumuls, dict(zip(tids.tolist(), np.split(lus, debuts[1:]))), lectures
+
+def _matrice(tontine, membres, cumuls: _Cumuls, lus, lectures, periode_min: int, periode_max: int, detail: bool) -> dict:
+    nb_periodes = max(periode_max - periode_min + 1, 0)
+    uids = np.array([uid for uid, _ in membres], dtype=np.int64)
+    with cumuls.lock:
+        recents = cumuls.consolider(lus, *lectures)
+        payes = cumuls.fenetre(uids, periode_min, periode_max, recents)
+
+    du = tontine.montant_cotisation
+    arrieres = np.clip(du - payes, 0, None)
+    total_payes = payes.sum(axis=1)
+    total_arrieres = arrieres.sum(axis=1)
+    # Solde final sans le cumul période par période, calculé seulement pour le détail
+    solde = total_payes - du * nb_periodes
+    periodes_impayees = (payes == 0).sum(axis=1)
+
+    solde_cumule = np.cumsum(payes - du, axis=1) if detail else None
+    lignes = []
+    for i, (uid, position) in enumerate(membres):
+        ligne = {
+            "id_utilisateur": uid,
+            "position": position,
+            "total_paye": int(total_payes[i]),
+            "total_arrieres": int(total_arrieres[i]),
+            "solde": int(solde[i]),
+            "periodes_impayees": int(periodes_impayees[i]),
+        }
+        if detail:
+            # Lignes NumPy contiguës : sérialisées directement par orjson (OPT_SERIALIZE_NUMPY)
+            ligne["payes"] = payes[i]
+            ligne["arrieres"] = arrieres[i]
+            ligne["solde_cumule"] = solde_cumule[i]
+        lignes.append(ligne)
+
+    return {
+        "id_tontine": tontine.id,
+        "montant_cotisation": du,
+        "periode_min": periode_min,
+        "periode_max": periode_max,
+        "total_paye": int(total_payes.sum()),
+        "total_arrieres": int(total_arrieres.sum()),
+        "membres": lignes,
+    }
+
+def situation_tontines(db: Session, tontines: List[models.Tontine], jour: Optional[date] = None,
+                       periode_min: int = 1, periode_max: Optional[int] = None, detail: bool = True) -> Dict[int, dict]:
+    # Bornes par tontine : de periode_min à la période courante (ou periode_max si fourni)
+    jour = jour or date.today()
+    bornes = {
+        t.id: (periode_min, periode_max if periode_max is not None
+               else scheduler.periode_courante(t.frequence, t.date_demarrage, jour))
+        for t in tontines
+    }
+    if not bornes:
+        return {}
+    membres, cumuls, lus, lectures = _charger(db, tontines)
+    return {
+        t.id: _matrice(t, membres.get(t.id, []), cumuls[t.id], lus.get(t.id, np.zeros(0, dtype=_PAIEMENT)),
+                       lectures, *bornes[t.id], detail)
+        for t in tontines
+    }
@@ -0,0 +1,108 @@
+import argparse
+import sys
+from typing import Dict, List, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import archivage
+import models
+
+COMPTEURS = ("total_cotisations", "total_distribue", "membres_actifs", "tours_realises")
+
+# Recalcule les compteurs depuis les tables brutes (paiements, tours, membres), en requêtes groupées
+def calculer_statistiques(db: Session, tontine_ids: Optional[List[int]] = None) -> Dict[int, dict]:
+    def filtrer(query, colonne):
+        return query.filter(colonne.in_(tontine_ids)) if tontine_ids is not None else query
+
+    ids = filtrer(db.query(models.Tontine.id), models.Tontine.id).all()
+    resultats = {tid: dict.fromkeys(COMPTEURS, 0) for (tid,) in ids}
+
+    # Cycles archivés compris : les compteurs couvrent tout l'historique
+    def historique(modele):
+        return archivage.union(modele, lambda table: [table.c.id_tontine.in_(tontine_ids)] if tontine_ids is not None else [])
+
+    P = historique(models.Paiement)
+    cotisations = db.query(P.c.id_tontine, func.sum(P.c.montant)).group_by(P.c.id_tontine)
+    for tid, total in cotisations:
+        if tid in resultats:
+            resultats[tid]["total_cotisations"] = int(total or 0)
+
+    R = historique(models.Tour)
+    tours = db.query(R.c.id_tontine, func.sum(R.c.montant_recu), func.count(R.c.id)).group_by(R.c.id_tontine)
+    for tid, total, nombre in tours:
+        if tid in resultats:
+            resultats[tid]["total_distribue"] = int(total or 0)
+            resultats[tid]["tours_realises"] = nombre
+
+    membres = filtrer(
+        db.query(models.Membre.id_tontine, func.count(models.Membre.id)),
+        models.Membre.id_tontine
+    ).group_by(models.Membre.id_tontine)
+    for tid, nombre in membres:
+        if tid in resultats:
+            resultats[tid]["membres_actifs"] = nombre
+
+    return resultats
+
+def _charger_compteurs(db: Session, tontine_ids: Optional[List[int]]):
+    query = db.query(models.StatistiqueTontine)
+    if tontine_ids is not None:
+        query = query.filter(models.StatistiqueTontine.id_tontine.in_(tontine_ids))
+    return {s.id_tontine: s for s in query}
+
+# Écrase les compteurs stockés par les valeurs recalculées (sans commit)
+def reconstruire_statistiques(db: Session, tontine_ids: Optional[List[int]] = None) -> Dict[int, dict]:
+    calculees = calculer_statistiques(db, tontine_ids)
+    existantes = _charger_compteurs(db, tontine_ids)
+    for tid, valeurs in calculees.items():
+        stat = existantes.get(tid)
+        if stat is None:
+            db.add(models.StatistiqueTontine(id_tontine=tid, **valeurs))
+        else:
+            for cle, valeur in valeurs.items():
+                setattr(stat, cle, valeur)
+    db.flush()
+    return calculees
+
+# Compare les compteurs stockés aux tables brutes : {id_tontine: {compteur: (stocké, attendu)}}
+def verifier_statistiques(db: Session, tontine_ids: Optional[List[int]] = None) -> Dict[int, dict]:
+    calculees = calculer_statistiques(db, tontine_ids)
+    stockees = _charger_compteurs(db, tontine_ids)
+    derives = {}
+    for tid, valeurs in calculees.items():
+        stat = stockees.get(tid)
+        ecarts = {
+            cle: (getattr(stat, cle) if stat is not None else None, attendu)
+            for cle, attendu in valeurs.items()
+            if stat is None or getattr(stat, cle) != attendu
+        }
+        if ecarts:
+            derives[tid] = ecarts
+    return derives
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compteurs de statistiques des tontines")
+    parser.add_argument("commande", choices=["verify", "rebuild"])
+    parser.add_argument("--tontine", type=int, action="append", help="Limiter à une tontine (répétable)")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        if args.commande == "rebuild":
+            calculees = reconstruire_statistiques(db, args.tontine)
+            db.commit()
+            print(f"✅ Compteurs reconstruits pour {len(calculees)} tontine(s)")
+            return 0
+        derives = verifier_statistiques(db, args.tontine)
+        for tid, ecarts in derives.items():
+            details = ", ".join(f"{cle}: {stocke} au lieu de {attendu}" for cle, (stocke, attendu) in ecarts.items())
+            print(f"❌ Tontine {tid} : {details}")
+        if derives:
+            return 1
+        print("✅ Aucun écart détecté")
+        return 0
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+# Configuration minimale avant tout import de l'application (config.py lit l'environnement à l'import)
+_DOSSIER = tempfile.mkdtemp(prefix="tontine-tests-")
+os.environ.setdefault("SECRET_KEY", "cle-de-test-" + "x" * 32)
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_DOSSIER}/application.db")
+
+import pytest
+from sqlalchemy import create_engine, insert
+
+import migrations
+import models
+
+
+# Base SQLite neuve par test, schéma posé par les migrations (comme en production)
+@pytest.fixture
+def moteur(tmp_path):
+    moteur = create_engine(f"sqlite:///{tmp_path}/tontine.db", connect_args={"timeout": 30})
+    migrations.upgrade(moteur, verbose=False)
+    yield moteur
+    moteur.dispose()
+
+
+def creer_utilisateurs(moteur, nombre: int, role: str = "membre"):
+    with moteur.begin() as conn:
+        conn.execute(insert(models.Utilisateur.__table__), [
+            {"nom_utilisateur": f"utilisateur{i}", "telephone": f"77{i:07d}", "email": f"utilisateur{i}@exemple.com",
+             "mot_de_passe": "-", "role": role} for i in range(1, nombre + 1)
+        ])
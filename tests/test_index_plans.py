@@ -0,0 +1,19 @@
+import pytest
+
+import migrations
+
+# Tables volumineuses : aucune requête critique de crud.py ne doit les parcourir en entier
+TABLES_SURVEILLEES = {"paiements", "tours", "membres", "tontines"}
+
+REQUETES = migrations.requetes_critiques()
+
+
+def _table(scan: str) -> str:
+    # SQLite : "SCAN paiements" / "SEARCH paiements USING INTEGER PRIMARY KEY (rowid>?)" ; MySQL : "paiements: type=ALL"
+    return scan.split()[1] if scan.startswith(("SCAN ", "SEARCH ")) else scan.split(":")[0]
+
+
+@pytest.mark.parametrize("appel", [appel for _, appel in REQUETES], ids=[nom for nom, _ in REQUETES])
+def test_requete_indexee(moteur, appel):
+    scans = migrations.scans_complets(moteur, appel)
+    assert not [scan for scan in scans if _table(scan) in TABLES_SURVEILLEES], scans
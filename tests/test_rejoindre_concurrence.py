@@ -0,0 +1,57 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import crud
+import models
+import schemas
+import statistiques
+from conftest import creer_utilisateurs
+
+CANDIDATS = 300
+DOUBLONS = 50
+THREADS = 32
+
+
+def _creer_tontine(moteur, capacite: int) -> int:
+    with Session(bind=moteur) as db:
+        return crud.create_tontine(db, schemas.TontineCreate(
+            nom="Adhésions simultanées", montant_cotisation=1000, frequence="mensuel", mode_rotation="ordre",
+            nombre_max_membres=capacite, date_demarrage=date.today()), 1).id
+
+
+def _rejoindre_en_parallele(moteur, tontine_id: int, demandes):
+    def rejoindre(utilisateur_id: int):
+        with Session(bind=moteur) as db:
+            return crud.rejoindre_tontine(db, tontine_id, utilisateur_id, date.today())[1]
+    with ThreadPoolExecutor(THREADS) as pool:
+        return list(pool.map(rejoindre, demandes))
+
+
+@pytest.mark.parametrize("capacite", [50, CANDIDATS])
+def test_adhesions_simultanees(moteur, capacite):
+    creer_utilisateurs(moteur, CANDIDATS)
+    tontine_id = _creer_tontine(moteur, capacite)
+    # Chaque candidat une fois, une partie deux fois (double clic), dans le désordre
+    demandes = list(range(1, CANDIDATS + 1)) + list(range(1, DOUBLONS + 1))
+    random.Random(capacite).shuffle(demandes)
+
+    erreurs = _rejoindre_en_parallele(moteur, tontine_id, demandes)
+
+    M = models.Membre.__table__
+    with Session(bind=moteur) as db:
+        lignes = db.execute(select(M.c.id_utilisateur, M.c.position).where(M.c.id_tontine == tontine_id)).all()
+        nombre = db.execute(select(func.count()).select_from(M).where(M.c.id_tontine == tontine_id)).scalar()
+        derives = statistiques.verifier_statistiques(db, [tontine_id])
+
+    attendus = min(capacite, CANDIDATS)
+    assert nombre == attendus
+    assert sorted(position for _, position in lignes) == list(range(1, attendus + 1))
+    assert len({uid for uid, _ in lignes}) == len(lignes)
+    assert not derives
+    assert erreurs.count(None) == attendus
+    assert set(erreurs) <= {None, "complete", "deja_membre"}